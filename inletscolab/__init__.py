@@ -1,7 +1,14 @@
-from . import config
-from . import inlets
-from . import server
-from . import client
+import importlib
 
-from .client import InletsColab
-from . import cmd
\ No newline at end of file
+""" Submodules are imported on first access, so `import inletscolab` stays cheap """
+
+__all__ = ['profiler', 'config', 'logs', 'probes', 'state', 'budgets', 'mounts', 'inlets', 'server', 'services', 'pool', 'extensions', 'cache', 'readcache', 'backup', 'snapshot', 'proxy', 'orchestrator', 'supervisor', 'metrics', 'watchdog', 'endpoints', 'bench', 'client', 'aio', 'cmd', 'InletsColab', 'AsyncInletsColab']
+
+def __getattr__(name: str):
+    if name == 'InletsColab': return importlib.import_module('.client', __name__).InletsColab
+    if name == 'AsyncInletsColab': return importlib.import_module('.aio', __name__).AsyncInletsColab
+    if name in __all__: return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__():
+    return __all__
@@ -0,0 +1,114 @@
+import time
+import asyncio
+import functools
+from urllib.parse import urlparse
+from lazycls.types import *
+from inletscolab.config import ServerConfig, logger, DebugEnabled
+from inletscolab.client import InletsColab
+from inletscolab.inlets import Inlets
+from inletscolab.server import Server
+from inletscolab.probes import Probe
+
+""" Asyncio API for running InletsColab inside an existing event loop, such as Jupyter's """
+
+
+class AsyncProbe:
+
+    @classmethod
+    async def tcp(cls, host: str, port: int, timeout: float = 1.0):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), timeout)
+        except (OSError, asyncio.TimeoutError): return False
+        writer.close()
+        return True
+
+    @classmethod
+    async def http(cls, url: str, timeout: float = 2.0):
+        """ Any response below 500 counts, matching Probe.http """
+        u = urlparse(url)
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(u.hostname, u.port or 80), timeout)
+            try:
+                writer.write(f'GET {u.path or "/"} HTTP/1.1\r\nHost: {u.netloc}\r\nConnection: close\r\n\r\n'.encode())
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), timeout)
+            finally: writer.close()
+            return int(line.split()[1]) < 500
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError): return False
+
+    @classmethod
+    async def wait_for(cls, check: Callable[[], Any], timeout: float = 120.0, name: str = 'probe', **kwargs):
+        """ Awaits `check` with exponential backoff until it passes, returning the elapsed seconds """
+        start = time.perf_counter()
+        deadline = start + timeout
+        for delay in Probe.backoff(**kwargs):
+            if await check():
+                elapsed = time.perf_counter() - start
+                if DebugEnabled: logger.info(f'{name} ready in {elapsed:.2f}s')
+                return elapsed
+            now = time.perf_counter()
+            if now >= deadline: break
+            await asyncio.sleep(min(delay, deadline - now))
+        raise TimeoutError(f'{name} was not ready after {timeout:.1f}s')
+
+
+class AsyncInletsColab:
+    """
+    Mirrors InletsColab with awaitables. Installers and mounts still run the same synchronous steps,
+    but in the loop's executor, so the kernel stays responsive while they do. Readiness is awaited natively.
+    The Server always runs in the background, since a foreground Server would block the loop.
+    """
+
+    @classmethod
+    async def run_sync(cls, func: Callable, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    @classmethod
+    async def setup_storage(cls, **kwargs):
+        return await cls.run_sync(InletsColab.setup_storage, **kwargs)
+
+    @classmethod
+    async def start(cls, wait_ready: bool = True, ready_timeout: float = 120.0, **kwargs) -> Dict[str, Any]:
+        """ Accepts the arguments of InletsColab.start, returning the status once started, and ready with `wait_ready` """
+        kwargs.update(server_background = True, wait_ready = False)
+        await cls.run_sync(InletsColab.start, **kwargs)
+        if wait_ready: await cls.wait_ready(timeout=ready_timeout)
+        return await cls.status()
+
+    @classmethod
+    async def wait_server(cls, timeout: float = 120.0) -> float:
+        start = time.perf_counter()
+        await AsyncProbe.wait_for(lambda: AsyncProbe.tcp(ServerConfig.host, ServerConfig.port), timeout=timeout, name=f'tcp://{ServerConfig.host}:{ServerConfig.port}')
+        await AsyncProbe.wait_for(lambda: AsyncProbe.http(ServerConfig.local_url), timeout=max(timeout - (time.perf_counter() - start), 1.0), name=ServerConfig.local_url)
+        Server.ready_time = time.perf_counter() - start
+        logger.info(f'Server is ready at {ServerConfig.local_url} after {Server.ready_time:.2f}s')
+        return Server.ready_time
+
+    @classmethod
+    async def wait_inlets(cls, timeout: float = 120.0) -> Optional[float]:
+        if Inlets.svc or not Inlets.d:
+            logger.warn('Tunnel readiness can only be detected for the inlets client process')
+            return None
+        if not Inlets.watcher:
+            logger.info('Inlets Tunnel was connected by an earlier start')
+            return Inlets.ready_time
+        watcher = Inlets.watcher
+
+        async def check(): return watcher.check()
+        Inlets.ready_time = await AsyncProbe.wait_for(check, timeout=timeout, name='Inlets Tunnel')
+        logger.info(f'Inlets Tunnel is connected after {Inlets.ready_time:.2f}s')
+        return Inlets.ready_time
+
+    @classmethod
+    async def wait_ready(cls, timeout: float = 120.0) -> Dict[str, float]:
+        """ Waits for the Server and the tunnel concurrently, returning the time to ready of each """
+        await asyncio.gather(cls.wait_server(timeout=timeout), cls.wait_inlets(timeout=timeout))
+        return InletsColab.ready_times()
+
+    @classmethod
+    async def status(cls) -> Dict[str, Any]:
+        return await cls.run_sync(InletsColab.status)
+
+    @classmethod
+    async def stop(cls):
+        return await cls.run_sync(InletsColab.stop)
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lazycls.types import *
+from lazycls.io import Path
+from inletscolab.config import BackupConfig, StorageConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler
+
+""" Incremental, Chunked Workspace Backup to STORAGE_BACKUP """
+
+class LocalBackend:
+    """ A directory, which may be a mounted bucket """
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str):
+        return os.path.join(self.root, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put(self, key: str, data: bytes):
+        p = self.path(key)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        tmp = f'{p}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f: f.write(data)
+        os.replace(tmp, p)
+
+    def get(self, key: str) -> bytes:
+        with open(self.path(key), 'rb') as f: return f.read()
+
+    def __repr__(self):
+        return f'<LocalBackend {self.root}>'
+
+
+class S3Backend:
+    """ S3 or an S3-compatible store such as Minio. Requires boto3 """
+    def __init__(self, bucket: str, prefix: str = ''):
+        try: import boto3
+        except ImportError as e: raise ImportError('An s3:// STORAGE_BACKUP requires boto3. Install it with `pip install boto3`') from e
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        endpoint = StorageConfig.minio_endpoint or None
+        key_id = StorageConfig.minio_key_id if endpoint else StorageConfig.s3_key_id
+        secret = StorageConfig.minio_secret if endpoint else StorageConfig.s3_secret
+        self.client = boto3.client('s3', endpoint_url=endpoint, region_name=StorageConfig.s3_region, aws_access_key_id=key_id or None, aws_secret_access_key=secret or None)
+
+    def key(self, key: str):
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def exists(self, key: str) -> bool:
+        try: self.client.head_object(Bucket=self.bucket, Key=self.key(key))
+        except self.client.exceptions.ClientError: return False
+        return True
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self.key(key), Body=data)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(key))['Body'].read()
+
+    def __repr__(self):
+        return f'<S3Backend s3://{self.bucket}/{self.prefix}>'
+
+
+class Backup:
+    """
+    Files are split into fixed-size chunks stored by their sha256 under chunks/, so unchanged
+    chunks are never uploaded twice. Each run writes a manifest of files to chunks, and only
+    files whose size or mtime changed since the last run are read and hashed again.
+    """
+    index: Dict[str, Any] = None
+    thread: threading.Thread = None
+    _stop = threading.Event()
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_backend(cls, target: str = None):
+        target = target or BackupConfig.target
+        if not target: raise ValueError('STORAGE_BACKUP is not set')
+        if target.startswith('s3://'):
+            bucket, _, prefix = target[5:].partition('/')
+            return S3Backend(bucket, prefix)
+        if target.startswith('file://'): target = target[7:]
+        return LocalBackend(target)
+
+    @classmethod
+    def load_index(cls):
+        with cls._lock:
+            if cls.index is not None: return cls.index
+            cls.index = {'files': {}, 'chunks': []}
+            p = BackupConfig.index_file
+            if p.exists():
+                try: cls.index = json.loads(p.read_text())
+                except ValueError: logger.warn(f'Backup Index at {p.string} is corrupt. Files will be rehashed.')
+            return cls.index
+
+    @classmethod
+    def save_index(cls):
+        with cls._lock:
+            p = BackupConfig.index_file
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.parent.joinpath('index.json.tmp')
+            tmp.write_text(json.dumps(cls.index))
+            os.replace(tmp.string, p.string)
+
+    @classmethod
+    def is_excluded(cls, rel: str, name: str):
+        return any(fnmatch.fnmatch(rel, pat) or fnmatch.fnmatch(name, pat) for pat in BackupConfig.exclude)
+
+    @classmethod
+    def scan(cls, source: str = None) -> Dict[str, os.stat_result]:
+        """ Walks the source with scandir, skipping excluded paths and other mounts such as buckets and Drive """
+        source = source or BackupConfig.source
+        files, stack = {}, [source]
+        while stack:
+            d = stack.pop()
+            try: it = os.scandir(d)
+            except OSError: continue
+            with it:
+                for e in it:
+                    rel = os.path.relpath(e.path, source)
+                    if cls.is_excluded(rel, e.name): continue
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            if not os.path.ismount(e.path): stack.append(e.path)
+                        elif e.is_file(follow_symlinks=False): files[rel] = e.stat(follow_symlinks=False)
+                    except OSError: continue
+        return files
+
+    @classmethod
+    def chunk_key(cls, digest: str):
+        return f'chunks/{digest[:2]}/{digest}'
+
+    @classmethod
+    def upload_file(cls, backend, path: str, known: set) -> Tuple[List[str], int]:
+        """ Hashes the file chunk by chunk, uploading chunks the backend doesn't have. Returns the digests and bytes sent """
+        digests, sent = [], 0
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(BackupConfig.chunk_size), b''):
+                digest = hashlib.sha256(data).hexdigest()
+                digests.append(digest)
+                with cls._lock:
+                    if digest in known: continue
+                    known.add(digest)
+                try: backend.put(cls.chunk_key(digest), data)
+                except Exception:
+                    with cls._lock: known.discard(digest)
+                    raise
+                sent += len(data)
+        return digests, sent
+
+    @classmethod
+    @Profiler.profile('backup.run')
+    def run(cls, source: str = None, target: str = None, workers: int = None) -> Dict[str, Any]:
+        """ Backs up files changed since the last run and writes a new manifest """
+        source = os.path.abspath(source or BackupConfig.source)
+        backend = cls.get_backend(target)
+        start = time.perf_counter()
+        index = cls.load_index()
+        # An index from another source or backend says nothing about this one
+        if index.get('source') != source or index.get('target') != repr(backend): index = cls.index = {'files': {}, 'chunks': [], 'source': source, 'target': repr(backend)}
+        known = set(index['chunks'])
+        current = cls.scan(source)
+        prev = index['files']
+        changed = [rel for rel, st in current.items() if rel not in prev or prev[rel]['size'] != st.st_size or prev[rel]['mtime_ns'] != st.st_mtime_ns]
+        stats = {'files': len(current), 'changed': len(changed), 'removed': len(set(prev) - set(current)), 'bytes_sent': 0, 'failed': 0}
+        unchanged = set(current) - set(changed)
+        files = {rel: prev[rel] for rel in unchanged}
+
+        def upload(rel: str):
+            st = current[rel]
+            digests, sent = cls.upload_file(backend, os.path.join(source, rel), known)
+            return rel, {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'mode': st.st_mode & 0o777, 'chunks': digests}, sent
+
+        with ThreadPoolExecutor(max_workers=max(workers or BackupConfig.workers, 1)) as pool:
+            futures = {rel: pool.submit(upload, rel) for rel in changed}
+            for rel, fut in futures.items():
+                try: rel, entry, sent = fut.result()
+                except Exception as e:
+                    stats['failed'] += 1
+                    # The last backed up version stays in the manifest until an upload succeeds
+                    if rel in prev: files[rel] = prev[rel]
+                    logger.error(f'Failed to back up {rel}: {e}')
+                    continue
+                files[rel] = entry
+                stats['bytes_sent'] += sent
+        if stats['changed'] or stats['removed'] or not backend.exists('manifests/latest.json'):
+            manifest = json.dumps({'created': time.time(), 'source': source, 'files': files}).encode()
+            backend.put(f'manifests/{int(time.time())}.json', manifest)
+            backend.put('manifests/latest.json', manifest)
+        with cls._lock:
+            index.update(files = files, chunks = sorted(known), source = source, target = repr(backend))
+            cls.save_index()
+        stats['duration'] = round(time.perf_counter() - start, 3)
+        logger.info(f"Backed up {stats['changed']} changed of {stats['files']} files ({stats['bytes_sent'] / 1024 / 1024:.1f}MB sent) to {backend} in {stats['duration']:.2f}s")
+        return stats
+
+    @classmethod
+    @Profiler.profile('backup.restore')
+    def restore(cls, dest: str = None, target: str = None, workers: int = None, manifest: str = 'latest') -> Dict[str, Any]:
+        """ Restores a manifest in parallel, skipping files already present with the same size and mtime """
+        dest = os.path.abspath(dest or BackupConfig.source)
+        backend = cls.get_backend(target)
+        start = time.perf_counter()
+        files = json.loads(backend.get(f'manifests/{manifest}.json'))['files']
+        stats = {'files': len(files), 'restored': 0, 'skipped': 0, 'bytes_received': 0, 'failed': 0}
+
+        def fetch(rel: str):
+            entry, path = files[rel], os.path.join(dest, rel)
+            try: st = os.stat(path)
+            except OSError: st = None
+            if st and st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']: return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp, received = f'{path}.restore.tmp', 0
+            with open(tmp, 'wb') as f:
+                for digest in entry['chunks']:
+                    data = backend.get(cls.chunk_key(digest))
+                    f.write(data)
+                    received += len(data)
+            os.chmod(tmp, entry.get('mode', 0o644))
+            os.replace(tmp, path)
+            os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+            return received
+
+        with ThreadPoolExecutor(max_workers=max(workers or BackupConfig.workers, 1)) as pool:
+            futures = {rel: pool.submit(fetch, rel) for rel in files}
+            for rel, fut in futures.items():
+                try: received = fut.result()
+                except Exception as e:
+                    stats['failed'] += 1
+                    logger.error(f'Failed to restore {rel}: {e}')
+                    continue
+                if received is None:
+                    stats['skipped'] += 1
+                    continue
+                stats['restored'] += 1
+                stats['bytes_received'] += received
+        # Restored files match the manifest, so the next backup only sends new changes
+        with cls._lock:
+            index = cls.index = {'files': files, 'chunks': sorted({d for e in files.values() for d in e['chunks']}), 'source': dest, 'target': repr(backend)}
+            cls.save_index()
+        stats['duration'] = round(time.perf_counter() - start, 3)
+        logger.info(f"Restored {stats['restored']} of {stats['files']} files ({stats['bytes_received'] / 1024 / 1024:.1f}MB) from {backend} in {stats['duration']:.2f}s")
+        return stats
+
+    @classmethod
+    def loop(cls, interval: float):
+        while not cls._stop.wait(interval):
+            try: cls.run()
+            except Exception as e: logger.error(f'Periodic Backup failed: {e}')
+
+    @classmethod
+    def start(cls, interval: float = None):
+        """ Runs a backup every `interval` seconds in a daemon thread """
+        interval = interval or BackupConfig.interval
+        if not interval or (cls.thread and cls.thread.is_alive()): return
+        cls._stop.clear()
+        cls.thread = threading.Thread(target=cls.loop, args=(interval,), name='InletsColab-Backup', daemon=True)
+        cls.thread.start()
+        logger.info(f'Backing up {BackupConfig.source} to {BackupConfig.target} every {interval:.0f}s')
+
+    @classmethod
+    def stop(cls, final: bool = False):
+        cls._stop.set()
+        if cls.thread: cls.thread.join(timeout=5.0)
+        cls.thread = None
+        if final and BackupConfig.target: cls.run()
+
+    @classmethod
+    def status(cls) -> Dict[str, Any]:
+        index = cls.load_index()
+        return {
+            'source': index.get('source'), 'target': index.get('target'),
+            'files': len(index['files']), 'bytes': sum(e['size'] for e in index['files'].values()),
+            'chunks': len(index['chunks']), 'periodic': bool(cls.thread and cls.thread.is_alive()),
+        }
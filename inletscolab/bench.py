@@ -0,0 +1,454 @@
+import os
+import ssl
+import sys
+import socket
+import tempfile
+import subprocess
+import time
+import base64
+import asyncio
+import hashlib
+import statistics
+from lazycls.types import *
+import threading
+from inletscolab.config import InletsConfig, WatchdogConfig, logger
+
+"""
+Tunnel Benchmark using Local Stand-Ins
+
+An HTTP/WebSocket echo upstream plays the local server, and a relay plays the inlets data plane:
+`tcp` pipes bytes per connection, `http` parses and forwards each request like an HTTP tunnel.
+"""
+
+_ws_guid = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_chunk_size = 64 * 1024
+_zeros = bytes(_chunk_size)
+
+
+async def read_head(reader: asyncio.StreamReader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            k, v = line.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+    return lines[0], headers, head
+
+
+async def read_body(reader: asyncio.StreamReader, headers: Dict[str, str]):
+    n = int(headers.get('content-length', 0))
+    return await reader.readexactly(n) if n else b''
+
+
+async def copy_body(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, n: int):
+    while n > 0:
+        chunk = await reader.read(min(n, _chunk_size))
+        if not chunk: raise asyncio.IncompleteReadError(b'', n)
+        writer.write(chunk)
+        await writer.drain()
+        n -= len(chunk)
+
+
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            data = await reader.read(_chunk_size)
+            if not data: break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError): pass
+    finally: writer.close()
+
+
+def ws_frame(payload: bytes, opcode: int = 0x2, mask: bool = False):
+    header = bytes([0x80 | opcode])
+    n = len(payload)
+    mbit = 0x80 if mask else 0
+    if n < 126: header += bytes([mbit | n])
+    elif n < 65536: header += bytes([mbit | 126]) + n.to_bytes(2, 'big')
+    else: header += bytes([mbit | 127]) + n.to_bytes(8, 'big')
+    if not mask: return header + payload
+    key = os.urandom(4)
+    return header + key + bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+
+async def ws_read(reader: asyncio.StreamReader):
+    b1, b2 = await reader.readexactly(2)
+    n = b2 & 0x7F
+    if n == 126: n = int.from_bytes(await reader.readexactly(2), 'big')
+    elif n == 127: n = int.from_bytes(await reader.readexactly(8), 'big')
+    key = await reader.readexactly(4) if b2 & 0x80 else None
+    payload = await reader.readexactly(n)
+    if key: payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return b1 & 0x0F, payload
+
+
+class EchoUpstream:
+    """ GET /echo, POST /echo, GET /bulk?size=N, the Watchdog probe and a WebSocket echo on any path """
+    def __init__(self, host: str = None, port: int = None):
+        self.host = host or InletsConfig.client_host
+        self.port = port if port is not None else InletsConfig.client_port
+        self.server: asyncio.AbstractServer = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line, headers, _ = await read_head(reader)
+                body = await read_body(reader, headers)
+                path = line.split(' ')[1]
+                if headers.get('upgrade', '').lower() == 'websocket': return await self.websocket(reader, writer, headers)
+                if path.startswith(WatchdogConfig.path):
+                    nonce = path.split('n=', 1)[1].encode() if 'n=' in path else b''
+                    writer.write(f'HTTP/1.1 200 OK\r\nContent-Length: {len(nonce)}\r\n\r\n'.encode() + nonce)
+                    await writer.drain()
+                elif path.startswith('/bulk'):
+                    size = int(path.split('size=', 1)[1]) if 'size=' in path else _chunk_size
+                    writer.write(f'HTTP/1.1 200 OK\r\nContent-Length: {size}\r\n\r\n'.encode())
+                    while size > 0:
+                        writer.write(_zeros[:min(size, _chunk_size)])
+                        size -= _chunk_size
+                        await writer.drain()
+                else:
+                    body = body or b'ok'
+                    writer.write(f'HTTP/1.1 200 OK\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError): pass
+        finally: writer.close()
+
+    async def websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: Dict[str, str]):
+        accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'].encode() + _ws_guid).digest()).decode()
+        writer.write(f'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n'.encode())
+        await writer.drain()
+        while True:
+            opcode, payload = await ws_read(reader)
+            if opcode == 0x8: break
+            writer.write(ws_frame(payload, opcode))
+            await writer.drain()
+
+
+class Relay:
+    """ Stands in for the inlets data plane in `tcp` or `http` mode. While `stalled`, it accepts connections but never answers """
+    def __init__(self, mode: str, upstream_host: str, upstream_port: int, host: str = '127.0.0.1', port: int = 0):
+        self.mode = mode
+        self.stalled = False
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.host = host
+        self.port = port
+        self.server: asyncio.AbstractServer = None
+
+    async def start(self):
+        handler = self.handle_tcp if self.mode == 'tcp' else self.handle_http
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            if not self.stalled: return await handler(reader, writer)
+            try: await reader.read()
+            except ConnectionError: pass
+            writer.close()
+
+        self.server = await asyncio.start_server(handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        up_reader, up_writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+        try: await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+        except asyncio.CancelledError: pass
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        up_reader, up_writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+        try:
+            while True:
+                _, headers, head = await read_head(reader)
+                up_writer.write(head[:-2] + b'X-Forwarded-For: 127.0.0.1\r\n\r\n')
+                await copy_body(reader, up_writer, int(headers.get('content-length', 0)))
+                status, resp_headers, resp_head = await read_head(up_reader)
+                writer.write(resp_head)
+                if ' 101 ' in status:
+                    await writer.drain()
+                    return await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+                await copy_body(up_reader, writer, int(resp_headers.get('content-length', 0)))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError): pass
+        finally:
+            writer.close()
+            up_writer.close()
+
+
+def percentile(values: List[float], pct: float):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+class TunnelBench:
+
+    @classmethod
+    async def http_load(cls, host: str, port: int, requests: int = 2000, concurrency: int = 16, payload: int = 0):
+        latencies = []
+        body = bytes(payload)
+        method = 'POST' if payload else 'GET'
+        request = f'{method} /echo HTTP/1.1\r\nHost: {host}\r\nContent-Length: {payload}\r\n\r\n'.encode() + body
+        per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+        async def worker(n: int):
+            reader, writer = await asyncio.open_connection(host, port)
+            for _ in range(n):
+                start = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                _, headers, _ = await read_head(reader)
+                await read_body(reader, headers)
+                latencies.append(time.perf_counter() - start)
+            writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(n) for n in per_worker if n])
+        elapsed = time.perf_counter() - start
+        return {
+            'requests': len(latencies),
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 3) if latencies else 0.0,
+        }
+
+    @classmethod
+    async def bulk(cls, host: str, port: int, size_mb: int = 64):
+        size = size_mb * 1024 * 1024
+        reader, writer = await asyncio.open_connection(host, port)
+        start = time.perf_counter()
+        writer.write(f'GET /bulk?size={size} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+        await writer.drain()
+        _, headers, _ = await read_head(reader)
+        remaining = int(headers['content-length'])
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, 1024 * 1024))
+            if not chunk: break
+            remaining -= len(chunk)
+        elapsed = time.perf_counter() - start
+        writer.close()
+        return {'bulk_mb': size_mb, 'bulk_mbps': round(size_mb / elapsed, 1)}
+
+    @classmethod
+    async def websocket(cls, host: str, port: int, messages: int = 500, size: int = 64):
+        key = base64.b64encode(os.urandom(16)).decode()
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f'GET /ws HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'.encode())
+        await writer.drain()
+        await read_head(reader)
+        payload, latencies = os.urandom(size), []
+        for _ in range(messages):
+            start = time.perf_counter()
+            writer.write(ws_frame(payload, mask=True))
+            await writer.drain()
+            await ws_read(reader)
+            latencies.append(time.perf_counter() - start)
+        writer.write(ws_frame(b'', opcode=0x8, mask=True))
+        writer.close()
+        return {'ws_p50_ms': round(percentile(latencies, 50) * 1000, 3), 'ws_p99_ms': round(percentile(latencies, 99) * 1000, 3)}
+
+    @classmethod
+    async def run_mode(cls, mode: str, upstream: EchoUpstream, requests: int = 2000, concurrency: int = 16, bulk_mb: int = 64, ws_messages: int = 500):
+        relay = await Relay(mode, upstream.host, upstream.port).start()
+        try:
+            result = {'mode': mode}
+            result.update(await cls.http_load(relay.host, relay.port, requests=requests, concurrency=concurrency))
+            result.update(await cls.bulk(relay.host, relay.port, size_mb=bulk_mb))
+            result.update(await cls.websocket(relay.host, relay.port, messages=ws_messages))
+            return result
+        finally: await relay.stop()
+
+    @classmethod
+    async def arun(cls, modes: List[str] = ('tcp', 'http'), host: str = None, port: int = None, baseline: bool = True, **kwargs):
+        """ Benchmarks each relay mode, and the upstream directly as a baseline """
+        upstream = await EchoUpstream(host, port).start()
+        results = []
+        try:
+            if baseline:
+                result = {'mode': 'direct'}
+                result.update(await cls.http_load(upstream.host, upstream.port, requests=kwargs.get('requests', 2000), concurrency=kwargs.get('concurrency', 16)))
+                result.update(await cls.bulk(upstream.host, upstream.port, size_mb=kwargs.get('bulk_mb', 64)))
+                result.update(await cls.websocket(upstream.host, upstream.port, messages=kwargs.get('ws_messages', 500)))
+                results.append(result)
+            for mode in modes: results.append(await cls.run_mode(mode, upstream, **kwargs))
+        finally: await upstream.stop()
+        return results
+
+    @classmethod
+    def run(cls, modes: List[str] = ('tcp', 'http'), **kwargs):
+        return asyncio.run(cls.arun(modes, **kwargs))
+
+    @classmethod
+    def display_info(cls, results: List[Dict[str, Any]]):
+        cols = ['mode', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'bulk_mbps', 'ws_p50_ms', 'ws_p99_ms']
+        msg = "\n\n" + ''.join(f'{c:>11}' for c in cols) + "\n"
+        for r in results: msg += ''.join(f'{r.get(c, ""):>11}' for c in cols) + "\n"
+        logger.info(msg)
+
+
+class WatchdogBench:
+    """ Stalls a relay stand-in and measures how long the Watchdog takes to notice, and to restore the tunnel """
+
+    @classmethod
+    def run(cls, trials: int = 3, mode: str = 'http', interval: float = 0.2, timeout: float = 0.5, failures: int = 3, reconnect_delay: float = 0.5) -> Dict[str, Any]:
+        from inletscolab.watchdog import Watchdog
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name='WatchdogBench', daemon=True)
+        thread.start()
+        run = lambda coro: asyncio.run_coroutine_threadsafe(coro, loop).result()
+        upstream = run(EchoUpstream('127.0.0.1', 0).start())
+        relay = run(Relay(mode, upstream.host, upstream.port).start())
+        url = f'http://{relay.host}:{relay.port}{WatchdogConfig.path}'
+        saved = (WatchdogConfig.timeout, WatchdogConfig.failures)
+        WatchdogConfig.timeout, WatchdogConfig.failures = timeout, failures
+
+        def restart():
+            # Stands in for relaunching inlets-pro and it connecting again
+            time.sleep(reconnect_delay)
+            relay.stalled = False
+
+        detections, reconnects = [], []
+        try:
+            for _ in range(trials):
+                if not Watchdog.check(url, restart): raise RuntimeError('The relay stand-in is not answering probes')
+                before = Watchdog.stats['reconnects'] + Watchdog.stats['failed_reconnects']
+                relay.stalled = True
+                stalled_at = time.perf_counter()
+                while True:
+                    time.sleep(interval)
+                    Watchdog.check(url, restart)
+                    if Watchdog.stats['reconnects'] + Watchdog.stats['failed_reconnects'] > before: break
+                total = time.perf_counter() - stalled_at
+                reconnects.append(Watchdog.stats['last_reconnect'] or 0.0)
+                detections.append(total - reconnects[-1])
+        finally:
+            WatchdogConfig.timeout, WatchdogConfig.failures = saved
+            run(relay.stop())
+            run(upstream.stop())
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5.0)
+        return {
+            'mode': mode, 'trials': trials, 'probe_interval': interval, 'probe_timeout': timeout, 'failures': failures,
+            'detect_p50_s': round(statistics.median(detections), 3), 'detect_max_s': round(max(detections), 3),
+            'reconnect_p50_s': round(statistics.median(reconnects), 3), 'reconnect_max_s': round(max(reconnects), 3),
+            'avg_rtt_ms': round((Watchdog.stats['avg_rtt'] or 0.0) * 1000, 3),
+        }
+
+
+class DelayedListener:
+    """ Stands in for an inlets server `delay` seconds away by waiting that long before each TLS handshake """
+    def __init__(self, delay: float, ctx: ssl.SSLContext, host: str = '127.0.0.1'):
+        self.delay = delay
+        self.ctx = ctx
+        self.sock = socket.create_server((host, 0))
+        self.host, self.port = self.sock.getsockname()[:2]
+        threading.Thread(target=self.serve, name=f'DelayedListener-{self.port}', daemon=True).start()
+
+    def serve(self):
+        while True:
+            try: conn, _ = self.sock.accept()
+            except OSError: return
+            threading.Thread(target=self.handshake, args=(conn,), daemon=True).start()
+
+    def handshake(self, conn: socket.socket):
+        time.sleep(self.delay)
+        try:
+            with self.ctx.wrap_socket(conn, server_side=True): pass
+        except (OSError, ssl.SSLError): conn.close()
+
+    def stop(self):
+        self.sock.close()
+
+
+class EndpointBench:
+    """ Probes local listeners with injected handshake delays, checking the fastest healthy one is ranked first """
+
+    @classmethod
+    def get_context(cls, tmp_dir: str) -> ssl.SSLContext:
+        """ A throwaway self-signed certificate, which needs the openssl binary """
+        cert, key = os.path.join(tmp_dir, 'cert.pem'), os.path.join(tmp_dir, 'key.pem')
+        try: subprocess.run(['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes', '-keyout', key, '-out', cert, '-days', '1', '-subj', '/CN=localhost'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError) as e: raise RuntimeError(f'EndpointBench needs openssl to create a test certificate: {e}')
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(cert, key)
+        return ctx
+
+    @classmethod
+    def run(cls, delays: List[float] = (0.08, 0.02, 0.05), down: int = 1, samples: int = 3) -> Dict[str, Any]:
+        from inletscolab.endpoints import Endpoints, Endpoint
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ctx = cls.get_context(tmp_dir)
+            listeners = [DelayedListener(d, ctx) for d in delays]
+        # Ports that were just released stand in for endpoints that are down
+        closed = []
+        for _ in range(down):
+            with socket.create_server(('127.0.0.1', 0)) as s: closed.append(s.getsockname()[1])
+        saved = (InletsConfig.is_cluster, InletsConfig.tunnel_host)
+        InletsConfig.is_cluster = True
+        try:
+            candidates = [Endpoint(f'{l.host}:{l.port}') for l in listeners] + [Endpoint(f'127.0.0.1:{p}') for p in closed]
+            InletsConfig.tunnel_host = ','.join(e.tunnel_host for e in candidates)
+            start = time.perf_counter()
+            ranked = Endpoints.rank(candidates, samples=samples, tls=True, timeout=max(delays) + 1.0)
+            duration = time.perf_counter() - start
+        finally:
+            InletsConfig.is_cluster, InletsConfig.tunnel_host = saved
+            for l in listeners: l.stop()
+        injected = {f'{l.host}:{l.port}': l.delay for l in listeners}
+        fastest = min(injected, key=injected.get)
+        return {
+            'candidates': [{'endpoint': f"{r['host']}:{r['port']}", 'injected_ms': round(injected[f"{r['host']}:{r['port']}"] * 1000, 1) if f"{r['host']}:{r['port']}" in injected else None, 'rtt_ms': round(r['rtt'] * 1000, 2) if r['rtt'] is not None else None, 'healthy': r['healthy']} for _, r in ranked],
+            'selected': ranked[0][0].tunnel_host,
+            'correct': ranked[0][0].tunnel_host == fastest,
+            'probe_s': round(duration, 3),
+            # Probing in parallel takes about as long as the slowest healthy candidate, not the sum
+            'sequential_s': round(sum(delays) * samples, 3),
+        }
+
+
+class ImportBench:
+    """ Measures import time in a fresh interpreter with `python -X importtime` """
+
+    @classmethod
+    def measure(cls, module: str = 'inletscolab.cmd', runs: int = 5) -> Dict[str, Any]:
+        totals, slowest = [], {}
+        for _ in range(runs):
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+            if proc.returncode != 0: raise RuntimeError(f'Failed to import {module}: {proc.stderr.strip().splitlines()[-1]}')
+            total = 0
+            for line in proc.stderr.splitlines():
+                if not line.startswith('import time:') or 'cumulative' in line: continue
+                _, cumulative, name = line[len('import time:'):].split('|')
+                # Top-level imports are unindented, and their cumulative times add up to the total
+                if not name[1:].startswith(' '): total += int(cumulative)
+                slowest[name.strip()] = max(slowest.get(name.strip(), 0), int(cumulative))
+            totals.append(total / 1000)
+        return {
+            'module': module,
+            'median_ms': round(statistics.median(totals), 1),
+            'min_ms': round(min(totals), 1),
+            'slowest_us': dict(sorted(slowest.items(), key=lambda kv: -kv[1])[:10]),
+        }
+
+    @classmethod
+    def check(cls, module: str = 'inletscolab.cmd', budget_ms: float = 150.0, runs: int = 5):
+        """ Returns the measurement and whether the median import time is within `budget_ms` """
+        result = cls.measure(module, runs)
+        result['budget_ms'] = budget_ms
+        result['ok'] = result['median_ms'] <= budget_ms
+        return result
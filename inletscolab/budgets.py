@@ -0,0 +1,245 @@
+import os
+import ctypes
+import platform
+import resource
+from lazycls.types import *
+from inletscolab.config import ServerConfig, InletsConfig, logger, DebugEnabled
+from inletscolab.state import State, pid_alive
+from inletscolab.procs import Procs
+
+"""
+Memory, CPU and IO Budgets for Launched Processes
+
+Budgets are applied right after the spawn, to the process, its threads and any children it has started,
+rather than in a preexec_fn, which is unsafe while the orchestrator's threads are running.
+Processes started later by the budgeted ones inherit everything but a memory rlimit's accounting.
+"""
+
+_cgroup_root = '/sys/fs/cgroup'
+_cgroup_name = 'inletscolab'
+_page_size = os.sysconf('SC_PAGE_SIZE')
+_clock_ticks = os.sysconf('SC_CLK_TCK')
+_units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+## ioprio_set has no libc wrapper
+_ioprio_syscalls = {'x86_64': 251, 'aarch64': 30, 'i386': 289, 'i686': 289}
+_io_classes = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+_ioprio_class_shift = 13
+
+
+def parse_size(value: Union[str, int, None]) -> Optional[int]:
+    """ i.e. 4G, 512M or 1073741824 -> bytes """
+    if not value: return None
+    if isinstance(value, int): return value
+    value = value.strip().lower().rstrip('ib').rstrip('b')
+    if value[-1] in _units: return int(float(value[:-1]) * _units[value[-1]])
+    return int(value)
+
+
+def parse_cpus(value: Union[str, List[int], None]) -> Optional[List[int]]:
+    """ i.e. 0-3,6 -> [0, 1, 2, 3, 6]. A negative count, i.e. -2, is every core but the last two """
+    if not value: return None
+    if not isinstance(value, str): return sorted(value)
+    available = sorted(os.sched_getaffinity(0))
+    if value.startswith('-') and value[1:].isdigit(): return available[:max(len(available) - int(value[1:]), 1)]
+    cpus = set()
+    for part in value.split(','):
+        start, _, end = part.strip().partition('-')
+        cpus.update(range(int(start), int(end or start) + 1))
+    return sorted(cpus)
+
+
+def get_tids(pid: int) -> List[int]:
+    """ Affinity, nice and IO priority are per thread on Linux """
+    try: return [int(t) for t in os.listdir(f'/proc/{pid}/task')]
+    except OSError: return [pid]
+
+
+class Budget:
+    def __init__(self, memory: Union[str, int] = None, cpus: Union[str, List[int]] = None, nice: int = 0, io_class: str = None, oom_score_adj: int = 0):
+        self.memory = parse_size(memory)
+        self.cpus = parse_cpus(cpus)
+        self.nice = nice or 0
+        self.io_class = io_class or None
+        self.oom_score_adj = oom_score_adj or 0
+        if self.io_class and self.io_class not in _io_classes: raise ValueError(f'Unknown IO class {self.io_class}. Use one of {list(_io_classes)}')
+
+    @classmethod
+    def for_component(cls, component: str) -> 'Budget':
+        """ `server` takes SERVER_*, and every inlets client INLETS_* """
+        if component == 'server' and ServerConfig.instances > 1:
+            from inletscolab.pool import ServerPool
+            return ServerPool.get_budget(0)
+        cfg = InletsConfig if component.startswith('inlets') else ServerConfig
+        return cls(memory = cfg.memory_limit, cpus = cfg.cpus, nice = cfg.nice, io_class = cfg.io_class, oom_score_adj = cfg.oom_score_adj)
+
+    @property
+    def empty(self):
+        return not (self.memory or self.cpus or self.nice or self.io_class or self.oom_score_adj)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'memory': self.memory, 'cpus': self.cpus, 'nice': self.nice, 'io_class': self.io_class, 'oom_score_adj': self.oom_score_adj}
+
+
+class Budgets:
+    cgroups: bool = None
+
+    @classmethod
+    def has_cgroups(cls) -> bool:
+        """ A writable cgroup v2 hierarchy with the memory controller, as when running as root outside a nested container """
+        if cls.cgroups is not None: return cls.cgroups
+        cls.cgroups = False
+        try:
+            with open(f'{_cgroup_root}/cgroup.controllers') as f: controllers = f.read().split()
+            if 'memory' not in controllers: return False
+            parent = f'{_cgroup_root}/{_cgroup_name}'
+            os.makedirs(parent, exist_ok=True)
+            with open(f'{_cgroup_root}/cgroup.subtree_control', 'w') as f: f.write('+memory')
+            with open(f'{parent}/cgroup.subtree_control', 'w') as f: f.write('+memory')
+            cls.cgroups = True
+        except OSError as e:
+            if DebugEnabled: logger.info(f'cgroup v2 is not available, so memory budgets fall back to rlimits: {e}')
+        return cls.cgroups
+
+    @classmethod
+    def get_cgroup(cls, component: str) -> str:
+        return f'{_cgroup_root}/{_cgroup_name}/{component}'
+
+    @classmethod
+    def set_cgroup(cls, component: str, pids: List[int], memory: int) -> bool:
+        if not cls.has_cgroups(): return False
+        path = cls.get_cgroup(component)
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(f'{path}/memory.max', 'w') as f: f.write(str(memory))
+            # Reclaim starts before the limit, so the process slows down before it is OOM killed
+            with open(f'{path}/memory.high', 'w') as f: f.write(str(int(memory * 0.9)))
+            for pid in pids:
+                with open(f'{path}/cgroup.procs', 'w') as f: f.write(str(pid))
+        except OSError as e:
+            logger.warn(f'Could not place {component} in {path}: {e}')
+            return False
+        return True
+
+    @classmethod
+    def set_rlimit(cls, pids: List[int], memory: int):
+        """ RLIMIT_DATA rather than RLIMIT_AS, since node and V8 reserve far more address space than they use """
+        for pid in pids:
+            try: resource.prlimit(pid, resource.RLIMIT_DATA, (memory, memory))
+            except (OSError, ValueError) as e: logger.warn(f'Could not limit the memory of pid {pid}: {e}')
+
+    @classmethod
+    def set_ioprio(cls, tid: int, io_class: str):
+        nr = _ioprio_syscalls.get(platform.machine())
+        if nr is None: return False
+        # Best effort and realtime take a level from 0 to 7. 4 is the kernel's default
+        value = (_io_classes[io_class] << _ioprio_class_shift) | (0 if io_class == 'idle' else 4)
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.syscall(nr, 1, tid, value) != 0: raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return True
+
+    @classmethod
+    def apply(cls, component: str, pid: int, budget: Budget = None) -> Dict[str, Any]:
+        """ Applies the budget to `pid` and its descendants, returning how each part was applied """
+        budget = budget or Budget.for_component(component)
+        if budget.empty:
+            if State.get(component).get('budget'): State.update(component, budget = None)
+            return {}
+        pids = [pid] + Procs.descendants(pid)
+        tids = [t for p in pids for t in get_tids(p)]
+        applied = {}
+        if budget.memory:
+            applied['memory'] = 'cgroup' if cls.set_cgroup(component, pids, budget.memory) else 'rlimit'
+            if applied['memory'] == 'rlimit': cls.set_rlimit(pids, budget.memory)
+        for tid in tids:
+            try:
+                if budget.cpus: os.sched_setaffinity(tid, budget.cpus)
+                if budget.nice: os.setpriority(os.PRIO_PROCESS, tid, budget.nice)
+                if budget.io_class: cls.set_ioprio(tid, budget.io_class)
+            # Threads can exit while they are updated
+            except ProcessLookupError: continue
+            except OSError as e:
+                logger.warn(f'Could not apply the {component} budget to thread {tid}: {e}')
+                break
+        if budget.cpus: applied['cpus'] = budget.cpus
+        if budget.nice: applied['nice'] = budget.nice
+        if budget.io_class: applied['io_class'] = budget.io_class
+        if budget.oom_score_adj:
+            # Raising the score is allowed without privileges, and makes the OOM killer pick this over the kernel
+            for p in pids:
+                try:
+                    with open(f'/proc/{p}/oom_score_adj', 'w') as f: f.write(str(budget.oom_score_adj))
+                except OSError as e: logger.warn(f'Could not set the OOM score of pid {p}: {e}')
+            applied['oom_score_adj'] = budget.oom_score_adj
+        State.update(component, budget = dict(budget.to_dict(), applied = applied))
+        logger.info(f'Applied the {component} budget to {len(pids)} processes: {applied}')
+        return applied
+
+    @classmethod
+    def read_memory(cls, pids: List[int]) -> int:
+        total = 0
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/statm') as f: total += int(f.read().split()[1]) * _page_size
+            except (OSError, IndexError, ValueError): continue
+        return total
+
+    @classmethod
+    def read_cpu(cls, pids: List[int]) -> float:
+        total = 0.0
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/stat', 'rb') as f: data = f.read()
+            except OSError: continue
+            fields = data[data.rindex(b')') + 2:].split()
+            total += (int(fields[11]) + int(fields[12])) / _clock_ticks
+        return total
+
+    @classmethod
+    def read_cgroup(cls, component: str) -> Dict[str, int]:
+        path = cls.get_cgroup(component)
+        result = {}
+        try:
+            with open(f'{path}/memory.current') as f: result['memory'] = int(f.read())
+            with open(f'{path}/memory.events') as f: events = dict(line.split() for line in f)
+            result['oom_kills'] = int(events.get('oom_kill', 0))
+            result['high_events'] = int(events.get('high', 0))
+        except (OSError, ValueError): pass
+        return result
+
+    @classmethod
+    def usage(cls, component: str) -> Optional[Dict[str, Any]]:
+        """ Current usage of the process tree recorded for `component` against its budget """
+        entry = State.get(component)
+        pid = entry.get('pid')
+        if not pid or not pid_alive(pid, entry.get('cmdline')): return None
+        pids = [pid] + Procs.descendants(pid)
+        budget = entry.get('budget', {})
+        result = {'pid': pid, 'processes': len(pids), 'memory': cls.read_memory(pids), 'cpu_seconds': round(cls.read_cpu(pids), 2), 'budget': budget}
+        if budget.get('applied', {}).get('memory') == 'cgroup': result.update(cls.read_cgroup(component))
+        if budget.get('memory'): result['memory_ratio'] = round(result['memory'] / budget['memory'], 3)
+        try:
+            result['cpus'] = sorted(os.sched_getaffinity(pid))
+            result['nice'] = os.getpriority(os.PRIO_PROCESS, pid)
+        except OSError: pass
+        return result
+
+    @classmethod
+    def get_usage(cls) -> Dict[str, Dict[str, Any]]:
+        """ Usage of every budgeted process in the State file """
+        usage = {}
+        for component, entry in State.load().items():
+            if not entry.get('budget'): continue
+            result = cls.usage(component)
+            if result: usage[component] = result
+        return usage
+
+    @classmethod
+    def display_info(cls):
+        for component, u in cls.get_usage().items():
+            msg = f"{component}: {u['memory'] / 1024 / 1024:.0f}MB"
+            if u['budget'].get('memory'): msg += f" of {u['budget']['memory'] / 1024 / 1024:.0f}MB ({u['budget']['applied'].get('memory')})"
+            msg += f" across {u['processes']} processes, {u['cpu_seconds']:.1f} cpu seconds"
+            if u['budget'].get('cpus'): msg += f" on cores {u['budget']['cpus']}"
+            if u.get('oom_kills'): msg += f", {u['oom_kills']} OOM kills"
+            logger.info(msg)
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import platform
+import threading
+import urllib.request
+from lazycls.types import *
+from lazycls.io import Path, PathLike
+from lazycls.prop import classproperty
+from inletscolab.config import CacheConfig, logger, DebugEnabled
+
+""" Content-Addressed Artifact Cache for Installer Binaries """
+
+_arch_map = {'x86_64': 'amd64', 'aarch64': 'arm64'}
+
+class ArtifactCache:
+    _lock = threading.Lock()
+
+    @classproperty
+    def cache_dir(cls):
+        return Path(CacheConfig.cache_dir)
+
+    @classproperty
+    def index_file(cls):
+        return cls.cache_dir.joinpath('index.json')
+
+    @classproperty
+    def arch(cls):
+        m = platform.machine().lower()
+        return _arch_map.get(m, m)
+
+    @classmethod
+    def get_key(cls, tool: str, version: str, arch: str = None):
+        return f'{tool}/{version}/{arch or cls.arch}'
+
+    @classmethod
+    def checksum(cls, path: PathLike, chunk_size: int = 1024 * 1024):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''): h.update(chunk)
+        return h.hexdigest()
+
+    @classmethod
+    def load_index(cls) -> Dict[str, Dict[str, Any]]:
+        if not cls.index_file.exists(): return {}
+        try: return json.loads(cls.index_file.read_text())
+        except ValueError:
+            logger.warn(f'Artifact Cache Index at {cls.index_file.string} is corrupt. Resetting.')
+            return {}
+
+    @classmethod
+    def save_index(cls, index: Dict[str, Dict[str, Any]]):
+        cls.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cls.cache_dir.joinpath('index.json.tmp')
+        tmp.write_text(json.dumps(index, indent=2))
+        os.replace(tmp.string, cls.index_file.string)
+
+    @classmethod
+    def get(cls, tool: str, version: str, arch: str = None):
+        """ `latest` is not a fixed version, so its entries expire after ARTIFACT_CACHE_LATEST_TTL """
+        entry = cls.load_index().get(cls.get_key(tool, version, arch))
+        if entry and version == 'latest' and time.time() - entry.get('created', 0) > CacheConfig.latest_ttl:
+            if DebugEnabled: logger.info(f'Cached {tool}/latest is older than {CacheConfig.latest_ttl}s. Refetching.')
+            return None
+        return entry
+
+    @classmethod
+    def exists(cls, tool: str, version: str, arch: str = None):
+        return cls.get(tool, version, arch) is not None
+
+    @classmethod
+    def put(cls, tool: str, version: str, files: List[PathLike], arch: str = None):
+        """ Copies `files` into the cache under tool/version/arch and records their checksums """
+        key = cls.get_key(tool, version, arch)
+        entry_dir = cls.cache_dir.joinpath(key)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        entry = {'files': {}, 'size': 0, 'created': time.time(), 'last_used': time.time()}
+        for f in files:
+            f = Path(f)
+            if not f.exists():
+                logger.warn(f'Skipping missing Artifact {f.string} for {key}')
+                continue
+            dest = entry_dir.joinpath(f.name)
+            shutil.copy2(f.string, dest.string)
+            entry['files'][f.name] = cls.checksum(dest)
+            entry['size'] += dest.stat().st_size
+        if not entry['files']: return None
+        with cls._lock:
+            index = cls.load_index()
+            index[key] = entry
+            cls.save_index(index)
+        logger.info(f'Cached {len(entry["files"])} Artifacts for {key}')
+        cls.evict()
+        return entry
+
+    @classmethod
+    def install(cls, tool: str, version: str, dest_dir: PathLike, arch: str = None, verify: bool = True):
+        """
+        Copies cached artifacts into `dest_dir` and makes them executable, as a cache on a bucket mount serves 0644 files.
+        A hard-link would let an installer overwriting the binary in place corrupt the cache entry too.
+        Returns False if the entry is missing or fails verification.
+        """
+        key = cls.get_key(tool, version, arch)
+        entry = cls.get(tool, version, arch)
+        if not entry: return False
+        entry_dir = cls.cache_dir.joinpath(key)
+        if verify and not cls.verify(tool, version, arch): return False
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        for name in entry['files']:
+            src, dest = entry_dir.joinpath(name), dest_dir.joinpath(name)
+            # Replaced rather than written in place, so a running binary is left intact
+            tmp = dest_dir.joinpath(f'.{name}.tmp')
+            shutil.copy2(src.string, tmp.string)
+            os.chmod(tmp.string, os.stat(tmp.string).st_mode | 0o755)
+            os.replace(tmp.string, dest.string)
+        with cls._lock:
+            index = cls.load_index()
+            if key in index:
+                index[key]['last_used'] = time.time()
+                cls.save_index(index)
+        logger.info(f'Installed {key} from Artifact Cache to {dest_dir.string}')
+        return True
+
+    @classmethod
+    def verify(cls, tool: str, version: str, arch: str = None):
+        key = cls.get_key(tool, version, arch)
+        entry = cls.get(tool, version, arch)
+        if not entry: return False
+        entry_dir = cls.cache_dir.joinpath(key)
+        for name, digest in entry['files'].items():
+            p = entry_dir.joinpath(name)
+            if not p.exists() or cls.checksum(p) != digest:
+                logger.error(f'Artifact {name} for {key} failed verification. Removing.')
+                cls.remove(tool, version, arch)
+                return False
+        return True
+
+    @classmethod
+    def remove(cls, tool: str, version: str, arch: str = None):
+        key = cls.get_key(tool, version, arch)
+        shutil.rmtree(cls.cache_dir.joinpath(key).string, ignore_errors=True)
+        with cls._lock:
+            index = cls.load_index()
+            if index.pop(key, None) is not None: cls.save_index(index)
+
+    @classmethod
+    def evict(cls, max_size: int = None):
+        """ Removes the least recently used entries until the cache is within `max_size` bytes """
+        max_size = max_size if max_size is not None else CacheConfig.max_size
+        index = cls.load_index()
+        total = sum(e['size'] for e in index.values())
+        for key, entry in sorted(index.items(), key=lambda kv: kv[1]['last_used']):
+            if total <= max_size: break
+            if DebugEnabled: logger.info(f'Evicting {key} from Artifact Cache')
+            cls.remove(*key.split('/'))
+            total -= entry['size']
+        return total
+
+    @classmethod
+    def prefetch_codeserver(cls, version: str):
+        """ Downloads the code-server deb that scripts/get_codeserver.sh would fetch """
+        if cls.exists('code-server', version): return True
+        name = f'code-server_{version}_{cls.arch}.deb'
+        url = f'https://github.com/coder/code-server/releases/download/v{version}/{name}'
+        tmp_dir = cls.cache_dir.joinpath('.tmp')
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp = tmp_dir.joinpath(name)
+        logger.info(f'Downloading {url}')
+        try: urllib.request.urlretrieve(url, tmp.string)
+        except Exception as e:
+            logger.error(f'Failed to download {url}: {e}')
+            return False
+        cls.put('code-server', version, [tmp])
+        tmp.unlink()
+        return True
+
+    @classmethod
+    def prefetch(cls, inlets: bool = True, codeserver: bool = True):
+        """ Warms the cache. Inlets has no direct release url, so it is installed and then cached. """
+        from inletscolab.config import InletsConfig, ServerConfig
+        if inlets and not cls.exists('inlets', InletsConfig.version): InletsConfig.ensure_inlets(overwrite=True)
+        if codeserver: cls.prefetch_codeserver(ServerConfig.version)
+
+    @classmethod
+    def display_info(cls):
+        index = cls.load_index()
+        msg = f"\n\nArtifact Cache at {cls.cache_dir.string}:\n"
+        for key, entry in index.items():
+            msg += f"  - {key}: {len(entry['files'])} files, {entry['size'] / 1024 / 1024:.1f}MB\n"
+        msg += f"Total: {sum(e['size'] for e in index.values()) / 1024 / 1024:.1f}MB / {CacheConfig.max_size / 1024 / 1024:.0f}MB\n"
+        logger.info(msg)
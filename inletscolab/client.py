@@ -1,19 +1,50 @@
+import threading
 from lazycls.types import *
 from lazycls.io import Path, PathLike
 from lazycls.envs import Env
 
-from inletscolab.config import logger, StorageConfig, ServerConfig, InletsConfig
+from inletscolab.config import logger, StorageConfig, ServerConfig, InletsConfig, CacheConfig, ReadCacheConfig, BackupConfig, SnapshotConfig, ProxyConfig, MetricsConfig, WatchdogConfig, EndpointConfig, SupervisorConfig, LogConfig
 from inletscolab.inlets import Inlets
 from inletscolab.server import Server
+from inletscolab.orchestrator import Orchestrator
+from inletscolab.supervisor import Supervisor
+from inletscolab.services import Services
+from inletscolab.state import State, pid_alive
+from inletscolab.profiler import Profiler
+from inletscolab.budgets import Budgets
+from inletscolab.pool import ServerPool
 
 """ Wrapper Client Class to manage all resources"""
 
 class InletsColab:
+    orchestrator: Orchestrator = None
     
     @classmethod
     def setup_storage(cls, **kwargs):
-        return StorageConfig.setup_storage(**kwargs)
+        results = StorageConfig.setup_storage(**kwargs)
+        cls.setup_backup()
+        return results
+
+    @classmethod
+    def setup_backup(cls):
+        """ With STORAGE_BACKUP set, restores the workspace on a VM without a backup index and starts periodic backups """
+        if not BackupConfig.target: return
+        from inletscolab.backup import Backup
+        if BackupConfig.restore and not BackupConfig.index_file.exists():
+            # The first VM for a target has nothing to restore yet
+            if Backup.get_backend().exists('manifests/latest.json'): Backup.restore()
+            else: logger.info(f'No Backup at {BackupConfig.target} yet. Starting cold.')
+        Backup.start()
     
+    @classmethod
+    def restore_snapshot(cls):
+        """ With SNAPSHOT_RESTORE, restores the environment snapshot on a VM that hasn't restored or saved one yet """
+        if not SnapshotConfig.restore or not SnapshotConfig.target or SnapshotConfig.index_file.exists(): return
+        from inletscolab.snapshot import Snapshot
+        # A missing or broken snapshot only means a cold start
+        try: return Snapshot.restore()
+        except Exception as e: logger.warn(f'Could not restore a Snapshot from {SnapshotConfig.target}: {e}')
+
     @classmethod
     def start_inlets(cls, license: str = None, overwrite_license: bool = False, overwrite_service: bool = False, inlets_service: bool = False, **kwargs):
         if inlets_service: Inlets.run_service(license = license, overwrite_license= overwrite_license, overwrite_service= overwrite_service, **kwargs)
@@ -23,6 +54,24 @@ class InletsColab:
     def start_server(cls, background: bool = False, **kwargs):
         Server.run_server(background=background, **kwargs)
     
+    @classmethod
+    def start_proxy(cls, **kwargs):
+        """
+        Starts the compressing, caching proxy that the tunnel forwards to when PROXY_ENABLED is set. With only WATCHDOG_ENABLED,
+        it passes responses through and answers the Watchdog's probes. With PROXY_DETACH, in its own process
+        """
+        if not ProxyConfig.required: return
+        from inletscolab.proxy import Proxy
+        if ProxyConfig.detach: return Proxy.spawn()
+        return Proxy.start(**dict(kwargs, transform = ProxyConfig.enabled))
+
+    @classmethod
+    def start_metrics(cls, **kwargs):
+        """ Serves /metrics when METRICS_ENABLED is set. Add it to INLETS_SERVICES to scrape it through the tunnel """
+        if not MetricsConfig.enabled: return
+        from inletscolab.metrics import Metrics
+        return Metrics.start(**kwargs)
+
     @classmethod
     def kill_inlets(cls): return Inlets.kill()
     
@@ -30,15 +79,172 @@ class InletsColab:
     def kill_server(cls): return Server.kill()
 
     @classmethod
-    def start(cls, license: str = None, overwrite_license: bool = False, overwrite_service: bool = False, inlets_service: bool = False, server_background: bool = False, inlets_args: Dict[str, Any] = {}, server_args:  Dict[str, Any] = {}, storage_args: Dict[str, Any] = {}, **kwargs):
-        cls.start_inlets(license = license, overwrite_license= overwrite_license, overwrite_service= overwrite_service, inlets_service=inlets_service, **inlets_args)
-        cls.setup_storage(**storage_args)
-        cls.start_server(background=server_background, **server_args)
+    def start(cls, license: str = None, overwrite_license: bool = False, overwrite_service: bool = False, inlets_service: bool = False, server_background: bool = False, inlets_args: Dict[str, Any] = {}, server_args:  Dict[str, Any] = {}, storage_args: Dict[str, Any] = {}, parallel: bool = True, wait_ready: bool = False, ready_timeout: float = 120.0, profile: str = None, **kwargs):
+        """
+        Starts Inlets, Storage and the Server. With `wait_ready`, a background start only returns
+        once the Server is serving and the tunnel is connected. A foreground Server blocks,
+        so readiness is then waited for in a thread instead.
+        With `profile`, phase and subprocess timings are written to that path as a Chrome trace.
+        Independent phases run concurrently as a startup graph. `parallel=False` runs them one after another.
+        Reruns are incremental: processes and mounts recorded in /authz/state.json from the same
+        config are kept, so an unchanged rerun only checks them. `State.clear()` forces a full start.
+        """
+        if profile: Profiler.enable()
+        cls.start_metrics()
+        if not parallel:
+            cls.start_proxy()
+            cls.start_inlets(license = license, overwrite_license= overwrite_license, overwrite_service= overwrite_service, inlets_service=inlets_service, **inlets_args)
+            cls.setup_storage(**storage_args)
+            cls.restore_snapshot()
+            # Server Pool instances are Services, and run the code-server that Server startup installs
+            Server.run_startup(**server_args)
+            Services.launch_all()
+            if server_background:
+                Server.launch(background=True)
+                cls.supervise()
+                cls.start_watchdog()
+                cls.start_endpoints()
+                if wait_ready: cls.wait_ready(timeout=ready_timeout)
+                return cls.save_profile(profile)
+            cls.supervise()
+            cls.start_watchdog()
+            cls.start_endpoints()
+        else:
+            cls.orchestrator = cls.get_orchestrator(license = license, overwrite_license= overwrite_license, overwrite_service= overwrite_service, inlets_service=inlets_service, server_background=server_background, inlets_args=inlets_args, server_args=server_args, storage_args=storage_args, wait_ready=wait_ready, ready_timeout=ready_timeout)
+            cls.orchestrator.run()
+            cls.orchestrator.display_info()
+            cls.supervise()
+            cls.start_watchdog()
+            cls.start_endpoints()
+            if server_background: return cls.save_profile(profile)
+        # The foreground Server blocks, so anything that should finish first happens here
+        cls.save_profile(profile)
+        if wait_ready: threading.Thread(target=cls.wait_ready, kwargs={'timeout': ready_timeout, 'raise_errors': False}, daemon=True).start()
+        Server.launch(background=False)
     
+    @classmethod
+    def save_profile(cls, path: str = None):
+        """ Displays the startup profile and writes it as a Chrome trace-event file """
+        if not path or not Profiler.enabled: return
+        Profiler.display_info()
+        Profiler.save(path)
+        logger.info(f'Saved Startup Profile to {path}')
+
+    @classmethod
+    def get_orchestrator(cls, license: str = None, overwrite_license: bool = False, overwrite_service: bool = False, inlets_service: bool = False, server_background: bool = False, inlets_args: Dict[str, Any] = {}, server_args:  Dict[str, Any] = {}, storage_args: Dict[str, Any] = {}, wait_ready: bool = False, ready_timeout: float = 120.0):
+        """ 
+        Builds the Startup Graph. Installers and Mounts run concurrently, 
+        while the Server is serving before the tunnel is reported ready.
+        A foreground Server blocks, so it is left to the caller.
+        """
+        orch = Orchestrator()
+        orch.add('inlets_setup', Inlets.run_startup, license = license, overwrite_license = overwrite_license, **inlets_args)
+        orch.add('storage', cls.setup_storage, **storage_args)
+        # inlets_args can change the client port, which the Server binds to
+        setup_deps, services_deps = ['inlets_setup'], []
+        if SnapshotConfig.restore and SnapshotConfig.target:
+            # Snapshots may be stored on a mounted bucket, and restore extensions the Server would otherwise install
+            orch.add('snapshot', cls.restore_snapshot, deps = ['storage'])
+            setup_deps.append('snapshot')
+            services_deps.append('snapshot')
+        orch.add('server_setup', Server.run_startup, deps = setup_deps, **server_args)
+        # Server Pool instances are Services, and run the code-server that Server startup installs
+        if ServerConfig.instances > 1: services_deps.append('server_setup')
+        orch.add('services', Services.launch_all, deps = services_deps)
+        inlets_deps, ready_deps = ['inlets_setup'], ['inlets']
+        if ProxyConfig.required:
+            orch.add('proxy', cls.start_proxy)
+            inlets_deps.append('proxy')
+        if server_background:
+            orch.add('server', Server.launch, deps = ['server_setup', 'storage'], background = True)
+            if wait_ready: 
+                orch.add('server_ready', Server.wait_ready, deps = ['server'], timeout = ready_timeout)
+                ready_deps.append('server_ready')
+            else: inlets_deps.append('server')
+        if inlets_service: orch.add('inlets', Inlets.launch_service, deps = inlets_deps, overwrite_service = overwrite_service)
+        else: orch.add('inlets', Inlets.launch_client, deps = inlets_deps, display = not wait_ready)
+        if wait_ready and not inlets_service: orch.add('inlets_ready', Inlets.wait_ready, deps = ready_deps, timeout = ready_timeout)
+        return orch
+
+    @classmethod
+    def wait_ready(cls, timeout: float = 120.0, raise_errors: bool = True):
+        """ Waits for the Server and then the tunnel, returning the time to ready of each """
+        try:
+            Server.wait_ready(timeout=timeout)
+            Inlets.wait_ready(timeout=timeout)
+        except (TimeoutError, RuntimeError) as e:
+            logger.error(f'Readiness check failed: {e}')
+            if raise_errors: raise
+        return cls.ready_times()
+
+    @classmethod
+    def status(cls) -> Dict[str, Any]:
+        """ Running state of each process from the State file, so it also reflects starts by other processes """
+        def get_proc(component: str):
+            entry = State.get(component)
+            return {'pid': entry.get('pid'), 'running': bool(entry.get('pid')) and pid_alive(entry['pid'], entry.get('cmdline'))}
+
+        from inletscolab.mounts import Mounts
+        return {
+            'server': dict(get_proc('server'), url = ServerConfig.local_url, ready_time = Server.ready_time),
+            'inlets': dict(get_proc('inlets'), url = InletsConfig.public_url, endpoint = InletsConfig.tunnel_url, ready_time = Inlets.ready_time, clients = [get_proc('inlets')] + [get_proc(f'inlets-{i}') for i in range(1, InletsConfig.clients)]),
+            'services': {s.name: dict(get_proc(f'service-{s.name}'), url = s.public_url) for s in Services.get_specs()},
+            'mounts': {s.path: StorageConfig.is_mounted(s.path) for s in Mounts.get_specs()},
+            'supervisor': Supervisor.stats(),
+            'budgets': Budgets.get_usage(),
+            'pool': ServerPool.status() if ServerConfig.instances > 1 else [],
+        }
+
+    @classmethod
+    def ready_times(cls):
+        return {'server': Server.ready_time, 'inlets': Inlets.ready_time}
+    
+    @classmethod
+    def supervise(cls):
+        """ Watches the inlets clients, a background Server and any Services, restarting them if they exit """
+        if not SupervisorConfig.enabled: return
+        Inlets.supervise()
+        Supervisor.watch('server', lambda: Server.d if Server.background else None, Server.restart)
+        Services.supervise()
+        Supervisor.start()
+
+    @classmethod
+    def start_watchdog(cls):
+        """ With WATCHDOG_ENABLED, probes the tunnel end to end and restarts the inlets client when it stalls """
+        if not WatchdogConfig.enabled or Inlets.svc: return
+        from inletscolab.watchdog import Watchdog
+        Watchdog.start()
+
+    @classmethod
+    def start_endpoints(cls):
+        """ With several tunnel endpoints listed, moves the inlets client to a faster one when it appears """
+        if Inlets.svc: return
+        from inletscolab.endpoints import Endpoints
+        Endpoints.start()
+
     @classmethod
     def stop(cls):
+        """ Stops everything recorded in the State file, so this works from any process, not only the one that started it """
+        Supervisor.stop()
+        if WatchdogConfig.enabled:
+            from inletscolab.watchdog import Watchdog
+            Watchdog.stop()
+        from inletscolab.endpoints import Endpoints
+        Endpoints.stop()
+        State.update('supervisor', stopped = True)
+        if BackupConfig.target:
+            from inletscolab.backup import Backup
+            Backup.stop()
         cls.kill_server()
+        Services.kill_all()
         cls.kill_inlets()
+        if ProxyConfig.required:
+            from inletscolab.proxy import Proxy
+            Proxy.display_info()
+            Proxy.stop()
+        if MetricsConfig.enabled:
+            from inletscolab.metrics import Metrics
+            Metrics.stop()
         
     @classmethod
     def export_config(cls):
@@ -46,6 +252,16 @@ class InletsColab:
         data.update(**InletsConfig.export_config())
         data.update(**ServerConfig.export_config())
         data.update(**StorageConfig.export_config())
+        data.update(**CacheConfig.export_config())
+        data.update(**ReadCacheConfig.export_config())
+        data.update(**BackupConfig.export_config())
+        data.update(**SnapshotConfig.export_config())
+        data.update(**ProxyConfig.export_config())
+        data.update(**MetricsConfig.export_config())
+        data.update(**WatchdogConfig.export_config())
+        data.update(**EndpointConfig.export_config())
+        data.update(**SupervisorConfig.export_config())
+        data.update(**LogConfig.export_config())
         return data
     
     @classmethod
@@ -65,12 +281,32 @@ class InletsColab:
         InletsConfig.reload_from_env()
         ServerConfig.reload_from_env()
         StorageConfig.reload_from_env()
+        CacheConfig.reload_from_env()
+        ReadCacheConfig.reload_from_env()
+        BackupConfig.reload_from_env()
+        SnapshotConfig.reload_from_env()
+        ProxyConfig.reload_from_env()
+        MetricsConfig.reload_from_env()
+        WatchdogConfig.reload_from_env()
+        EndpointConfig.reload_from_env()
+        SupervisorConfig.reload_from_env()
+        LogConfig.reload_from_env()
     
     @classmethod
     def reload_from_env(cls):
         InletsConfig.reload_from_env()
         ServerConfig.reload_from_env()
         StorageConfig.reload_from_env()
+        CacheConfig.reload_from_env()
+        ReadCacheConfig.reload_from_env()
+        BackupConfig.reload_from_env()
+        SnapshotConfig.reload_from_env()
+        ProxyConfig.reload_from_env()
+        MetricsConfig.reload_from_env()
+        WatchdogConfig.reload_from_env()
+        EndpointConfig.reload_from_env()
+        SupervisorConfig.reload_from_env()
+        LogConfig.reload_from_env()
     
         
 
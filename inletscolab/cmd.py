@@ -1,10 +1,10 @@
+import json
 import typer
 from typing import List, Optional
 from typer import Argument, Option
 from pathlib import Path
-from lazycls.envs import Env
-from lazycls.serializers import Yaml, OrJson
-from inletscolab.client import InletsColab, logger
+
+# Commands import the rest of the package on use, so the CLI starts without loading lazycls
 
 def parse_args(args: List[str] = []):
     kwargs = {}
@@ -14,16 +14,24 @@ def parse_args(args: List[str] = []):
     return kwargs
 
 def set_envs_from_args(args: List[str] = [], override: bool = False):
+    from lazycls.envs import Env
     envars = parse_args(args)
     for k,v in envars.items():
         Env.set_env(k, v, override=override)
     
 def get_server_config():
+    """ code-server's config.yaml is flat `key: value` pairs, so it is read without a yaml parser """
     p = Path('/root/.config/code-server/config.yaml')
     if not p.exists(): return {}
-    return Yaml.loads(p.read_text())
+    cfg = {}
+    for line in p.read_text().splitlines():
+        key, sep, val = line.partition(':')
+        if sep and not line.startswith((' ', '#')): cfg[key.strip()] = val.strip().strip('"\'')
+    return cfg
 
 def load_envfile_config(envfile: Path, override: bool = False):
+    from lazycls.envs import Env
+    from lazycls.serializers import Yaml, OrJson
     envars = Yaml.loads(envfile.read_text()) if envfile.suffix in {'.yml', '.yaml'} else OrJson.loads(envfile.read_text())
     for k,v in envars.items():
         Env.set_env(k, v, override=override)
@@ -44,7 +52,12 @@ def run_inlets_colab(
     inlet: Optional[List[str]] = Option([], help = "A Repeating List of Args for Inlets in format of key=value"),
     server:  Optional[List[str]] = Option([], help = "A Repeating List of Args for Server in format of key=value"),
     storage: Optional[List[str]] = Option([], help = "A Repeating List of Args for Storage in format of key=value"),
+    parallel: bool = Option(True, help="Run independent startup phases concurrently"),
+    wait_ready: bool = Option(False, help="Wait until the Server is serving and the tunnel is connected"),
+    ready_timeout: float = Option(120.0, help="Seconds to wait for readiness"),
+    profile: Optional[Path] = Option(None, help="Write a startup profile (Chrome trace-event JSON) to this path"),
 ):  
+    from inletscolab.client import InletsColab
     if envfile and envfile.exists():
         if encoded_envfile: InletsColab.load(path=envfile, override=override_env)
         else: load_envfile_config(envfile, override=override_env)  
@@ -55,19 +68,247 @@ def run_inlets_colab(
     inlets_args = parse_args(inlet)
     server_args = parse_args(server)
     storage_args = parse_args(storage)
-    InletsColab.start(license = license, overwrite_license= overwrite_license, inlets_service = inlets_service, server_background = server_background, inlets_args = inlets_args, server_args = server_args, storage_args = storage_args)
+    # This process exits once a background start returns, which would take a proxy thread with it
+    if server_background:
+        from inletscolab.config import ProxyConfig
+        ProxyConfig.detach = True
+    InletsColab.start(license = license, overwrite_license= overwrite_license, inlets_service = inlets_service, server_background = server_background, inlets_args = inlets_args, server_args = server_args, storage_args = storage_args, parallel = parallel, wait_ready = wait_ready, ready_timeout = ready_timeout, profile = profile.as_posix() if profile else None)
 
 @cli.command('stop')
 def stop_inlets_colab():
+    from inletscolab.client import InletsColab
     InletsColab.stop()
 
+@cli.command('prefetch')
+def prefetch_artifacts(
+    inlets: bool = Option(True, help="Cache the inletsctl and inlets-pro binaries"),
+    codeserver: bool = Option(True, help="Cache the code-server package"),
+    cache_dir: Optional[str] = Option(None, help="Artifact Cache Directory, i.e. a mounted bucket path", envvar="ARTIFACT_CACHE_DIR"),
+):
+    from inletscolab.config import CacheConfig
+    from inletscolab.cache import ArtifactCache
+    if cache_dir: CacheConfig.cache_dir = cache_dir
+    ArtifactCache.prefetch(inlets = inlets, codeserver = codeserver)
+    ArtifactCache.display_info()
+
+@cli.command('logs')
+def show_logs(
+    name: str = Argument('server', help="Process to show logs for: server or inlets"),
+    lines: int = Option(50, '--lines', '-n', help="Number of lines to show"),
+    follow: bool = Option(False, '--follow', '-f', help="Keep printing new lines as they are written"),
+):
+    from inletscolab.logs import Logs
+    if not follow:
+        for line in Logs.tail(name, lines): print(line)
+        return
+    try:
+        for line in Logs.follow(name, lines): print(line)
+    except KeyboardInterrupt: pass
+
+@cli.command('proxy')
+def run_proxy(
+    port: Optional[int] = Option(None, help="Port to listen on. Defaults to PROXY_PORT"),
+    backend_port: Optional[int] = Option(None, help="Server port to forward to. Defaults to INLETS_CLIENT_PORT"),
+    passthrough: bool = Option(False, help="Pass responses through as is, only answering Watchdog probes"),
+):
+    """ Runs the compressing, caching proxy in the foreground, printing its savings on exit """
+    import time
+    from inletscolab.proxy import Proxy
+    Proxy.start(port = port, backend_port = backend_port, transform = not passthrough)
+    try:
+        while True: time.sleep(60)
+    except KeyboardInterrupt: pass
+    Proxy.display_info()
+    Proxy.stop()
+
+@cli.command('metrics')
+def show_metrics():
+    """ Prints the metrics once, for processes recorded by any earlier start """
+    from inletscolab.metrics import Metrics
+    typer.echo(Metrics.collect(), nl=False)
+
+@cli.command('endpoints')
+def show_endpoints(
+    refresh: bool = Option(False, help="Probe every candidate again, rather than reusing a selection within ENDPOINT_TTL"),
+):
+    """ Prints the tunnel endpoint candidates, their handshake times and the selected one """
+    from inletscolab.endpoints import Endpoints
+    Endpoints.select(force = refresh)
+    typer.echo(json.dumps(Endpoints.status(), indent=2))
+
+@cli.command('budgets')
+def show_budgets():
+    """ Prints the memory and cpu usage of each budgeted process against its budget """
+    from inletscolab.budgets import Budgets
+    typer.echo(json.dumps(Budgets.get_usage(), indent=2))
+
 serverCli = typer.Typer(name='server')
 
 @serverCli.command('password')
 def show_server_password():
     cfg = get_server_config()
     pw = cfg.get('password', 'None')
-    logger.info(f'\nServer Password: {pw}\n')
+    typer.echo(f'\nServer Password: {pw}\n')
+
+
+poolCli = typer.Typer(name='pool')
+
+@poolCli.command('start')
+def pool_start():
+    """ Starts SERVER_INSTANCES - 1 instances alongside the Server. Restart inlets to expose newly added ones """
+    from inletscolab.pool import ServerPool
+    ServerPool.start()
+
+@poolCli.command('stop')
+def pool_stop():
+    from inletscolab.pool import ServerPool
+    ServerPool.stop()
+
+@poolCli.command('status')
+def pool_status():
+    from inletscolab.pool import ServerPool
+    typer.echo(json.dumps(ServerPool.status(), indent=2))
+
+
+readcacheCli = typer.Typer(name='readcache')
+
+@readcacheCli.command('prefetch')
+def readcache_prefetch(
+    patterns: Optional[List[str]] = Argument(None, help="Files or glob patterns to cache, i.e. '/content/gs/train/**/*.jpg'"),
+    manifest: Optional[Path] = Option(None, help="File listing one path or pattern per line"),
+    root: Optional[Path] = Option(None, help="Directory relative paths are resolved against"),
+    workers: Optional[int] = Option(None, help="Parallel copies. Defaults to READ_CACHE_WORKERS"),
+    max_mb: Optional[int] = Option(None, help="Cache size budget. Defaults to READ_CACHE_MAX_MB"),
+):
+    from inletscolab.config import ReadCacheConfig
+    from inletscolab.readcache import ReadCache
+    if max_mb: ReadCacheConfig.max_size_mb = max_mb
+    results = ReadCache.prefetch(patterns, manifest = manifest, root = root, workers = workers)
+    typer.echo(f'Cached {len(results)} files')
+    ReadCache.display_info()
+
+@readcacheCli.command('get')
+def readcache_get(paths: List[str] = Argument(..., help="Files to return local paths for")):
+    from inletscolab.readcache import ReadCache
+    for p in paths: typer.echo(ReadCache.get(p))
+    ReadCache.save()
+
+@readcacheCli.command('stats')
+def readcache_stats():
+    from inletscolab.readcache import ReadCache
+    typer.echo(json.dumps(ReadCache.get_stats(), indent=2))
 
+@readcacheCli.command('clear')
+def readcache_clear():
+    from inletscolab.readcache import ReadCache
+    ReadCache.clear()
+
+
+backupCli = typer.Typer(name='backup')
+
+@backupCli.command('run')
+def backup_run(
+    source: Optional[str] = Option(None, help="Directory to back up. Defaults to BACKUP_SOURCE"),
+    target: Optional[str] = Option(None, help="Backup location. Defaults to STORAGE_BACKUP"),
+    workers: Optional[int] = Option(None, help="Parallel uploads. Defaults to BACKUP_WORKERS"),
+):
+    from inletscolab.backup import Backup
+    typer.echo(json.dumps(Backup.run(source = source, target = target, workers = workers), indent=2))
+
+@backupCli.command('restore')
+def backup_restore(
+    dest: Optional[str] = Option(None, help="Directory to restore into. Defaults to BACKUP_SOURCE"),
+    target: Optional[str] = Option(None, help="Backup location. Defaults to STORAGE_BACKUP"),
+    workers: Optional[int] = Option(None, help="Parallel downloads. Defaults to BACKUP_WORKERS"),
+    manifest: str = Option('latest', help="Manifest to restore"),
+):
+    from inletscolab.backup import Backup
+    typer.echo(json.dumps(Backup.restore(dest = dest, target = target, workers = workers, manifest = manifest), indent=2))
+
+@backupCli.command('status')
+def backup_status():
+    from inletscolab.backup import Backup
+    typer.echo(json.dumps(Backup.status(), indent=2))
+
+
+snapshotCli = typer.Typer(name='snapshot')
+
+@snapshotCli.command('save')
+def snapshot_save(
+    paths: Optional[List[str]] = Argument(None, help="Directories to snapshot. Defaults to SNAPSHOT_PATHS"),
+    target: Optional[str] = Option(None, help="Snapshot location. Defaults to SNAPSHOT_TARGET or STORAGE_BACKUP/snapshot"),
+    workers: Optional[int] = Option(None, help="Parallel packers. Defaults to SNAPSHOT_WORKERS"),
+):
+    from inletscolab.snapshot import Snapshot
+    typer.echo(json.dumps(Snapshot.save(paths = paths, target = target, workers = workers), indent=2))
+
+@snapshotCli.command('restore')
+def snapshot_restore(
+    target: Optional[str] = Option(None, help="Snapshot location. Defaults to SNAPSHOT_TARGET or STORAGE_BACKUP/snapshot"),
+    workers: Optional[int] = Option(None, help="Parallel streams. Defaults to SNAPSHOT_WORKERS"),
+    manifest: str = Option('latest', help="Snapshot to restore"),
+):
+    from inletscolab.snapshot import Snapshot
+    typer.echo(json.dumps(Snapshot.restore(target = target, workers = workers, manifest = manifest), indent=2))
+
+
+benchCli = typer.Typer(name='bench')
+
+@benchCli.command('tunnel')
+def bench_tunnel(
+    mode: Optional[List[str]] = Option(['tcp', 'http'], help="Relay modes to benchmark, matching INLETS_CLIENT_TYPE"),
+    port: Optional[int] = Option(None, help="Upstream port. Defaults to INLETS_CLIENT_PORT, use 0 for any free port"),
+    requests: int = Option(2000, help="Number of echo requests per mode"),
+    concurrency: int = Option(16, help="Concurrent keep-alive connections"),
+    bulk_mb: int = Option(64, help="Size of the bulk transfer in MB"),
+    ws_messages: int = Option(500, help="Number of WebSocket round trips"),
+    output: Optional[Path] = Option(None, help="Write the results as JSON to this path"),
+):
+    from inletscolab.bench import TunnelBench
+    results = TunnelBench.run(mode, port = port, requests = requests, concurrency = concurrency, bulk_mb = bulk_mb, ws_messages = ws_messages)
+    TunnelBench.display_info(results)
+    if output: output.write_text(json.dumps(results, indent=2))
+
+@benchCli.command('watchdog')
+def bench_watchdog(
+    trials: int = Option(3, help="Number of stalls to detect and recover from"),
+    mode: str = Option('http', help="Relay mode, matching INLETS_CLIENT_TYPE"),
+    interval: float = Option(0.2, help="Seconds between probes"),
+    timeout: float = Option(0.5, help="Probe timeout"),
+    failures: int = Option(3, help="Failed probes before reconnecting"),
+    reconnect_delay: float = Option(0.5, help="Simulated time for the inlets client to reconnect"),
+):
+    from inletscolab.bench import WatchdogBench
+    result = WatchdogBench.run(trials = trials, mode = mode, interval = interval, timeout = timeout, failures = failures, reconnect_delay = reconnect_delay)
+    typer.echo(json.dumps(result, indent=2))
+
+@benchCli.command('endpoints')
+def bench_endpoints(
+    delays: str = Option('0.08,0.02,0.05', help="Comma separated handshake delays of the local listeners, in seconds"),
+    down: int = Option(1, help="Candidates that refuse connections"),
+    samples: int = Option(3, help="Handshakes per candidate"),
+):
+    from inletscolab.bench import EndpointBench
+    result = EndpointBench.run(delays = [float(d) for d in delays.split(',')], down = down, samples = samples)
+    typer.echo(json.dumps(result, indent=2))
+
+@benchCli.command('import')
+def bench_import(
+    module: str = Option('inletscolab.cmd', help="Module to import"),
+    budget_ms: float = Option(150.0, help="Fail if the median import time exceeds this"),
+    runs: int = Option(5, help="Number of fresh interpreters to measure"),
+):
+    from inletscolab.bench import ImportBench
+    result = ImportBench.check(module, budget_ms = budget_ms, runs = runs)
+    typer.echo(json.dumps(result, indent=2))
+    if not result['ok']: raise typer.Exit(code=1)
 
 cli.add_typer(serverCli)
+cli.add_typer(poolCli)
+cli.add_typer(readcacheCli)
+cli.add_typer(backupCli)
+cli.add_typer(snapshotCli)
+cli.add_typer(benchCli)
+
+if __name__ == '__main__':
+    cli()
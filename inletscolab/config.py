@@ -1,22 +1,28 @@
+import re
+import json
+import functools
+import threading
+import importlib.util
 from lazycls.envs import Env
 from lazycls.prop import classproperty
 from lazycls.types import *
 from lazycls.io import Path, PathLike
 from lazycls.serializers import Base
-from lazycls.utils import find_binary_in_path, exec_shell
+from lazycls.utils import find_binary_in_path
 from logz import get_logger
 from uuid import uuid1
+from inletscolab.envs import LazyEnv
+from inletscolab.profiler import Profiler, exec_shell
 
 
-try:
-    from google.colab import drive # type: ignore
-    colab_env = True
-except ImportError:
-    colab_env = False
+@functools.lru_cache()
+def is_colab_env() -> bool:
+    """ Checks for google.colab without importing it """
+    try: return importlib.util.find_spec('google.colab') is not None
+    except ImportError: return False
 
 
 authz_dir = Path('/authz')
-authz_dir.mkdir(parents=True, exist_ok=True)
 root_dir = Path.get_parent_path(__file__)
 
 bin_dir = root_dir.joinpath('bin')
@@ -25,28 +31,480 @@ user_exec_dir = Path('/usr/local/bin')
 
 _inlets_installer = scripts_dir.joinpath('get_inlets.sh')
 _inlets_exec = user_exec_dir.joinpath('inletsctl')
+_inlets_pro_exec = user_exec_dir.joinpath('inlets-pro')
 
 _cs_installer = scripts_dir.joinpath('get_codeserver.sh')
+_cs_cache_dir = Path.home().joinpath('.cache/code-server')
+
+# apt and dpkg hold the same lock file, so package installs from concurrent startup phases run one at a time
+_package_lock = threading.Lock()
 
 CSDefaultExtensions = ["ms-python.python", "ms-toolsai.jupyter", "mechatroner.rainbow-csv", "vscode-icons-team.vscode-icons", "tabnine.tabnine-vscode", "almenon.arepl", "kevinrose.vsc-python-indent", "ms-vscode-remote.remote-ssh", "mutantdino.resourcemonitor", "ms-python.vscode-pylance"]
 CSDefaultVersion = "3.12.0"
+CSDefaultExtensionsDir = Path.home().joinpath('.local/share/code-server/extensions').as_posix()
+
+# Mount tunables per performance profile. Explicitly set tunables take precedence
+StorageProfiles = {
+    'default': {},
+    'read-heavy': {'stat_cache_ttl': 60, 'type_cache_ttl': 60, 'stat_cache_entries': 20000, 'cache_size_mb': 10240, 'parallelism': 32},
+    'write-heavy': {'stat_cache_ttl': 5, 'type_cache_ttl': 5, 'cache_size_mb': 0, 'parallelism': 16, 'multipart_size_mb': 64},
+    'many-small-files': {'stat_cache_ttl': 600, 'type_cache_ttl': 600, 'stat_cache_entries': 200000, 'cache_size_mb': 4096, 'parallelism': 64},
+}
 
 logger = get_logger('InletsColab')
 
 DebugEnabled: bool = Env.to_bool('DEBUG_ENABLED')
 
+def decode_mountinfo(field: str) -> str:
+    """ The kernel octal-escapes spaces, tabs, newlines and backslashes in mountinfo paths, i.e. a space is \\040 """
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def get_gauth(*args, **kwargs):
+    """ Env.to_json_b64 writes the decoded credentials under /authz """
+    authz_dir.mkdir(parents=True, exist_ok=True)
+    return Env.to_json_b64(*args, **kwargs)
+
+
+class CacheConfig:
+    cache_dir: str = LazyEnv(Env.to_str, 'ARTIFACT_CACHE_DIR', '/authz/.cache/artifacts')
+    max_size_mb: int = LazyEnv(Env.to_int, 'ARTIFACT_CACHE_MAX_MB', 2048)
+    enabled: bool = LazyEnv(Env.to_bool, 'ARTIFACT_CACHE_ENABLED', 'true')
+    # Entries cached as `latest` are refetched after this many seconds, so new releases are picked up
+    latest_ttl: int = LazyEnv(Env.to_int, 'ARTIFACT_CACHE_LATEST_TTL', 86400)
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classproperty
+    def max_size(cls):
+        return cls.max_size_mb * 1024 * 1024
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'ARTIFACT_CACHE_DIR': cls.cache_dir,
+            'ARTIFACT_CACHE_MAX_MB': cls.max_size_mb,
+            'ARTIFACT_CACHE_ENABLED': cls.enabled,
+            'ARTIFACT_CACHE_LATEST_TTL': cls.latest_ttl,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading CacheConfig from Environment')
+        cls.cache_dir: str = Env.to_str('ARTIFACT_CACHE_DIR', cls.cache_dir)
+        cls.max_size_mb: int = Env.to_int('ARTIFACT_CACHE_MAX_MB', cls.max_size_mb)
+        cls.enabled: bool = Env.to_bool('ARTIFACT_CACHE_ENABLED') or cls.enabled
+        cls.latest_ttl: int = Env.to_int('ARTIFACT_CACHE_LATEST_TTL', cls.latest_ttl)
+
+
+class ReadCacheConfig:
+    cache_dir: str = LazyEnv(Env.to_str, 'READ_CACHE_DIR', '/tmp/inletscolab/readcache')
+    max_size_mb: int = LazyEnv(Env.to_int, 'READ_CACHE_MAX_MB', 10240)
+    workers: int = LazyEnv(Env.to_int, 'READ_CACHE_WORKERS', 8)
+    validate: bool = LazyEnv(Env.to_bool, 'READ_CACHE_VALIDATE', 'true')
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classproperty
+    def max_size(cls):
+        return cls.max_size_mb * 1024 * 1024
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'READ_CACHE_DIR': cls.cache_dir,
+            'READ_CACHE_MAX_MB': cls.max_size_mb,
+            'READ_CACHE_WORKERS': cls.workers,
+            'READ_CACHE_VALIDATE': cls.validate,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading ReadCacheConfig from Environment')
+        cls.cache_dir: str = Env.to_str('READ_CACHE_DIR', cls.cache_dir)
+        cls.max_size_mb: int = Env.to_int('READ_CACHE_MAX_MB', cls.max_size_mb)
+        cls.workers: int = Env.to_int('READ_CACHE_WORKERS', cls.workers)
+        cls.validate: bool = Env.to_bool('READ_CACHE_VALIDATE') or cls.validate
+
+
+class BackupConfig:
+    source: str = LazyEnv(Env.to_str, 'BACKUP_SOURCE', '/content')
+    exclude: List[str] = LazyEnv(Env.to_list, 'BACKUP_EXCLUDE', ['sample_data', 'drive', '.ipynb_checkpoints', '__pycache__'])
+    interval: float = LazyEnv(Env.to_float, 'BACKUP_INTERVAL', 0.0)
+    workers: int = LazyEnv(Env.to_int, 'BACKUP_WORKERS', 8)
+    chunk_size_mb: int = LazyEnv(Env.to_int, 'BACKUP_CHUNK_MB', 8)
+    restore: bool = LazyEnv(Env.to_bool, 'BACKUP_RESTORE')
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classproperty
+    def target(cls):
+        return StorageConfig.storage_backup
+
+    @classproperty
+    def chunk_size(cls):
+        return cls.chunk_size_mb * 1024 * 1024
+
+    @classproperty
+    def index_file(cls):
+        return authz_dir.joinpath('backup', 'index.json')
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'BACKUP_SOURCE': cls.source,
+            'BACKUP_EXCLUDE': cls.exclude,
+            'BACKUP_INTERVAL': cls.interval,
+            'BACKUP_WORKERS': cls.workers,
+            'BACKUP_CHUNK_MB': cls.chunk_size_mb,
+            'BACKUP_RESTORE': cls.restore,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading BackupConfig from Environment')
+        cls.source: str = Env.to_str('BACKUP_SOURCE', cls.source)
+        cls.exclude: List[str] = Env.to_list('BACKUP_EXCLUDE', cls.exclude)
+        cls.interval: float = Env.to_float('BACKUP_INTERVAL', cls.interval)
+        cls.workers: int = Env.to_int('BACKUP_WORKERS', cls.workers)
+        cls.chunk_size_mb: int = Env.to_int('BACKUP_CHUNK_MB', cls.chunk_size_mb)
+        cls.restore: bool = Env.to_bool('BACKUP_RESTORE') or cls.restore
+
+
+class SnapshotConfig:
+    ## Defaults to code-server's user data and extensions, and Jupyter's settings. See `paths`
+    dirs: List[str] = LazyEnv(Env.to_list, 'SNAPSHOT_PATHS', [])
+    exclude: List[str] = LazyEnv(Env.to_list, 'SNAPSHOT_EXCLUDE', ['__pycache__', 'logs', 'CachedExtensionVSIXs', '*.log'])
+    ## Adds the site-packages of this interpreter, where pip installs on top of Colab's packages land
+    packages: bool = LazyEnv(Env.to_bool, 'SNAPSHOT_PACKAGES')
+    ## Defaults to STORAGE_BACKUP/snapshot
+    snapshot_target: str = LazyEnv(Env.to_str, 'SNAPSHOT_TARGET', '')
+    workers: int = LazyEnv(Env.to_int, 'SNAPSHOT_WORKERS', 8)
+    chunk_size_mb: int = LazyEnv(Env.to_int, 'SNAPSHOT_CHUNK_MB', 16)
+    level: int = LazyEnv(Env.to_int, 'SNAPSHOT_LEVEL', 3)
+    restore: bool = LazyEnv(Env.to_bool, 'SNAPSHOT_RESTORE')
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classproperty
+    def paths(cls) -> List[str]:
+        if cls.dirs: return cls.dirs
+        paths = [Path.home().joinpath('.local/share/code-server').as_posix(), Path.home().joinpath('.jupyter').as_posix(), Path.home().joinpath('.local/share/jupyter').as_posix()]
+        if not ServerConfig.extensions_dir.startswith(paths[0]): paths.append(ServerConfig.extensions_dir)
+        if cls.packages:
+            import sysconfig
+            paths.append(sysconfig.get_paths()['purelib'])
+        return paths
+
+    @classproperty
+    def target(cls):
+        if cls.snapshot_target: return cls.snapshot_target
+        if StorageConfig.storage_backup: return StorageConfig.storage_backup.rstrip('/') + '/snapshot'
+        return ''
+
+    @classproperty
+    def chunk_size(cls):
+        return cls.chunk_size_mb * 1024 * 1024
+
+    @classproperty
+    def index_file(cls):
+        return authz_dir.joinpath('snapshot', 'index.json')
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'SNAPSHOT_PATHS': cls.dirs,
+            'SNAPSHOT_EXCLUDE': cls.exclude,
+            'SNAPSHOT_PACKAGES': cls.packages,
+            'SNAPSHOT_TARGET': cls.snapshot_target,
+            'SNAPSHOT_WORKERS': cls.workers,
+            'SNAPSHOT_CHUNK_MB': cls.chunk_size_mb,
+            'SNAPSHOT_LEVEL': cls.level,
+            'SNAPSHOT_RESTORE': cls.restore,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading SnapshotConfig from Environment')
+        cls.dirs: List[str] = Env.to_list('SNAPSHOT_PATHS', cls.dirs)
+        cls.exclude: List[str] = Env.to_list('SNAPSHOT_EXCLUDE', cls.exclude)
+        cls.packages: bool = Env.to_bool('SNAPSHOT_PACKAGES') or cls.packages
+        cls.snapshot_target: str = Env.to_str('SNAPSHOT_TARGET', cls.snapshot_target)
+        cls.workers: int = Env.to_int('SNAPSHOT_WORKERS', cls.workers)
+        cls.chunk_size_mb: int = Env.to_int('SNAPSHOT_CHUNK_MB', cls.chunk_size_mb)
+        cls.level: int = Env.to_int('SNAPSHOT_LEVEL', cls.level)
+        cls.restore: bool = Env.to_bool('SNAPSHOT_RESTORE') or cls.restore
+
+
+class LogConfig:
+    log_dir: str = LazyEnv(Env.to_str, 'LOG_DIR', '/authz/logs')
+    max_lines: int = LazyEnv(Env.to_int, 'LOG_MAX_LINES', 2000)
+    max_line_length: int = LazyEnv(Env.to_int, 'LOG_MAX_LINE_LENGTH', 16384)
+    max_bytes: int = LazyEnv(Env.to_int, 'LOG_MAX_BYTES', 10 * 1024 * 1024)
+    backups: int = LazyEnv(Env.to_int, 'LOG_BACKUPS', 3)
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'LOG_DIR': cls.log_dir,
+            'LOG_MAX_LINES': cls.max_lines,
+            'LOG_MAX_LINE_LENGTH': cls.max_line_length,
+            'LOG_MAX_BYTES': cls.max_bytes,
+            'LOG_BACKUPS': cls.backups,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading LogConfig from Environment')
+        cls.log_dir: str = Env.to_str('LOG_DIR', cls.log_dir)
+        cls.max_lines: int = Env.to_int('LOG_MAX_LINES', cls.max_lines)
+        cls.max_line_length: int = Env.to_int('LOG_MAX_LINE_LENGTH', cls.max_line_length)
+        cls.max_bytes: int = Env.to_int('LOG_MAX_BYTES', cls.max_bytes)
+        cls.backups: int = Env.to_int('LOG_BACKUPS', cls.backups)
+
+
+class SupervisorConfig:
+    enabled: bool = LazyEnv(Env.to_bool, 'SUPERVISOR_ENABLED', 'true')
+    interval: float = LazyEnv(Env.to_float, 'SUPERVISOR_INTERVAL', 1.0)
+    backoff_initial: float = LazyEnv(Env.to_float, 'SUPERVISOR_BACKOFF_INITIAL', 1.0)
+    backoff_max: float = LazyEnv(Env.to_float, 'SUPERVISOR_BACKOFF_MAX', 60.0)
+    jitter: float = LazyEnv(Env.to_float, 'SUPERVISOR_JITTER', 0.2)
+    max_restarts: int = LazyEnv(Env.to_int, 'SUPERVISOR_MAX_RESTARTS', 10)
+    restart_window: float = LazyEnv(Env.to_float, 'SUPERVISOR_RESTART_WINDOW', 600.0)
+    ## Seconds a process is given to exit after SIGTERM before it is sent SIGKILL
+    stop_timeout: float = LazyEnv(Env.to_float, 'SUPERVISOR_STOP_TIMEOUT', 5.0)
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'SUPERVISOR_ENABLED': cls.enabled,
+            'SUPERVISOR_INTERVAL': cls.interval,
+            'SUPERVISOR_BACKOFF_INITIAL': cls.backoff_initial,
+            'SUPERVISOR_BACKOFF_MAX': cls.backoff_max,
+            'SUPERVISOR_JITTER': cls.jitter,
+            'SUPERVISOR_MAX_RESTARTS': cls.max_restarts,
+            'SUPERVISOR_RESTART_WINDOW': cls.restart_window,
+            'SUPERVISOR_STOP_TIMEOUT': cls.stop_timeout,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading SupervisorConfig from Environment')
+        cls.enabled: bool = Env.to_bool('SUPERVISOR_ENABLED') or cls.enabled
+        cls.interval: float = Env.to_float('SUPERVISOR_INTERVAL', cls.interval)
+        cls.backoff_initial: float = Env.to_float('SUPERVISOR_BACKOFF_INITIAL', cls.backoff_initial)
+        cls.backoff_max: float = Env.to_float('SUPERVISOR_BACKOFF_MAX', cls.backoff_max)
+        cls.jitter: float = Env.to_float('SUPERVISOR_JITTER', cls.jitter)
+        cls.max_restarts: int = Env.to_int('SUPERVISOR_MAX_RESTARTS', cls.max_restarts)
+        cls.restart_window: float = Env.to_float('SUPERVISOR_RESTART_WINDOW', cls.restart_window)
+        cls.stop_timeout: float = Env.to_float('SUPERVISOR_STOP_TIMEOUT', cls.stop_timeout)
+
+
+class MetricsConfig:
+    enabled: bool = LazyEnv(Env.to_bool, 'METRICS_ENABLED')
+    host: str = LazyEnv(Env.to_str, 'METRICS_HOST', '127.0.0.1')
+    port: int = LazyEnv(Env.to_int, 'METRICS_PORT', 9108)
+    ## Seconds between tunnel RTT probes. Scrapes in between reuse the last measurement
+    probe_interval: float = LazyEnv(Env.to_float, 'METRICS_PROBE_INTERVAL', 15.0)
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'METRICS_ENABLED': cls.enabled,
+            'METRICS_HOST': cls.host,
+            'METRICS_PORT': cls.port,
+            'METRICS_PROBE_INTERVAL': cls.probe_interval,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading MetricsConfig from Environment')
+        cls.enabled: bool = Env.to_bool('METRICS_ENABLED') or cls.enabled
+        cls.host: str = Env.to_str('METRICS_HOST', cls.host)
+        cls.port: int = Env.to_int('METRICS_PORT', cls.port)
+        cls.probe_interval: float = Env.to_float('METRICS_PROBE_INTERVAL', cls.probe_interval)
+
+
+class WatchdogConfig:
+    enabled: bool = LazyEnv(Env.to_bool, 'WATCHDOG_ENABLED')
+    ## Defaults to INLETS_CLIENT public_url + WATCHDOG_PATH. Whatever answers it must echo the `n` query parameter, as the proxy does
+    probe_url: str = LazyEnv(Env.to_str, 'WATCHDOG_URL', '')
+    path: str = LazyEnv(Env.to_str, 'WATCHDOG_PATH', '/__inletscolab/probe')
+    interval: float = LazyEnv(Env.to_float, 'WATCHDOG_INTERVAL', 10.0)
+    timeout: float = LazyEnv(Env.to_float, 'WATCHDOG_TIMEOUT', 5.0)
+    ## Consecutive failed probes before the inlets client is restarted
+    failures: int = LazyEnv(Env.to_int, 'WATCHDOG_FAILURES', 3)
+    reconnect_timeout: float = LazyEnv(Env.to_float, 'WATCHDOG_RECONNECT_TIMEOUT', 60.0)
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classproperty
+    def url(cls):
+        if cls.probe_url: return cls.probe_url
+        return InletsConfig.public_url.rstrip('/') + cls.path
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'WATCHDOG_ENABLED': cls.enabled,
+            'WATCHDOG_URL': cls.probe_url,
+            'WATCHDOG_PATH': cls.path,
+            'WATCHDOG_INTERVAL': cls.interval,
+            'WATCHDOG_TIMEOUT': cls.timeout,
+            'WATCHDOG_FAILURES': cls.failures,
+            'WATCHDOG_RECONNECT_TIMEOUT': cls.reconnect_timeout,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading WatchdogConfig from Environment')
+        cls.enabled: bool = Env.to_bool('WATCHDOG_ENABLED') or cls.enabled
+        cls.probe_url: str = Env.to_str('WATCHDOG_URL', cls.probe_url)
+        cls.path: str = Env.to_str('WATCHDOG_PATH', cls.path)
+        cls.interval: float = Env.to_float('WATCHDOG_INTERVAL', cls.interval)
+        cls.timeout: float = Env.to_float('WATCHDOG_TIMEOUT', cls.timeout)
+        cls.failures: int = Env.to_int('WATCHDOG_FAILURES', cls.failures)
+        cls.reconnect_timeout: float = Env.to_float('WATCHDOG_RECONNECT_TIMEOUT', cls.reconnect_timeout)
+
+
+class ProxyConfig:
+    enabled: bool = LazyEnv(Env.to_bool, 'PROXY_ENABLED')
+    port: int = LazyEnv(Env.to_int, 'PROXY_PORT', 7071)
+    cache_mb: int = LazyEnv(Env.to_int, 'PROXY_CACHE_MB', 64)
+    compress_level: int = LazyEnv(Env.to_int, 'PROXY_COMPRESS_LEVEL', 6)
+    compress_min_size: int = LazyEnv(Env.to_int, 'PROXY_COMPRESS_MIN', 1024)
+    max_buffer_mb: int = LazyEnv(Env.to_int, 'PROXY_MAX_BUFFER_MB', 32)
+    backend_pool: int = LazyEnv(Env.to_int, 'PROXY_BACKEND_POOL', 16)
+    # Runs the proxy as its own process rather than a thread, so it outlives the process that started it
+    detach: bool = LazyEnv(Env.to_bool, 'PROXY_DETACH')
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classproperty
+    def required(cls):
+        """ The proxy answers the Watchdog's probes, so it also runs, passing responses through, with only WATCHDOG_ENABLED """
+        return cls.enabled or WatchdogConfig.enabled
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'PROXY_ENABLED': cls.enabled,
+            'PROXY_PORT': cls.port,
+            'PROXY_CACHE_MB': cls.cache_mb,
+            'PROXY_COMPRESS_LEVEL': cls.compress_level,
+            'PROXY_COMPRESS_MIN': cls.compress_min_size,
+            'PROXY_MAX_BUFFER_MB': cls.max_buffer_mb,
+            'PROXY_BACKEND_POOL': cls.backend_pool,
+            'PROXY_DETACH': cls.detach,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading ProxyConfig from Environment')
+        cls.enabled: bool = Env.to_bool('PROXY_ENABLED') or cls.enabled
+        cls.port: int = Env.to_int('PROXY_PORT', cls.port)
+        cls.cache_mb: int = Env.to_int('PROXY_CACHE_MB', cls.cache_mb)
+        cls.compress_level: int = Env.to_int('PROXY_COMPRESS_LEVEL', cls.compress_level)
+        cls.compress_min_size: int = Env.to_int('PROXY_COMPRESS_MIN', cls.compress_min_size)
+        cls.max_buffer_mb: int = Env.to_int('PROXY_MAX_BUFFER_MB', cls.max_buffer_mb)
+        cls.backend_pool: int = Env.to_int('PROXY_BACKEND_POOL', cls.backend_pool)
+        cls.detach: bool = Env.to_bool('PROXY_DETACH') or cls.detach
+
+
+class EndpointConfig:
+    ## How candidate tunnel endpoints, listed in INLETS_TUNNEL_HOST and INLETS_SERVER_HOST, are chosen
+    ttl: float = LazyEnv(Env.to_float, 'ENDPOINT_TTL', 600.0)
+    interval: float = LazyEnv(Env.to_float, 'ENDPOINT_INTERVAL', 300.0)
+    samples: int = LazyEnv(Env.to_int, 'ENDPOINT_SAMPLES', 3)
+    timeout: float = LazyEnv(Env.to_float, 'ENDPOINT_TIMEOUT', 2.0)
+    tls: bool = LazyEnv(Env.to_bool, 'ENDPOINT_TLS', 'true')
+    ## A new endpoint has to be this much faster than the current one to switch to it
+    margin: float = LazyEnv(Env.to_float, 'ENDPOINT_MARGIN', 0.2)
+
+    @classmethod
+    def update_config(cls, **kwargs):
+        for k,v in kwargs.items():
+            if getattr(cls, k, None): setattr(cls, k, v)
+
+    @classmethod
+    def export_config(cls):
+        return {
+            'ENDPOINT_TTL': cls.ttl,
+            'ENDPOINT_INTERVAL': cls.interval,
+            'ENDPOINT_SAMPLES': cls.samples,
+            'ENDPOINT_TIMEOUT': cls.timeout,
+            'ENDPOINT_TLS': cls.tls,
+            'ENDPOINT_MARGIN': cls.margin,
+        }
+
+    @classmethod
+    def reload_from_env(cls):
+        logger.info(f'Reloading EndpointConfig from Environment')
+        cls.ttl: float = Env.to_float('ENDPOINT_TTL', cls.ttl)
+        cls.interval: float = Env.to_float('ENDPOINT_INTERVAL', cls.interval)
+        cls.samples: int = Env.to_int('ENDPOINT_SAMPLES', cls.samples)
+        cls.timeout: float = Env.to_float('ENDPOINT_TIMEOUT', cls.timeout)
+        cls.tls: bool = Env.to_bool('ENDPOINT_TLS') or cls.tls
+        cls.margin: float = Env.to_float('ENDPOINT_MARGIN', cls.margin)
+
+
 class InletsConfig:
-    license: str = Env.to_str('INLETS_LICENSE', '')
-    token: str = Env.to_str('INLETS_TOKEN', '')
-    tunnel_host: str = Env.to_str('INLETS_TUNNEL_HOST', '')
-    server_host: str = Env.to_str('INLETS_SERVER_HOST', '')
-    server_port: int = Env.to_int('INLETS_SERVER_PORT', 8123)
-    client_host: str = Env.to_str('INLETS_CLIENT_HOST', '127.0.0.1')
-    client_port: int = Env.to_int('INLETS_CLIENT_PORT', 7070)
-    domain_name: str = Env.to_str('INLETS_DOMAIN', 'localhost')
-    is_cluster: bool = Env.to_bool('INLETS_CLUSTER', 'true')
-    client_type: str = Env.to_str('INLETS_CLIENT_TYPE', 'tcp')
-    use_sudo: bool = Env.to_bool('INLETS_USE_SUDO', 'true')
+    license: str = LazyEnv(Env.to_str, 'INLETS_LICENSE', '')
+    token: str = LazyEnv(Env.to_str, 'INLETS_TOKEN', '')
+    ## Either may list several comma separated candidates, paired by position. See inletscolab.endpoints
+    tunnel_host: str = LazyEnv(Env.to_str, 'INLETS_TUNNEL_HOST', '')
+    server_host: str = LazyEnv(Env.to_str, 'INLETS_SERVER_HOST', '')
+    server_port: int = LazyEnv(Env.to_int, 'INLETS_SERVER_PORT', 8123)
+    client_host: str = LazyEnv(Env.to_str, 'INLETS_CLIENT_HOST', '127.0.0.1')
+    client_port: int = LazyEnv(Env.to_int, 'INLETS_CLIENT_PORT', 7070)
+    domain_name: str = LazyEnv(Env.to_str, 'INLETS_DOMAIN', 'localhost')
+    is_cluster: bool = LazyEnv(Env.to_bool, 'INLETS_CLUSTER', 'true')
+    client_type: str = LazyEnv(Env.to_str, 'INLETS_CLIENT_TYPE', 'tcp')
+    use_sudo: bool = LazyEnv(Env.to_bool, 'INLETS_USE_SUDO', 'true')
+    version: str = LazyEnv(Env.to_str, 'INLETS_VERSION', 'latest')
+    ## Additional upstreams as `name:port[:subdomain],...` or a JSON list. See inletscolab.services
+    services: Union[str, List[Dict[str, Any]]] = LazyEnv(Env.to_str, 'INLETS_SERVICES', '')
+    ## Client processes connected to the same tunnel. The inlets server spreads connections across them
+    clients: int = LazyEnv(Env.to_int, 'INLETS_CLIENTS', 1)
+    ## Budgets for the launched processes. See inletscolab.budgets
+    memory_limit: str = LazyEnv(Env.to_str, 'INLETS_MEMORY_LIMIT', '')
+    cpus: str = LazyEnv(Env.to_str, 'INLETS_CPUS', '')
+    nice: int = LazyEnv(Env.to_int, 'INLETS_NICE', 0)
+    io_class: str = LazyEnv(Env.to_str, 'INLETS_IO_CLASS', '')
+    oom_score_adj: int = LazyEnv(Env.to_int, 'INLETS_OOM_SCORE_ADJ', 0)
 
     @classmethod
     def update_config(cls, **kwargs):
@@ -66,14 +524,27 @@ class InletsConfig:
     def inlets_exists(cls):
         return _inlets_exec.exists()
     
+    @classproperty
+    def active_tunnel_host(cls):
+        """ The tunnel host of the selected endpoint, when several are listed """
+        if ',' not in cls.tunnel_host and ',' not in cls.server_host: return cls.tunnel_host
+        from inletscolab.endpoints import Endpoints
+        return Endpoints.get_selected().tunnel_host
+
+    @classproperty
+    def active_server_host(cls):
+        if ',' not in cls.tunnel_host and ',' not in cls.server_host: return cls.server_host
+        from inletscolab.endpoints import Endpoints
+        return Endpoints.get_selected().server_host
+
     @classproperty
     def tunnel_url(cls):
-        if cls.is_cluster: return f'wss://{cls.tunnel_host}'
-        return f'wss://{cls.server_host}:{cls.server_port}/connect'
+        if cls.is_cluster: return f'wss://{cls.active_tunnel_host}'
+        return f'wss://{cls.active_server_host}:{cls.server_port}/connect'
     
     @classproperty
     def public_url(cls):
-        if cls.is_cluster: return f'https://{cls.server_host}'
+        if cls.is_cluster: return f'https://{cls.active_server_host}'
         if cls.domain_name: return f'https://{cls.domain_name}'
         return f'http://{cls.client_host}:{cls.client_port}'
         
@@ -82,7 +553,10 @@ class InletsConfig:
     def upstream(cls): return cls.client_host
 
     @classproperty
-    def upstream_port(cls): return cls.client_port
+    def upstream_port(cls):
+        # The proxy sits between the tunnel and the Server
+        if ProxyConfig.required: return ProxyConfig.port
+        return cls.client_port
 
     @classproperty
     def systemd_path(cls):
@@ -90,14 +564,27 @@ class InletsConfig:
 
     @classproperty
     def upstream_url(cls):
-        if cls.domain_name: return f'{cls.domain_name}=http://{cls.client_host}:{cls.client_port}'
-        return f'http://{cls.client_host}:{cls.client_port}'
+        if cls.domain_name: return f'{cls.domain_name}=http://{cls.client_host}:{cls.upstream_port}'
+        return f'http://{cls.client_host}:{cls.upstream_port}'
+
+    @classproperty
+    def upstream_ports(cls):
+        from inletscolab.services import Services
+        return [cls.upstream_port] + [s.port for s in Services.get_specs()]
+
+    @classproperty
+    def upstream_urls(cls):
+        from inletscolab.services import Services
+        return [cls.upstream_url] + [s.upstream_url for s in Services.get_specs()]
 
     @classmethod
     def get_cmd(cls):
+        """ Every service shares the one client, as extra tcp ports or extra http upstream mappings """
         cmd = f'inlets-pro {cls.client_type} client --url={cls.tunnel_url}' 
-        if cls.is_cluster: cmd += f' --upstream={cls.upstream} --port={cls.upstream_port} --auto-tls=false'
-        else:  cmd += f' --upstream={cls.upstream_url}'
+        ports = cls.upstream_ports
+        if cls.is_cluster and len(ports) > 1: cmd += f' --upstream={cls.upstream} --ports={",".join(str(p) for p in ports)} --auto-tls=false'
+        elif cls.is_cluster: cmd += f' --upstream={cls.upstream} --port={cls.upstream_port} --auto-tls=false'
+        else: cmd += ''.join(f' --upstream={u}' for u in cls.upstream_urls)
         if cls.token: cmd += f' --token={cls.token}'
         if cls.license: cmd += f' --license-file={cls.lincense_file.string}'
         if cls.use_sudo: cmd = 'sudo ' + cmd 
@@ -128,19 +615,35 @@ class InletsConfig:
         cls.license = license
 
     @classmethod
+    @Profiler.profile('inlets.install')
     def ensure_inlets(cls, overwrite: bool = False):
-        if cls.inlets_exists and not overwrite: return
+        from inletscolab.state import State
+        # Binaries installed outside of InletsColab have no recorded version and are trusted as is
+        if cls.inlets_exists and not overwrite and State.get('installed').get('inlets', cls.version) == cls.version: return
+        from inletscolab.cache import ArtifactCache
+        if CacheConfig.enabled and not overwrite and ArtifactCache.install('inlets', cls.version, user_exec_dir):
+            State.update('installed', inlets = cls.version)
+            return
         logger.info(f'Setting up Inlets. This will take a moment.')
-        exec_shell(f'sudo bash {_inlets_installer.string}')
-        exec_shell('sudo inletsctl download')
+        exec_shell(f'sudo bash {_inlets_installer.string}', check=True)
+        cmd = 'sudo inletsctl download'
+        if cls.version != 'latest': cmd += f' --version {cls.version}'
+        exec_shell(cmd, check=True)
+        if CacheConfig.enabled: ArtifactCache.put('inlets', cls.version, [_inlets_exec, _inlets_pro_exec])
+        State.update('installed', inlets = cls.version)
     
     @classmethod
     def display_info(cls):
         msg = "\n\nInlets Client is Running at: "
-        if cls.is_cluster: msg += f" {cls.server_host}"
+        if cls.is_cluster: msg += f" {cls.active_server_host}"
         else: msg+= f" {cls.domain_name}"
-        msg += f". Listening to: http://{cls.client_host}:{cls.client_port}\n\n"
+        msg += f". Listening to: http://{cls.client_host}:{cls.client_port}"
+        if cls.clients > 1: msg += f" over {cls.clients} connections"
+        msg += "\n\n"
         logger.info(msg)
+        if cls.services:
+            from inletscolab.services import Services
+            Services.display_info()
         logger.warn('Setup is not complete until Server is running.')
 
     @classmethod
@@ -156,7 +659,15 @@ class InletsConfig:
             'INLETS_DOMAIN': cls.domain_name,
             'INLETS_CLIENT_TYPE': cls.client_type,
             'INLETS_CLUSTER': cls.is_cluster,
-            'INLETS_USE_SUDO': cls.use_sudo        
+            'INLETS_USE_SUDO': cls.use_sudo,
+            'INLETS_VERSION': cls.version,
+            'INLETS_SERVICES': cls.services,
+            'INLETS_CLIENTS': cls.clients,
+            'INLETS_MEMORY_LIMIT': cls.memory_limit,
+            'INLETS_CPUS': cls.cpus,
+            'INLETS_NICE': cls.nice,
+            'INLETS_IO_CLASS': cls.io_class,
+            'INLETS_OOM_SCORE_ADJ': cls.oom_score_adj,
         }
     
     @classmethod
@@ -173,18 +684,38 @@ class InletsConfig:
         cls.is_cluster: bool = Env.to_bool('INLETS_CLUSTER') or cls.is_cluster
         cls.client_type: str = Env.to_str('INLETS_CLIENT_TYPE', cls.client_type)
         cls.use_sudo: bool = Env.to_bool('INLETS_USE_SUDO') or cls.use_sudo
+        cls.version: str = Env.to_str('INLETS_VERSION', cls.version)
+        cls.services: str = Env.to_str('INLETS_SERVICES', cls.services)
+        cls.clients: int = Env.to_int('INLETS_CLIENTS', cls.clients)
+        cls.memory_limit: str = Env.to_str('INLETS_MEMORY_LIMIT', cls.memory_limit)
+        cls.cpus: str = Env.to_str('INLETS_CPUS', cls.cpus)
+        cls.nice: int = Env.to_int('INLETS_NICE', cls.nice)
+        cls.io_class: str = Env.to_str('INLETS_IO_CLASS', cls.io_class)
+        cls.oom_score_adj: int = Env.to_int('INLETS_OOM_SCORE_ADJ', cls.oom_score_adj)
         
 
     
 
 class ServerConfig:
-    extensions: List[str] = Env.to_list('CODESERVER_EXTENSIONS', CSDefaultExtensions)
-    version: str = Env.to_str('CODESERVER_VERSION', CSDefaultVersion)
-    authtoken: str = Env.to_str('SERVER_AUTHTOKEN', '')
-    password: str = Env.to_str('SERVER_PASSWORD', '')
-    code: bool = Env.to_bool('RUN_CODE', 'true')
-    lab: bool = Env.to_bool('RUN_LAB')
-    generate_auth: bool = Env.to_bool('GENERATE_AUTH', 'true')
+    extensions: List[str] = LazyEnv(Env.to_list, 'CODESERVER_EXTENSIONS', CSDefaultExtensions)
+    version: str = LazyEnv(Env.to_str, 'CODESERVER_VERSION', CSDefaultVersion)
+    extensions_dir: str = LazyEnv(Env.to_str, 'CODESERVER_EXTENSIONS_DIR', CSDefaultExtensionsDir)
+    extensions_batch_size: int = LazyEnv(Env.to_int, 'CODESERVER_EXTENSIONS_BATCH', 4)
+    extensions_workers: int = LazyEnv(Env.to_int, 'CODESERVER_EXTENSIONS_WORKERS', 2)
+    authtoken: str = LazyEnv(Env.to_str, 'SERVER_AUTHTOKEN', '')
+    password: str = LazyEnv(Env.to_str, 'SERVER_PASSWORD', '')
+    code: bool = LazyEnv(Env.to_bool, 'RUN_CODE', 'true')
+    lab: bool = LazyEnv(Env.to_bool, 'RUN_LAB')
+    generate_auth: bool = LazyEnv(Env.to_bool, 'GENERATE_AUTH', 'true')
+    ## Budgets for the launched processes. See inletscolab.budgets
+    memory_limit: str = LazyEnv(Env.to_str, 'SERVER_MEMORY_LIMIT', '')
+    cpus: str = LazyEnv(Env.to_str, 'SERVER_CPUS', '')
+    nice: int = LazyEnv(Env.to_int, 'SERVER_NICE', 0)
+    io_class: str = LazyEnv(Env.to_str, 'SERVER_IO_CLASS', '')
+    oom_score_adj: int = LazyEnv(Env.to_int, 'SERVER_OOM_SCORE_ADJ', 0)
+    ## Independent Server instances, each on its own cores. See inletscolab.pool
+    instances: int = LazyEnv(Env.to_int, 'SERVER_INSTANCES', 1)
+    pool_port: int = LazyEnv(Env.to_int, 'SERVER_POOL_PORT', 7080)
     lab_token: str = None
     
 
@@ -200,17 +731,34 @@ class ServerConfig:
     @classproperty
     def cs_exec_script(cls): return scripts_dir.joinpath('run_codeserver.sh')
 
+    @classproperty
+    def pool_dir(cls): return authz_dir.joinpath('pool')
+
     @classproperty
     def is_colab(cls):
-        return colab_env
+        return is_colab_env()
     
     @classmethod
+    @Profiler.profile('codeserver.install')
     def ensure_codeserver(cls):
-        if cls.cs_exists or not cls.is_colab: return
+        if not cls.is_colab: return
+        from inletscolab.state import State
+        if cls.cs_exists and State.get('installed').get('code-server', cls.version) == cls.version: return
+        from inletscolab.cache import ArtifactCache
+        # get_codeserver.sh reuses a deb already present in its cache dir
+        if CacheConfig.enabled: ArtifactCache.install('code-server', cls.version, _cs_cache_dir)
         logger.info(f'Setting up CodeServer ver. {cls.version}')
-        exec_shell(f'sudo bash {_cs_installer.string} --version {cls.version}')
-        for ext in cls.extensions:
-            exec_shell(f'code-server --install-extension {ext}')
+        with _package_lock: exec_shell(f'sudo bash {_cs_installer.string} --version {cls.version}', check=True)
+        cs_deb = _cs_cache_dir.joinpath(f'code-server_{cls.version}_{ArtifactCache.arch}.deb')
+        if CacheConfig.enabled and cs_deb.exists() and not ArtifactCache.exists('code-server', cls.version): ArtifactCache.put('code-server', cls.version, [cs_deb])
+        cls.ensure_extensions()
+        State.update('installed', **{'code-server': cls.version})
+
+    @classmethod
+    @Profiler.profile('codeserver.extensions')
+    def ensure_extensions(cls, force: bool = False):
+        from inletscolab.extensions import ExtensionInstaller
+        return ExtensionInstaller.install(cls.extensions, force=force)
 
     @classmethod
     def get_authtoken(cls):
@@ -243,17 +791,21 @@ class ServerConfig:
     def public_url(cls):
         return InletsConfig.public_url
 
+    @classproperty
+    def local_url(cls):
+        return f'http://{cls.host}:{cls.port}/'
+
+
+    @classmethod
+    def build_lab_cmd(cls, port: int, token: str, password: str = ''):
+        return f"jupyter-lab --ip='{cls.host}' --allow-root --ServerApp.allow_remote_access=True --no-browser --ServerApp.token='{token}' --ServerApp.password='{password or ''}' --port={port}"
 
     @classmethod
-    def get_lab_cmd(cls):
-        cmd = f"jupyter-lab --ip='{cls.host}' --allow-root --ServerApp.allow_remote_access=True --no-browser"
+    def get_lab_cmd(cls, port: int = None):
         cls.token = cls.get_lab_token()
         password = cls.get_lab_password()
-        if password: 
-            cls.password = password
-            cmd += f" --ServerApp.token='{cls.token}' --ServerApp.password='{password}' --port={cls.port}"
-        else: cmd += f" --ServerApp.token='{cls.token}' --ServerApp.password='' --port={cls.port}"
-        return cmd
+        if password: cls.password = password
+        return cls.build_lab_cmd(port or cls.port, cls.token, password)
 
     @classmethod
     def get_codeserver_cmd(cls):
@@ -278,6 +830,9 @@ class ServerConfig:
         logger.info(msg)
         if cls.code: logger.info(f'\n\nYour CodeServer is Available Here: {cls.public_url}/?folder=/content\n')
         if cls.password: logger.info(f'\n\nYour CodeServer Password: {cls.password}\n')
+        if cls.instances > 1:
+            from inletscolab.pool import ServerPool
+            ServerPool.display_info()
     
     
     @classmethod
@@ -285,51 +840,84 @@ class ServerConfig:
         logger.info(f'Reloading ServerConfig from Environment')
         cls.extensions: List[str] = Env.to_list('CODESERVER_EXTENSIONS', cls.extensions)
         cls.version: str = Env.to_str('CODESERVER_VERSION', cls.version)
+        cls.extensions_dir: str = Env.to_str('CODESERVER_EXTENSIONS_DIR', cls.extensions_dir)
+        cls.extensions_batch_size: int = Env.to_int('CODESERVER_EXTENSIONS_BATCH', cls.extensions_batch_size)
+        cls.extensions_workers: int = Env.to_int('CODESERVER_EXTENSIONS_WORKERS', cls.extensions_workers)
         cls.authtoken: str = Env.to_str('SERVER_AUTHTOKEN', cls.authtoken)
         cls.password: str = Env.to_str('SERVER_PASSWORD', cls.password)
         cls.code: bool = Env.to_bool('RUN_CODE') or cls.code
         cls.lab: bool = Env.to_bool('RUN_LAB') or cls.lab
         cls.generate_auth: bool = Env.to_bool('GENERATE_AUTH') or cls.generate_auth
+        cls.memory_limit: str = Env.to_str('SERVER_MEMORY_LIMIT', cls.memory_limit)
+        cls.cpus: str = Env.to_str('SERVER_CPUS', cls.cpus)
+        cls.nice: int = Env.to_int('SERVER_NICE', cls.nice)
+        cls.io_class: str = Env.to_str('SERVER_IO_CLASS', cls.io_class)
+        cls.oom_score_adj: int = Env.to_int('SERVER_OOM_SCORE_ADJ', cls.oom_score_adj)
+        cls.instances: int = Env.to_int('SERVER_INSTANCES', cls.instances)
+        cls.pool_port: int = Env.to_int('SERVER_POOL_PORT', cls.pool_port)
 
     @classmethod
     def export_config(cls):
         return {
             'CODESERVER_EXTENSIONS': cls.extensions,
             'CODESERVER_VERSION': cls.version,
+            'CODESERVER_EXTENSIONS_DIR': cls.extensions_dir,
+            'CODESERVER_EXTENSIONS_BATCH': cls.extensions_batch_size,
+            'CODESERVER_EXTENSIONS_WORKERS': cls.extensions_workers,
             'SERVER_AUTHTOKEN': cls.authtoken,
             'SERVER_PASSWORD': cls.password,
             'RUN_CODE': cls.code,
             'RUN_LAB': cls.lab,
-            'GENERATE_AUTH': cls.generate_auth
+            'GENERATE_AUTH': cls.generate_auth,
+            'SERVER_MEMORY_LIMIT': cls.memory_limit,
+            'SERVER_CPUS': cls.cpus,
+            'SERVER_NICE': cls.nice,
+            'SERVER_IO_CLASS': cls.io_class,
+            'SERVER_OOM_SCORE_ADJ': cls.oom_score_adj,
+            'SERVER_INSTANCES': cls.instances,
+            'SERVER_POOL_PORT': cls.pool_port,
         }
 
 
 
 class StorageConfig:
-    mount_drive: bool = Env.to_bool('MOUNT_DRIVE')
-    mount_s3: bool = Env.to_bool('MOUNT_S3')
-    mount_gs: bool = Env.to_bool('MOUNT_GS')
-    mount_minio: bool = Env.to_bool('MOUNT_MINIO')
-    s3_bucket: str = Env.to_str('S3_BUCKET')
-    gs_bucket: str = Env.to_str('GS_BUCKET')
-    minio_bucket: str = Env.to_str('MINIO_BUCKET')
-    s3_mount_path: str = Env.to_str('S3_MOUNT_PATH', '/content/s3')
-    gs_mount_path: str = Env.to_str('GS_MOUNT_PATH', '/content/gs')
-    minio_mount_path: str = Env.to_str('MINIO_MOUNT_PATH', '/content/minio')
+    mount_drive: bool = LazyEnv(Env.to_bool, 'MOUNT_DRIVE')
+    mount_s3: bool = LazyEnv(Env.to_bool, 'MOUNT_S3')
+    mount_gs: bool = LazyEnv(Env.to_bool, 'MOUNT_GS')
+    mount_minio: bool = LazyEnv(Env.to_bool, 'MOUNT_MINIO')
+    s3_bucket: str = LazyEnv(Env.to_str, 'S3_BUCKET')
+    gs_bucket: str = LazyEnv(Env.to_str, 'GS_BUCKET')
+    minio_bucket: str = LazyEnv(Env.to_str, 'MINIO_BUCKET')
+    s3_mount_path: str = LazyEnv(Env.to_str, 'S3_MOUNT_PATH', '/content/s3')
+    gs_mount_path: str = LazyEnv(Env.to_str, 'GS_MOUNT_PATH', '/content/gs')
+    minio_mount_path: str = LazyEnv(Env.to_str, 'MINIO_MOUNT_PATH', '/content/minio')
+    ## Additional Mounts as `provider://bucket=/mount/path,...` or a JSON list of specs
+    mounts: Union[str, List[Dict[str, str]]] = LazyEnv(Env.to_str, 'STORAGE_MOUNTS', '')
+    mount_timeout: float = LazyEnv(Env.to_float, 'MOUNT_TIMEOUT', 60.0)
+    mount_workers: int = LazyEnv(Env.to_int, 'MOUNT_WORKERS', 4)
     ## Auths
     ### GCP
-    gauth: PathLike = Env.to_json_b64('GS_AUTH', 'GOOGLE_APPLICATION_CREDENTIALS', '/authz/adc.json')
-    gproject: str = Env.to_str('GS_PROJECT')
+    gauth: PathLike = LazyEnv(get_gauth, 'GS_AUTH', 'GOOGLE_APPLICATION_CREDENTIALS', '/authz/adc.json')
+    gproject: str = LazyEnv(Env.to_str, 'GS_PROJECT')
     ### AWS
-    s3_key_id: str = Env.to_str_env('AWS_KEYID', 'AWS_ACCESS_KEY_ID', '')
-    s3_secret: str = Env.to_str_env('AWS_SECRET', 'AWS_SECRET_ACCESS_KEY', '')
-    s3_region: str = Env.to_str('AWS_REGION', 'us-east-1')
+    s3_key_id: str = LazyEnv(Env.to_str_env, 'AWS_KEYID', 'AWS_ACCESS_KEY_ID', '')
+    s3_secret: str = LazyEnv(Env.to_str_env, 'AWS_SECRET', 'AWS_SECRET_ACCESS_KEY', '')
+    s3_region: str = LazyEnv(Env.to_str, 'AWS_REGION', 'us-east-1')
     ### Minio
-    minio_endpoint: str = Env.to_str('MINIO_ENDPOINT')
-    minio_key_id: str = Env.to_str('MINIO_KEYID')
-    minio_secret: str = Env.to_str('MINIO_SECRET')
-    ### Backups / Not Used ATM
-    storage_backup: str = Env.to_str('STORAGE_BACKUP', '')
+    minio_endpoint: str = LazyEnv(Env.to_str, 'MINIO_ENDPOINT')
+    minio_key_id: str = LazyEnv(Env.to_str, 'MINIO_KEYID')
+    minio_secret: str = LazyEnv(Env.to_str, 'MINIO_SECRET')
+    ### Backups, a directory (or mounted bucket path) or s3://bucket/prefix. See BackupConfig
+    storage_backup: str = LazyEnv(Env.to_str, 'STORAGE_BACKUP', '')
+    ### Mount Performance
+    mount_profile: str = LazyEnv(Env.to_str, 'MOUNT_PROFILE', 'default')
+    stat_cache_ttl: int = LazyEnv(Env.to_int, 'MOUNT_STAT_CACHE_TTL', None)
+    type_cache_ttl: int = LazyEnv(Env.to_int, 'MOUNT_TYPE_CACHE_TTL', None)
+    stat_cache_entries: int = LazyEnv(Env.to_int, 'MOUNT_STAT_CACHE_ENTRIES', None)
+    cache_dir: str = LazyEnv(Env.to_str, 'MOUNT_CACHE_DIR', '/tmp/inletscolab/mounts')
+    cache_size_mb: int = LazyEnv(Env.to_int, 'MOUNT_CACHE_SIZE_MB', None)
+    parallelism: int = LazyEnv(Env.to_int, 'MOUNT_PARALLELISM', None)
+    multipart_size_mb: int = LazyEnv(Env.to_int, 'MOUNT_MULTIPART_SIZE_MB', None)
     
     @classmethod
     def update_config(cls, **kwargs):
@@ -338,21 +926,56 @@ class StorageConfig:
 
     @classmethod
     def mount_gdrive(cls, force: bool = False):
-        if cls.mount_drive or force and colab_env: drive.mount("/content/drive")
+        if cls.is_mounted('/content/drive'): return
+        if cls.mount_drive or force and is_colab_env():
+            from google.colab import drive # type: ignore
+            drive.mount("/content/drive")
     
     @classmethod
+    @Profiler.profile('storage.setup')
     def setup_storage(cls, **kwargs):
+        """ Skips the setup script when the same config was already mounted and every mount is still in place """
+        from inletscolab.state import State
         if kwargs: cls.update_config(**kwargs)
         cls.write_envfile()
         cls.write_botofile()
         cls.mount_gdrive()
-        if cls.has_mounts:
-            logger.info(f'Setting up Storage. This may take a while...')
-            exec_shell(f'sudo bash {cls.storage_setup_exec_script.string}')
+        if not cls.has_mounts: return
+        from inletscolab.mounts import Mounts
+        config = cls.get_envfile_values()
+        if State.is_current('storage', config) and all(cls.is_mounted(p) for p in cls.mount_paths):
+            logger.info(f'Storage is already mounted at {", ".join(cls.mount_paths)}')
+            return
+        logger.info(f'Setting up Storage. This may take a while...')
+        with _package_lock: exec_shell(f'sudo bash {cls.storage_setup_exec_script.string} {cls.envfile.string} install', check=True)
+        results = Mounts.mount_all()
+        Mounts.display_info(results)
+        # A partial mount is retried on the next start
+        hashes = [State.hash_config(config)] if all(r.ok for r in results) else []
+        State.update('storage', hashes = hashes, mounts = [r.to_dict() for r in results])
+        return results
     
     @classproperty
     def has_mounts(cls):
-        return any([cls.mount_gs, cls.mount_s3, cls.mount_minio])
+        return any([cls.mount_gs, cls.mount_s3, cls.mount_minio, cls.mounts])
+
+    @classproperty
+    def mount_paths(cls):
+        from inletscolab.mounts import Mounts
+        return [s.path for s in Mounts.get_specs()]
+
+    @classproperty
+    def mount_providers(cls):
+        from inletscolab.mounts import Mounts
+        return sorted({s.provider for s in Mounts.get_specs()})
+
+    @classmethod
+    def is_mounted(cls, path: str, mountinfo: str = '/proc/self/mountinfo'):
+        """ Reads the mount points from /proc/self/mountinfo, where the 5th field is the mount point """
+        try:
+            with open(mountinfo) as f: mounts = {decode_mountinfo(line.split()[4]) for line in f if line.strip()}
+        except OSError: return False
+        return (path.rstrip('/') or '/') in mounts
     
     @classproperty
     def envfile(cls): return scripts_dir.joinpath('load_env.sh')
@@ -369,15 +992,54 @@ class StorageConfig:
     @classproperty
     def s3_endpoint(cls): return f'https://s3.{cls.s3_region}.amazonaws.com'
     
+    @classmethod
+    def get_mount_tunables(cls) -> Dict[str, Any]:
+        """ Merges the profile with explicitly set tunables. Unset tunables are left to the mount tool """
+        if cls.mount_profile not in StorageProfiles: raise ValueError(f'Unknown Mount Profile {cls.mount_profile}. Choose from {list(StorageProfiles)}')
+        tunables = dict(StorageProfiles[cls.mount_profile])
+        for k in ['stat_cache_ttl', 'type_cache_ttl', 'stat_cache_entries', 'cache_size_mb', 'parallelism', 'multipart_size_mb']:
+            if getattr(cls, k) is not None: tunables[k] = getattr(cls, k)
+        return tunables
+
+    @classmethod
+    def get_gcsfuse_opts(cls, name: str = 'gs'):
+        t = cls.get_mount_tunables()
+        opts = []
+        if t.get('stat_cache_ttl') is not None: opts.append(f"--stat-cache-ttl={t['stat_cache_ttl']}s")
+        if t.get('type_cache_ttl') is not None: opts.append(f"--type-cache-ttl={t['type_cache_ttl']}s")
+        if t.get('stat_cache_entries'): opts.append(f"--stat-cache-capacity={t['stat_cache_entries']}")
+        if t.get('cache_size_mb') and cls.cache_dir: opts += [f'--cache-dir={cls.cache_dir}/{name}', f"--file-cache-max-size-mb={t['cache_size_mb']}"]
+        if t.get('parallelism'): opts.append(f"--max-conns-per-host={t['parallelism']}")
+        return ' '.join(opts)
+
+    @classmethod
+    def get_s3fs_opts(cls, name: str = 's3'):
+        t = cls.get_mount_tunables()
+        opts = []
+        if t.get('stat_cache_ttl') is not None: opts.append(f"-o stat_cache_expire={t['stat_cache_ttl']}")
+        # s3fs has no type cache, but can cache that objects don't exist
+        if t.get('type_cache_ttl'): opts.append('-o enable_noobj_cache')
+        if t.get('stat_cache_entries'): opts.append(f"-o max_stat_cache_size={t['stat_cache_entries']}")
+        # s3fs can't bound its cache size, only keep that much disk free
+        if t.get('cache_size_mb') and cls.cache_dir: opts += [f'-o use_cache={cls.cache_dir}/{name}', '-o ensure_diskfree=1024']
+        if t.get('parallelism'): opts.append(f"-o parallel_count={t['parallelism']}")
+        if t.get('multipart_size_mb'): opts.append(f"-o multipart_size={t['multipart_size_mb']}")
+        return ' '.join(opts)
+
     @classmethod
     def write_envfile(cls):
+        values = cls.get_envfile_values()
+        if cls.envfile.exists() and cls.envfile.read_text() == values: return
         if DebugEnabled: logger.info(f'Writing Envfile to {cls.envfile.string}')
-        cls.envfile.write_text(cls.get_envfile_values())
+        cls.envfile.write_text(values)
     
     @classmethod
     def write_botofile(cls):
+        values = cls.get_boto_values()
+        if cls.botofile.exists() and cls.botofile.read_text() == values: return
         if DebugEnabled: logger.info(f'Writing Botofile to {cls.botofile.string}')
-        cls.botofile.write_text(cls.get_boto_values())
+        cls.botofile.parent.mkdir(parents=True, exist_ok=True)
+        cls.botofile.write_text(values)
     
     @classmethod
     def get_envfile_data(cls):
@@ -454,6 +1116,14 @@ export BOTO_PATH={cls.botofile.string}
 export BOTO_CONFIG={cls.botofile.string}
 
 export STORAGE_BACKUP={cls.storage_backup}
+
+export STORAGE_MOUNTS='{cls.mounts if isinstance(cls.mounts, str) else json.dumps(cls.mounts)}'
+export MOUNT_PROVIDERS="{' '.join(cls.mount_providers)}"
+export MOUNT_PROFILE={cls.mount_profile}
+export MOUNT_CACHE_DIR={cls.cache_dir}
+export GS_MOUNT_OPTS="{cls.get_gcsfuse_opts('gs')}"
+export S3_MOUNT_OPTS="{cls.get_s3fs_opts('s3')}"
+export MINIO_MOUNT_OPTS="{cls.get_s3fs_opts('minio')}"
 """
         return t
     
@@ -477,7 +1147,18 @@ export STORAGE_BACKUP={cls.storage_backup}
             'MINIO_ENDPOINT': cls.minio_endpoint,
             'MINIO_ACCESS_KEY': cls.minio_key_id,
             'MINIO_SECRET_KEY': cls.minio_secret,
-            'STORAGE_BACKUP': cls.storage_backup
+            'STORAGE_BACKUP': cls.storage_backup,
+            'STORAGE_MOUNTS': cls.mounts,
+            'MOUNT_TIMEOUT': cls.mount_timeout,
+            'MOUNT_WORKERS': cls.mount_workers,
+            'MOUNT_PROFILE': cls.mount_profile,
+            'MOUNT_STAT_CACHE_TTL': cls.stat_cache_ttl,
+            'MOUNT_TYPE_CACHE_TTL': cls.type_cache_ttl,
+            'MOUNT_STAT_CACHE_ENTRIES': cls.stat_cache_entries,
+            'MOUNT_CACHE_DIR': cls.cache_dir,
+            'MOUNT_CACHE_SIZE_MB': cls.cache_size_mb,
+            'MOUNT_PARALLELISM': cls.parallelism,
+            'MOUNT_MULTIPART_SIZE_MB': cls.multipart_size_mb,
         }
     
     @classmethod
@@ -493,8 +1174,11 @@ export STORAGE_BACKUP={cls.storage_backup}
         cls.s3_mount_path: str = Env.to_str('S3_MOUNT_PATH', cls.s3_mount_path)
         cls.gs_mount_path: str = Env.to_str('GS_MOUNT_PATH', cls.gs_mount_path)
         cls.minio_mount_path: str = Env.to_str('MINIO_MOUNT_PATH', cls.minio_mount_path)
+        cls.mounts: str = Env.to_str('STORAGE_MOUNTS', cls.mounts)
+        cls.mount_timeout: float = Env.to_float('MOUNT_TIMEOUT', cls.mount_timeout)
+        cls.mount_workers: int = Env.to_int('MOUNT_WORKERS', cls.mount_workers)
         ### GCP
-        cls.gauth: Type(Path) = Env.to_json_b64('GS_AUTH', 'GOOGLE_APPLICATION_CREDENTIALS', cls.gauth.as_posix())
+        cls.gauth: Type(Path) = get_gauth('GS_AUTH', 'GOOGLE_APPLICATION_CREDENTIALS', cls.gauth.as_posix())
         ### AWS
         cls.s3_key_id: str = Env.to_str_env('AWS_KEYID', 'AWS_ACCESS_KEY_ID', cls.s3_key_id)
         cls.s3_secret: str = Env.to_str_env('AWS_SECRET', 'AWS_SECRET_ACCESS_KEY', cls.s3_secret)
@@ -505,4 +1189,13 @@ export STORAGE_BACKUP={cls.storage_backup}
         cls.minio_secret: str = Env.to_str('MINIO_SECRET', cls.minio_secret)
         ### Backup
         cls.storage_backup: str = Env.to_str('STORAGE_BACKUP', cls.storage_backup)
+        ### Mount Performance
+        cls.mount_profile: str = Env.to_str('MOUNT_PROFILE', cls.mount_profile)
+        cls.stat_cache_ttl: int = Env.to_int('MOUNT_STAT_CACHE_TTL', cls.stat_cache_ttl)
+        cls.type_cache_ttl: int = Env.to_int('MOUNT_TYPE_CACHE_TTL', cls.type_cache_ttl)
+        cls.stat_cache_entries: int = Env.to_int('MOUNT_STAT_CACHE_ENTRIES', cls.stat_cache_entries)
+        cls.cache_dir: str = Env.to_str('MOUNT_CACHE_DIR', cls.cache_dir)
+        cls.cache_size_mb: int = Env.to_int('MOUNT_CACHE_SIZE_MB', cls.cache_size_mb)
+        cls.parallelism: int = Env.to_int('MOUNT_PARALLELISM', cls.parallelism)
+        cls.multipart_size_mb: int = Env.to_int('MOUNT_MULTIPART_SIZE_MB', cls.multipart_size_mb)
         
\ No newline at end of file
@@ -0,0 +1,185 @@
+import ssl
+import time
+import socket
+import statistics
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from lazycls.types import *
+from inletscolab.config import EndpointConfig, InletsConfig, logger, DebugEnabled
+from inletscolab.state import State
+
+"""
+Latency-Aware Tunnel Endpoint Selection
+
+INLETS_TUNNEL_HOST and INLETS_SERVER_HOST may list several inlets servers, i.e. one per region.
+Each candidate is probed in parallel for its TCP connect and TLS handshake time, and the client
+connects to the fastest healthy one. The choice is kept in the State file for ENDPOINT_TTL seconds,
+so reruns keep the running client, and re-evaluated every ENDPOINT_INTERVAL seconds.
+"""
+
+
+def split_hosts(value: str) -> List[str]:
+    return [h.strip() for h in (value or '').split(',') if h.strip()]
+
+
+class Endpoint:
+    def __init__(self, tunnel_host: str = '', server_host: str = ''):
+        self.tunnel_host = tunnel_host
+        self.server_host = server_host
+
+    @property
+    def key(self):
+        return f'{self.tunnel_host}|{self.server_host}'
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """ Where the inlets client connects: the tunnel host in cluster mode, otherwise the server's control port """
+        if InletsConfig.is_cluster:
+            url = urlparse(f'wss://{self.tunnel_host}')
+            return url.hostname, url.port or 443
+        return self.server_host, InletsConfig.server_port
+
+    def __repr__(self):
+        return f'<Endpoint {self.address[0]}:{self.address[1]}>'
+
+
+class Endpoints:
+    selected: Endpoint = None
+    results: Dict[str, Dict[str, Any]] = {}
+    thread: threading.Thread = None
+    _stop = threading.Event()
+    _lock = threading.RLock()
+    _context: ssl.SSLContext = None
+
+    @classmethod
+    def get_candidates(cls) -> List[Endpoint]:
+        """ Pairs the listed tunnel and server hosts by position. A single host is shared by every candidate """
+        tunnels, servers = split_hosts(InletsConfig.tunnel_host), split_hosts(InletsConfig.server_host)
+        count = max(len(tunnels), len(servers), 1)
+        for name, hosts in [('INLETS_TUNNEL_HOST', tunnels), ('INLETS_SERVER_HOST', servers)]:
+            if len(hosts) not in {0, 1, count}: raise ValueError(f'{name} lists {len(hosts)} hosts, but {count} endpoints are configured')
+        pick = lambda hosts, i: hosts[i if len(hosts) > 1 else 0] if hosts else ''
+        return [Endpoint(pick(tunnels, i), pick(servers, i)) for i in range(count)]
+
+    @classmethod
+    def get_context(cls) -> ssl.SSLContext:
+        """ Without verification, no CA bundle is loaded, which would otherwise dominate the measurement """
+        if cls._context is None:
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+            cls._context = ctx
+        return cls._context
+
+    @classmethod
+    def measure(cls, endpoint: Endpoint, timeout: float = None, tls: bool = None) -> Optional[float]:
+        """ Seconds to connect and, with `tls`, complete a TLS handshake. Certificates are not verified, as only latency matters here """
+        timeout = timeout or EndpointConfig.timeout
+        tls = EndpointConfig.tls if tls is None else tls
+        host, port = endpoint.address
+        ctx = cls.get_context() if tls else None
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((host, port), timeout=timeout) as sock:
+                if ctx:
+                    with ctx.wrap_socket(sock, server_hostname=host): pass
+        except (OSError, ssl.SSLError) as e:
+            if DebugEnabled: logger.info(f'Probe of {endpoint} failed: {e}')
+            return None
+        return time.perf_counter() - start
+
+    @classmethod
+    def probe(cls, endpoint: Endpoint, samples: int = None, **kwargs) -> Dict[str, Any]:
+        """ The median of several handshakes. Healthy when at least half of them succeed """
+        samples = max(samples or EndpointConfig.samples, 1)
+        times = [cls.measure(endpoint, **kwargs) for _ in range(samples)]
+        ok = [t for t in times if t is not None]
+        return {'host': endpoint.address[0], 'port': endpoint.address[1], 'healthy': len(ok) * 2 >= samples, 'rtt': statistics.median(ok) if ok else None, 'failures': samples - len(ok)}
+
+    @classmethod
+    def rank(cls, candidates: List[Endpoint] = None, **kwargs) -> List[Tuple[Endpoint, Dict[str, Any]]]:
+        """ Probes every candidate in parallel, returning them fastest healthy first """
+        candidates = candidates or cls.get_candidates()
+        with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            results = list(pool.map(lambda e: cls.probe(e, **kwargs), candidates))
+        ranked = list(zip(candidates, results))
+        ranked.sort(key=lambda r: (not r[1]['healthy'], r[1]['rtt'] if r[1]['rtt'] is not None else float('inf')))
+        return ranked
+
+    @classmethod
+    def select(cls, force: bool = False) -> Endpoint:
+        """
+        Picks the fastest healthy candidate, reusing a choice made within ENDPOINT_TTL unless `force`.
+        The current endpoint is kept unless the new one is ENDPOINT_MARGIN faster, so near ties don't reconnect.
+        """
+        with cls._lock:
+            candidates = cls.get_candidates()
+            by_key = {e.key: e for e in candidates}
+            if len(candidates) == 1:
+                cls.selected = candidates[0]
+                return cls.selected
+            cached = State.get('endpoint')
+            if not force and cached.get('selected') in by_key and time.time() - cached.get('checked', 0) < EndpointConfig.ttl:
+                cls.selected, cls.results = by_key[cached['selected']], cached.get('results', {})
+                if DebugEnabled: logger.info(f'Using {cls.selected}, selected {time.time() - cached["checked"]:.0f}s ago')
+                return cls.selected
+            start = time.perf_counter()
+            ranked = cls.rank(candidates)
+            cls.results = {e.key: r for e, r in ranked}
+            best, best_result = ranked[0]
+            current = cls.selected or by_key.get(cached.get('selected'))
+            current_result = cls.results.get(current.key) if current else None
+            if not best_result['healthy']:
+                logger.warn(f'None of the {len(candidates)} tunnel endpoints answered. Keeping {current or best}')
+                best = current or best
+            elif current and current_result and current_result['healthy'] and best_result['rtt'] >= current_result['rtt'] * (1 - EndpointConfig.margin): best = current
+            changed = cls.selected is not None and best.key != cls.selected.key
+            cls.selected = best
+            State.update('endpoint', selected = best.key, checked = time.time(), results = cls.results)
+            msg = ', '.join(f"{r['host']}:{r['port']} {r['rtt'] * 1000:.1f}ms" if r['healthy'] else f"{r['host']}:{r['port']} down" for _, r in ranked)
+            logger.info(f'{"Switched to" if changed else "Selected"} {best} in {time.perf_counter() - start:.2f}s. {msg}')
+            return cls.selected
+
+    @classmethod
+    def get_selected(cls) -> Endpoint:
+        with cls._lock:
+            if cls.selected is None or cls.selected.key not in {e.key for e in cls.get_candidates()}: cls.select()
+            return cls.selected
+
+    @classmethod
+    def reevaluate(cls, restart: Callable[[], Any] = None) -> bool:
+        """ Probes the candidates again, restarting the inlets client if a faster endpoint was selected """
+        previous = cls.get_selected()
+        if cls.select(force=True).key == previous.key: return False
+        if restart is None:
+            from inletscolab.inlets import Inlets
+            restart = Inlets.restart_client
+        restart()
+        logger.info(f'Inlets Tunnel moved to {cls.selected}. Public URL: {InletsConfig.public_url}')
+        return True
+
+    @classmethod
+    def loop(cls, restart: Callable[[], Any] = None):
+        while not cls._stop.wait(EndpointConfig.interval):
+            try: cls.reevaluate(restart)
+            except Exception as e: logger.error(f'Tunnel endpoint re-evaluation failed: {e}')
+
+    @classmethod
+    def start(cls, restart: Callable[[], Any] = None):
+        """ Re-evaluates the endpoints in the background, when several are listed and ENDPOINT_INTERVAL is set """
+        if cls.thread and cls.thread.is_alive(): return
+        if EndpointConfig.interval <= 0 or len(cls.get_candidates()) < 2: return
+        cls._stop.clear()
+        cls.thread = threading.Thread(target=cls.loop, args=(restart,), name='InletsColab-Endpoints', daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def stop(cls):
+        cls._stop.set()
+        if cls.thread: cls.thread.join(timeout=EndpointConfig.timeout * EndpointConfig.samples + 1.0)
+        cls.thread = None
+
+    @classmethod
+    def status(cls) -> Dict[str, Any]:
+        return {'selected': cls.selected.key if cls.selected else None, 'results': cls.results}
@@ -0,0 +1,19 @@
+from lazycls.types import *
+
+""" Env Values Resolved on First Access """
+
+class LazyEnv:
+    """ Resolves an Env value on first access and then caches it on the class, so nothing is read or written at import """
+    def __init__(self, func: Callable, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.name: str = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        value = self.func(*self.args, **self.kwargs)
+        setattr(owner, self.name, value)
+        return value
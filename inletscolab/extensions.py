@@ -0,0 +1,111 @@
+import re
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from lazycls.types import *
+from lazycls.io import Path
+from lazycls.prop import classproperty
+from inletscolab.config import ServerConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler
+
+""" Batched, Parallel CodeServer Extension Installer """
+
+# publisher.name-1.2.3 or publisher.name-1.2.3-linux-x64
+_ext_dir_re = re.compile(r'^(?P<id>.+?)-(?P<version>\d[\w.+]*)(?:-[a-z0-9]+-[a-z0-9]+)?$')
+
+class ExtensionResult:
+    """ `duration` is that of the whole batch the extension was installed in, as one code-server invocation installs them all """
+    def __init__(self, spec: str, status: str, duration: float = 0.0, batch: int = None):
+        self.spec = spec
+        self.status = status
+        self.duration = duration
+        self.batch = batch
+
+    @property
+    def timing(self):
+        return '' if self.batch is None else f' (batch {self.batch}: {self.duration:.2f}s)'
+
+    def __repr__(self):
+        return f'<ExtensionResult {self.spec}: {self.status}{self.timing}>'
+
+
+class ExtensionInstaller:
+
+    @classproperty
+    def extensions_dir(cls):
+        return Path(ServerConfig.extensions_dir)
+
+    @classmethod
+    def parse(cls, spec: str):
+        """ Splits `publisher.name@version` into (id, version) """
+        ext_id, _, version = spec.partition('@')
+        return ext_id.strip().lower(), (version.strip() or None)
+
+    @classmethod
+    def get_installed(cls) -> Dict[str, List[str]]:
+        """ Reads installed extensions from the extensions directory, i.e. `publisher.name-1.2.3` """
+        installed = {}
+        if not cls.extensions_dir.exists(): return installed
+        for p in cls.extensions_dir.iterdir():
+            if not p.is_dir() or p.name.startswith('.'): continue
+            m = _ext_dir_re.match(p.name.lower())
+            if not m: continue
+            installed.setdefault(m.group('id'), []).append(m.group('version'))
+        return installed
+
+    @classmethod
+    def is_installed(cls, spec: str, installed: Dict[str, List[str]] = None):
+        installed = installed if installed is not None else cls.get_installed()
+        ext_id, version = cls.parse(spec)
+        if ext_id not in installed: return False
+        return version is None or version in installed[ext_id]
+
+    @classmethod
+    def get_cmd(cls, batch: List[str]):
+        cmd = ['code-server']
+        for spec in batch: cmd += ['--install-extension', spec]
+        return cmd
+
+    @classmethod
+    def install_batch(cls, batch: List[str], idx: int = 0):
+        cmd = cls.get_cmd(batch)
+        if DebugEnabled: logger.info(' '.join(cmd))
+        start = time.perf_counter()
+        with Profiler.span('code-server --install-extension', 'subprocess', extensions=batch):
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        duration = time.perf_counter() - start
+        if proc.returncode != 0: logger.error(f'Extension Batch {idx} exited with {proc.returncode}: {proc.stdout.strip()}')
+        installed = cls.get_installed()
+        return [ExtensionResult(spec, 'installed' if cls.is_installed(spec, installed) else 'failed', duration, idx) for spec in batch]
+
+    @classmethod
+    def install(cls, extensions: List[str] = None, batch_size: int = None, workers: int = None, force: bool = False) -> List[ExtensionResult]:
+        """
+        Installs extensions in batches of `batch_size` per code-server invocation,
+        running up to `workers` invocations at a time. Durations are per batch, so with
+        CODESERVER_EXTENSIONS_BATCH=1 they time each extension.
+        """
+        extensions = extensions if extensions is not None else ServerConfig.extensions
+        batch_size = batch_size or ServerConfig.extensions_batch_size
+        workers = workers or ServerConfig.extensions_workers
+        installed = cls.get_installed()
+        results, pending = [], []
+        for spec in extensions:
+            if not force and cls.is_installed(spec, installed): results.append(ExtensionResult(spec, 'skipped'))
+            else: pending.append(spec)
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        if batches:
+            logger.info(f'Installing {len(pending)} CodeServer Extensions in {len(batches)} batches')
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for batch_results in pool.map(cls.install_batch, batches, range(len(batches))):
+                    results.extend(batch_results)
+        cls.display_info(results)
+        return results
+
+    @classmethod
+    def display_info(cls, results: List[ExtensionResult]):
+        msg = "\n\nCodeServer Extensions:\n"
+        for r in results: msg += f"  - {r.spec}: {r.status}{r.timing}\n"
+        logger.info(msg)
+        failed = [r.spec for r in results if r.status == 'failed']
+        if failed: logger.warn(f'Failed to install Extensions: {failed}')
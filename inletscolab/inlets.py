@@ -1,30 +1,204 @@
-from lazycls.utils import exec_shell, exec_daemon, subprocess
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lazycls.types import *
+from lazycls.utils import subprocess
 from inletscolab.config import InletsConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler, exec_shell, exec_daemon
+from inletscolab.probes import Probe, OutputWatcher
+from inletscolab.logs import Logs
+from inletscolab.state import State
+from inletscolab.procs import Procs
+from inletscolab.budgets import Budgets
 
 class Inlets:
     d: subprocess.Popen = None
     svc: bool = False
+    watcher: OutputWatcher = None
+    ready_time: float = None
+    # Extra clients on the same tunnel, keyed by index from 1
+    replicas: Dict[int, subprocess.Popen] = {}
+    replica_watchers: Dict[int, OutputWatcher] = {}
+    # The Supervisor, Watchdog and Endpoints restart clients from their own threads
+    _lock = threading.RLock()
 
     @classmethod
+    @Profiler.profile('inlets.startup')
     def run_startup(cls, license: str = None, overwrite_license: bool = False, **kwargs):
         InletsConfig.update_config(**kwargs)
-        InletsConfig.ensure_inlets()
+        # With several endpoints, probing them overlaps the install
+        from inletscolab.endpoints import Endpoints
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            selected = pool.submit(Endpoints.get_selected)
+            InletsConfig.ensure_inlets()
+            selected.result()
         InletsConfig.create_license(license=license, overwrite=overwrite_license)
 
     @classmethod
     def run_server(cls, license: str = None, overwrite_license: bool = False, **kwargs):
         cls.svc = False
         cls.run_startup(license = license, overwrite_license = overwrite_license, **kwargs)
+        cls.launch_client()
+
+    @classmethod
+    def get_config(cls) -> Dict[str, Any]:
+        """ The config a running client is matched against. The command covers upstreams from Services and the Server Pool """
+        return dict(InletsConfig.export_config(), cmd = InletsConfig.get_cmd())
+
+    @classmethod
+    def adopt(cls) -> bool:
+        """ Reuses an inlets client left running by an earlier start with the same config """
+        handle = State.get_running('inlets', cls.get_config())
+        if not handle: return False
+        if not cls.d or cls.d.pid != handle.pid:
+            cls.d = handle
+            cls.watcher = None
+        logger.info(f'Inlets Client is already running with pid {handle.pid}')
+        return True
+
+    @classmethod
+    @Profiler.profile('inlets.launch')
+    def launch_client(cls, display: bool = True):
+        """ Starts the inlets client, assuming startup has already completed. A client running from the same config is kept """
+        with cls._lock:
+            cls.svc = False
+            if cls.adopt():
+                cls.launch_replicas()
+                if display: InletsConfig.display_info()
+                return
+            if cls.d: cls.kill_server()
+            cls.ready_time = None
+            cmd = InletsConfig.get_cmd()
+            if DebugEnabled: logger.info(cmd)
+            cls.d = exec_daemon(cmd=cmd.split(' '), set_proc_uid=False)
+            cls.watcher = OutputWatcher(Logs.attach('inlets', cls.d))
+            State.record_process('inlets', cls.d.pid, [State.hash_config(cls.get_config())])
+            Budgets.apply('inlets', cls.d.pid)
+            cls.launch_replicas()
+            if display: InletsConfig.display_info()
+
+    @classmethod
+    @Profiler.profile('inlets.ready')
+    def wait_ready(cls, timeout: float = 120.0, display: bool = True):
+        """ Blocks until the inlets client reports the tunnel is connected """
+        if cls.svc or not cls.d:
+            logger.warn('Tunnel readiness can only be detected for the inlets client process')
+            return None
+        # An adopted client's output went to the interpreter that started it
+        if not cls.watcher:
+            logger.info('Inlets Tunnel was connected by an earlier start')
+            return cls.ready_time
+        cls.ready_time = Probe.wait_for(cls.watcher.check, timeout=timeout, name='Inlets Tunnel')
+        logger.info(f'Inlets Tunnel is connected after {cls.ready_time:.2f}s')
+        if cls.replicas: cls.check_replicas(timeout=timeout)
+        if display: InletsConfig.display_info()
+        return cls.ready_time
+
+    @classmethod
+    def launch_replicas(cls):
+        """ 
+        Starts INLETS_CLIENTS - 1 extra clients with the same command. The inlets server balances new 
+        connections across every connected client, so bulk transfers are not limited to one connection.
+        Replicas recorded by an earlier start beyond the current count, or from another config, are stopped.
+        """
+        config = cls.get_config()
+        for name, entry in State.load().items():
+            if not name.startswith('inlets-') or not entry.get('pid'): continue
+            index = int(name.split('-', 1)[1])
+            if index < InletsConfig.clients and State.is_current(name, config): continue
+            Procs.stop_recorded(name)
+        for index in range(1, InletsConfig.clients): cls.launch_replica(index)
+
+    @classmethod
+    def launch_replica(cls, index: int):
+        name = f'inlets-{index}'
+        proc = cls.replicas.get(index)
+        if proc and proc.poll() is None: return
+        handle = State.get_running(name, cls.get_config())
+        if handle:
+            cls.replicas[index] = handle
+            cls.replica_watchers.pop(index, None)
+            return
         cmd = InletsConfig.get_cmd()
-        if DebugEnabled: logger.info(cmd)
-        cls.d = exec_daemon(cmd=cmd.split(' '), set_proc_uid=False)
-        InletsConfig.display_info()
+        cls.replicas[index] = exec_daemon(cmd=cmd.split(' '), set_proc_uid=False)
+        cls.replica_watchers[index] = OutputWatcher(Logs.attach(name, cls.replicas[index]))
+        State.record_process(name, cls.replicas[index].pid, [State.hash_config(cls.get_config())])
+        Budgets.apply(name, cls.replicas[index].pid)
+
+    @classmethod
+    def is_healthy(cls, index: int) -> bool:
+        """ The replica is running and has connected, or was adopted from an earlier start """
+        proc = cls.replicas.get(index)
+        if not proc or proc.poll() is not None: return False
+        watcher = cls.replica_watchers.get(index)
+        return watcher is None or watcher.matched.is_set()
+
+    @classmethod
+    def check_replicas(cls, timeout: float = 30.0) -> List[int]:
+        """ 
+        Waits for the replicas to connect, returning the healthy ones. A replica that fails is stopped, 
+        which takes it out of the inlets server's rotation until the Supervisor restarts it.
+        """
+        healthy = []
+        for index, watcher in list(cls.replica_watchers.items()):
+            try: Probe.wait_for(watcher.check, timeout=timeout, name=f'Inlets Client {index}')
+            except (TimeoutError, RuntimeError) as e:
+                logger.error(f'Inlets Client {index} is unhealthy and was removed from rotation: {e}')
+                cls.kill_replica(index, forget=False)
+        for index in sorted(cls.replicas):
+            if cls.is_healthy(index): healthy.append(index)
+        logger.info(f'{len(healthy) + 1} of {InletsConfig.clients} Inlets Clients are connected')
+        return healthy
+
+    @classmethod
+    def kill_replica(cls, index: int, forget: bool = True):
+        """ With `forget`, the replica is also no longer supervised or restarted """
+        proc = cls.replicas.pop(index, None) if forget else cls.replicas.get(index)
+        if proc: Procs.stop(proc, name=f'Inlets Client {index}')
+        if forget: cls.replica_watchers.pop(index, None)
+        Procs.stop_recorded(f'inlets-{index}')
+
+    @classmethod
+    def restart_replica(cls, index: int):
+        with cls._lock:
+            cls.kill_replica(index)
+            cls.launch_replica(index)
+
+    @classmethod
+    def supervise(cls):
+        from inletscolab.supervisor import Supervisor
+        Supervisor.watch('inlets', lambda: None if cls.svc else cls.d, cls.restart_client)
+        for index in range(1, InletsConfig.clients): Supervisor.watch(f'inlets-{index}', lambda index=index: cls.replicas.get(index), lambda index=index: cls.restart_replica(index))
     
     @classmethod
     def kill_server(cls):
-        if not cls.d: return
-        cls.d.kill()
+        """ Stops the inlets clients gracefully, including ones started by another process """
+        for index in list(cls.replicas): cls.kill_replica(index)
+        for name in [c for c in State.load() if c.startswith('inlets-')]: Procs.stop_recorded(name)
+        if cls.d: Procs.stop(cls.d, name='Inlets Client')
+        Procs.stop_recorded('inlets')
         cls.d = None
+        cls.watcher = None
+
+    @classmethod
+    def restart_client(cls):
+        """ Relaunches the inlets client after it has exited """
+        with cls._lock:
+            if cls.d: Procs.stop(cls.d, name='Inlets Client')
+            cls.d = None
+            State.update('inlets', pid = None)
+            cls.launch_client(display=False)
+
+    @classmethod
+    def reconnect(cls, timeout: float = 30.0):
+        """
+        Restarts the client and every replica. The inlets server balances across all of them, so a stalled
+        tunnel can be on any one. Replicas that don't connect again are taken out of rotation
+        """
+        with cls._lock:
+            for index in list(cls.replicas): cls.kill_replica(index, forget=False)
+            cls.restart_client()
+        if cls.replica_watchers: cls.check_replicas(timeout=timeout)
 
     @classmethod
     def create_service(cls, overwrite: bool = False):
@@ -38,6 +212,10 @@ class Inlets:
     @classmethod
     def exec_service(cls, cmd: str):
         if not InletsConfig.systemd_path.exists(): return
+        # Colab and most containers don't run systemd, where systemctl can only fail
+        if not os.path.isdir('/run/systemd/system'):
+            logger.warn(f'systemd is not running. Skipping systemctl {cmd} inlets')
+            return
         cmd = f'systemctl {cmd} inlets'
         if InletsConfig.use_sudo: cmd = 'sudo ' + cmd
         if DebugEnabled: logger.info(cmd)
@@ -72,6 +250,12 @@ class Inlets:
         """ Runs all the processes to start the serice """
         cls.svc = True
         cls.run_startup(license = license, overwrite_license = overwrite_license, **kwargs)
+        cls.launch_service(overwrite_service = overwrite_service)
+
+    @classmethod
+    def launch_service(cls, overwrite_service: bool = False):
+        """ Creates and starts the systemd service, assuming startup has already completed """
+        cls.svc = True
         cls.create_service(overwrite= overwrite_service)
         cls.enable_service()
         cls.start_service()
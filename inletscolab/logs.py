@@ -0,0 +1,154 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import logging
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from lazycls.types import *
+from lazycls.io import Path
+from lazycls.utils import subprocess
+from inletscolab.config import LogConfig, logger
+
+""" Bounded, Non-Blocking Log Capture for Supervised Processes """
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst: shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class LogPipe:
+    """ Drains a process' stdout/stderr into a ring buffer, and optionally rotating, compressed JSONL files """
+    def __init__(self, name: str, proc: subprocess.Popen, max_lines: int = None, log_dir: str = None):
+        self.name = name
+        self.proc = proc
+        self.lines = deque(maxlen=max_lines or LogConfig.max_lines)
+        self.seq: int = 0
+        self.cond = threading.Condition()
+        self.listeners: List[Callable[[str], Any]] = []
+        self.writer: logging.Logger = None
+        log_dir = log_dir if log_dir is not None else LogConfig.log_dir
+        if log_dir: self.writer = self.get_writer(name, log_dir)
+        self.threads = [threading.Thread(target=self.drain, args=(stream, label), name=f'LogPipe-{name}-{label}', daemon=True) for stream, label in ((proc.stdout, 'stdout'), (proc.stderr, 'stderr')) if stream]
+        for t in self.threads: t.start()
+
+    @classmethod
+    def get_path(cls, name: str, log_dir: str = None):
+        return Path(log_dir or LogConfig.log_dir).joinpath(f'{name}.jsonl')
+
+    @classmethod
+    def get_writer(cls, name: str, log_dir: str):
+        path = cls.get_path(name, log_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        writer = logging.getLogger(f'inletscolab.logs.{name}')
+        writer.propagate = False
+        writer.setLevel(logging.INFO)
+        for h in list(writer.handlers):
+            writer.removeHandler(h)
+            h.close()
+        handler = RotatingFileHandler(path.string, maxBytes=LogConfig.max_bytes, backupCount=LogConfig.backups)
+        handler.namer = lambda n: n + '.gz'
+        handler.rotator = _gzip_rotator
+        writer.addHandler(handler)
+        return writer
+
+    def add_listener(self, func: Callable[[str], Any]):
+        with self.cond:
+            self.listeners.append(func)
+            for _, _, line in self.lines: func(line)
+
+    def drain(self, stream, label: str):
+        for line in iter(lambda: stream.readline(LogConfig.max_line_length), b''):
+            if isinstance(line, bytes): line = line.decode(errors='replace')
+            if not line: break
+            line = line.rstrip('\n')
+            record = (time.time(), label, line)
+            with self.cond:
+                self.lines.append(record)
+                self.seq += 1
+                self.cond.notify_all()
+            for func in self.listeners:
+                try: func(line)
+                except Exception as e: logger.error(f'Log listener for {self.name} failed: {e}')
+            if self.writer: self.writer.info(json.dumps({'ts': record[0], 'name': self.name, 'stream': label, 'line': line}))
+
+    def tail(self, n: int = 50) -> List[str]:
+        with self.cond: return [line for _, _, line in list(self.lines)[-n:]]
+
+    def follow(self, n: int = 10, timeout: float = None):
+        """ Yields the last `n` lines and then new lines as they arrive, until the process exits or `timeout` passes idle """
+        with self.cond:
+            for _, _, line in list(self.lines)[-n:]: yield line
+            seen = self.seq
+        while True:
+            with self.cond:
+                if self.seq == seen:
+                    if self.proc.poll() is not None and not any(t.is_alive() for t in self.threads): return
+                    if not self.cond.wait(timeout=timeout or 1.0) and timeout: return
+                new = min(self.seq - seen, len(self.lines))
+                records = list(self.lines)[-new:] if new else []
+                seen = self.seq
+            for _, _, line in records: yield line
+
+
+class Logs:
+    pipes: Dict[str, LogPipe] = {}
+
+    @classmethod
+    def attach(cls, name: str, proc: subprocess.Popen, **kwargs):
+        cls.pipes[name] = LogPipe(name, proc, **kwargs)
+        return cls.pipes[name]
+
+    @classmethod
+    def get(cls, name: str):
+        return cls.pipes.get(name)
+
+    @classmethod
+    def read_file(cls, name: str, n: int = 50, log_dir: str = None):
+        path = LogPipe.get_path(name, log_dir)
+        if not path.exists(): return []
+        with open(path.string, 'rb') as f:
+            # Only the end of the file is needed, so avoid reading all of it
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - n * LogConfig.max_line_length, 0))
+            lines = f.read().decode(errors='replace').splitlines()[-n:]
+        out = []
+        for l in lines:
+            try: out.append(json.loads(l)['line'])
+            except (ValueError, KeyError): continue
+        return out
+
+    @classmethod
+    def follow_file(cls, name: str, n: int = 10, log_dir: str = None, interval: float = 0.5):
+        """ Follows the JSONL file, for use from a process other than the one capturing the logs """
+        yield from cls.read_file(name, n, log_dir)
+        path = LogPipe.get_path(name, log_dir)
+        pos = path.stat().st_size if path.exists() else 0
+        while True:
+            time.sleep(interval)
+            if not path.exists(): continue
+            size = path.stat().st_size
+            # Rotated underneath us
+            if size < pos: pos = 0
+            if size == pos: continue
+            with open(path.string, 'rb') as f:
+                f.seek(pos)
+                data = f.read()
+            # Hold back a partial trailing line
+            data = data[:data.rfind(b'\n') + 1]
+            pos += len(data)
+            for l in data.decode(errors='replace').splitlines():
+                try: yield json.loads(l)['line']
+                except (ValueError, KeyError): continue
+
+    @classmethod
+    def tail(cls, name: str, n: int = 50):
+        if name in cls.pipes: return cls.pipes[name].tail(n)
+        return cls.read_file(name, n)
+
+    @classmethod
+    def follow(cls, name: str, n: int = 10):
+        if name in cls.pipes: return cls.pipes[name].follow(n)
+        return cls.follow_file(name, n)
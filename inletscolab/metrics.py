@@ -0,0 +1,206 @@
+import os
+import time
+import socket
+import threading
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from lazycls.types import *
+from inletscolab.config import MetricsConfig, InletsConfig, StorageConfig, logger, DebugEnabled
+from inletscolab.state import State, pid_alive
+
+""" Prometheus Text Exposition of Process, Readiness, Mount and Tunnel Metrics """
+
+_clk_tck = os.sysconf('SC_CLK_TCK')
+_page_size = os.sysconf('SC_PAGE_SIZE')
+
+
+def read_proc_stat(pid: int) -> Optional[Tuple[float, int, float]]:
+    """ Returns the cpu seconds, rss bytes and start time in seconds since boot from /proc/<pid>/stat """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f: data = f.read()
+    except OSError: return None
+    # The command name may contain spaces, so fields are counted from its closing paren
+    fields = data[data.rindex(b')') + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / _clk_tck, int(fields[21]) * _page_size, int(fields[19]) / _clk_tck
+
+
+def read_uptime() -> float:
+    with open('/proc/uptime') as f: return float(f.read().split()[0])
+
+
+def escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Exposition:
+    """ Collects samples grouped by metric, rendering each metric's HELP and TYPE once """
+    def __init__(self):
+        self.metrics: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def add(self, name: str, kind: str, help: str, value: Any, **labels):
+        if value is None: return
+        metric = self.metrics.setdefault(f'inletscolab_{name}', (kind, help, []))
+        label_str = ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+        metric[2].append(f'inletscolab_{name}{{{label_str}}} {float(value)}' if label_str else f'inletscolab_{name} {float(value)}')
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, samples) in self.metrics.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}'] + samples
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """ Collection only reads /proc and in-process state, so a scrape does not spawn any processes """
+    server: ThreadingHTTPServer = None
+    thread: threading.Thread = None
+    # pid -> (sample time, cpu seconds), for the cpu usage since the last scrape
+    _samples: Dict[int, Tuple[float, float]] = {}
+    _rtt: Tuple[float, Optional[float]] = (0.0, None)
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_processes(cls) -> Dict[str, int]:
+        """ Processes recorded in the State file, including those of earlier starts """
+        return {name: entry['pid'] for name, entry in State.load().items() if entry.get('pid') and pid_alive(entry['pid'], entry.get('cmdline'))}
+
+    @classmethod
+    def get_tunnel_rtt(cls) -> Optional[float]:
+        """ TCP connect time to the inlets server, measured at most once per probe interval """
+        with cls._lock:
+            last, rtt = cls._rtt
+            if time.monotonic() - last < MetricsConfig.probe_interval: return rtt
+            url = urlparse(InletsConfig.tunnel_url)
+            rtt = None
+            if url.hostname:
+                start = time.perf_counter()
+                try:
+                    with socket.create_connection((url.hostname, url.port or 443), timeout=2.0): rtt = time.perf_counter() - start
+                except OSError: pass
+            cls._rtt = (time.monotonic(), rtt)
+            return rtt
+
+    @classmethod
+    def collect_processes(cls, exp: Exposition):
+        uptime, now = read_uptime(), time.monotonic()
+        stats = {}
+        for name, pid in cls.get_processes().items():
+            stat = read_proc_stat(pid)
+            if not stat: continue
+            stats[name] = (pid, stat)
+            cpu, rss, started = stat
+            exp.add('process_cpu_seconds_total', 'counter', 'User and system cpu time of the process', cpu, process=name, pid=pid)
+            exp.add('process_resident_memory_bytes', 'gauge', 'Resident set size of the process', rss, process=name, pid=pid)
+            exp.add('process_uptime_seconds', 'gauge', 'Seconds since the process started', uptime - started, process=name, pid=pid)
+        # Scrapes are served from several threads
+        with cls._lock:
+            for name, (pid, (cpu, _, _)) in stats.items():
+                prev = cls._samples.get(pid)
+                if prev and now > prev[0]: exp.add('process_cpu_usage_ratio', 'gauge', 'Cpu cores used since the previous scrape', (cpu - prev[1]) / (now - prev[0]), process=name, pid=pid)
+                cls._samples[pid] = (now, cpu)
+            seen = {pid for pid, _ in stats.values()}
+            for pid in set(cls._samples) - seen: cls._samples.pop(pid)
+
+    @classmethod
+    def collect_supervisor(cls, exp: Exposition):
+        from inletscolab.supervisor import Supervisor
+        for name, s in Supervisor.stats().items():
+            exp.add('restarts_total', 'counter', 'Restarts by the Supervisor', s['restarts'], process=name)
+            exp.add('downtime_seconds_total', 'counter', 'Seconds spent down before a restart', s['downtime'], process=name)
+            exp.add('process_down', 'gauge', 'The process has exited and not been restarted yet', s['down'] or s['gave_up'], process=name)
+
+    @classmethod
+    def collect_readiness(cls, exp: Exposition):
+        from inletscolab.server import Server
+        from inletscolab.inlets import Inlets
+        exp.add('ready_seconds', 'gauge', 'Seconds from launch until the component was ready', Server.ready_time, component='server')
+        exp.add('ready_seconds', 'gauge', 'Seconds from launch until the component was ready', Inlets.ready_time, component='inlets')
+        if InletsConfig.clients > 1: exp.add('inlets_clients_healthy', 'gauge', 'Connected inlets clients', 1 + sum(Inlets.is_healthy(i) for i in Inlets.replicas))
+
+    @classmethod
+    def collect_mounts(cls, exp: Exposition):
+        from inletscolab.mounts import Mounts
+        setup = {r.spec.path: r for r in Mounts.results}
+        for spec in Mounts.get_specs():
+            mounted = StorageConfig.is_mounted(spec.path)
+            start = time.perf_counter()
+            # A hung FUSE mount fails the stat rather than blocking the scrape
+            responsive = mounted and Mounts.stat(spec.path, timeout=2.0)
+            exp.add('mount_up', 'gauge', 'The mount is present and answered a stat', responsive, path=spec.path, provider=spec.provider)
+            if mounted: exp.add('mount_stat_seconds', 'gauge', 'Latency of a stat of the mount root', time.perf_counter() - start, path=spec.path, provider=spec.provider)
+            if spec.path in setup: exp.add('mount_setup_seconds', 'gauge', 'Seconds taken to mount at startup', setup[spec.path].duration, path=spec.path, provider=spec.provider)
+
+    @classmethod
+    def collect_watchdog(cls, exp: Exposition):
+        from inletscolab.watchdog import Watchdog
+        s = Watchdog.get_stats()
+        if not s['probes']: return
+        exp.add('watchdog_probes_total', 'counter', 'End to end probes through the public URL', s['probes'])
+        exp.add('watchdog_failures_total', 'counter', 'Failed end to end probes', s['failures'])
+        exp.add('watchdog_failure_streak', 'gauge', 'Consecutive failed probes', s['streak'])
+        exp.add('watchdog_rtt_seconds', 'gauge', 'Round trip time of the last passing probe', s['last_rtt'])
+        exp.add('watchdog_reconnects_total', 'counter', 'Inlets client restarts after the tunnel stalled', s['reconnects'])
+        exp.add('watchdog_reconnect_seconds', 'gauge', 'Seconds from the last restart until probes passed again', s['last_reconnect'])
+
+    @classmethod
+    def collect_budgets(cls, exp: Exposition):
+        from inletscolab.budgets import Budgets
+        for name, u in Budgets.get_usage().items():
+            exp.add('budget_memory_bytes', 'gauge', 'Resident memory of the process tree', u.get('memory'), process=name)
+            if u['budget'].get('memory'): exp.add('budget_memory_limit_bytes', 'gauge', 'Memory budget of the process tree', u['budget']['memory'], process=name)
+            exp.add('budget_cpu_seconds_total', 'counter', 'User and system cpu time of the process tree', u['cpu_seconds'], process=name)
+            if 'oom_kills' in u: exp.add('budget_oom_kills_total', 'counter', 'Processes OOM killed within the memory budget', u['oom_kills'], process=name)
+
+    @classmethod
+    def collect_endpoints(cls, exp: Exposition):
+        from inletscolab.endpoints import Endpoints
+        if not Endpoints.results: return
+        for key, r in Endpoints.results.items():
+            endpoint = f"{r['host']}:{r['port']}"
+            exp.add('endpoint_up', 'gauge', 'The tunnel endpoint answered at its last probe', r['healthy'], endpoint=endpoint)
+            exp.add('endpoint_rtt_seconds', 'gauge', 'Median connect and TLS handshake time of the tunnel endpoint', r['rtt'], endpoint=endpoint)
+            exp.add('endpoint_selected', 'gauge', 'The inlets client connects to this endpoint', bool(Endpoints.selected) and Endpoints.selected.key == key, endpoint=endpoint)
+
+    @classmethod
+    def collect(cls) -> str:
+        exp = Exposition()
+        for collector in [cls.collect_processes, cls.collect_supervisor, cls.collect_readiness, cls.collect_mounts, cls.collect_watchdog, cls.collect_budgets, cls.collect_endpoints]:
+            try: collector(exp)
+            except Exception as e: logger.error(f'Metrics collector {collector.__name__} failed: {e}')
+        exp.add('tunnel_rtt_seconds', 'gauge', 'TCP connect time to the inlets server', cls.get_tunnel_rtt())
+        exp.add('tunnel_up', 'gauge', 'The inlets server accepted a TCP connection at the last probe', cls._rtt[1] is not None)
+        return exp.render()
+
+    @classmethod
+    def start(cls, host: str = None, port: int = None):
+        """ Serves /metrics from a daemon thread """
+        if cls.thread and cls.thread.is_alive(): return cls.server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = cls.collect().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args):
+                if DebugEnabled: logger.info(f'Metrics: {format % args}')
+
+        cls.server = ThreadingHTTPServer((host or MetricsConfig.host, port if port is not None else MetricsConfig.port), Handler)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever, name='InletsColab-Metrics', daemon=True)
+        cls.thread.start()
+        logger.info(f'Serving Metrics at http://{cls.server.server_address[0]}:{cls.server.server_address[1]}/metrics')
+        return cls.server
+
+    @classmethod
+    def stop(cls):
+        if not cls.server: return
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.server = cls.thread = None
@@ -0,0 +1,161 @@
+import os
+import time
+import json
+import shlex
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from lazycls.types import *
+from inletscolab.config import StorageConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler
+
+""" Concurrent Bucket Mounting with Readiness Verification """
+
+_providers = {'gs', 's3', 'minio'}
+
+class MountSpec:
+    def __init__(self, provider: str, bucket: str, path: str, options: str = ''):
+        if provider not in _providers: raise ValueError(f'Unknown Mount Provider {provider}. Choose from {sorted(_providers)}')
+        self.provider = provider
+        self.bucket = bucket
+        self.path = path.rstrip('/') or '/'
+        self.options = options or ''
+
+    @classmethod
+    def parse(cls, spec: Union[str, Dict[str, str]]):
+        """ Accepts `provider://bucket=/mount/path` or a dict with provider, bucket, path and options """
+        if isinstance(spec, dict): return cls(**spec)
+        target, _, path = spec.partition('=')
+        provider, sep, bucket = target.partition('://')
+        if not sep or not bucket or not path: raise ValueError(f'Invalid Mount Spec {spec}. Expected provider://bucket=/mount/path')
+        return cls(provider.strip(), bucket.strip(), path.strip())
+
+    @property
+    def name(self):
+        return f'{self.provider}-{self.bucket}'.replace('/', '_')
+
+    def get_cmd(self) -> List[str]:
+        """ The bucket and path are single arguments, so spaces in either don't split them. Mounts run as root, as in setup_storage.sh """
+        options = shlex.split(self.options)
+        if self.provider == 'gs': return ['sudo', '--preserve-env=GOOGLE_APPLICATION_CREDENTIALS', 'gcsfuse'] + shlex.split(StorageConfig.get_gcsfuse_opts(self.name)) + options + [self.bucket, self.path]
+        cmd = ['sudo', 's3fs', self.bucket, self.path]
+        if self.provider == 's3': cmd += ['-o', 'passwd_file=/etc/passwd-s3fs']
+        else: cmd += ['-o', 'passwd_file=/etc/passwd-miniofs', '-o', f'url={StorageConfig.minio_endpoint}/', '-o', 'use_path_request_style']
+        return cmd + shlex.split(StorageConfig.get_s3fs_opts(self.name)) + options
+
+    def to_dict(self):
+        return {'provider': self.provider, 'bucket': self.bucket, 'path': self.path, 'options': self.options}
+
+    def __repr__(self):
+        return f'<MountSpec {self.provider}://{self.bucket} -> {self.path}>'
+
+
+class MountResult:
+    def __init__(self, spec: MountSpec, status: str, duration: float = 0.0, error: str = None):
+        self.spec = spec
+        self.status = status
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status in {'mounted', 'exists'}
+
+    def to_dict(self):
+        return {'path': self.spec.path, 'status': self.status, 'duration': round(self.duration, 3), 'error': self.error}
+
+    def __repr__(self):
+        return f'<MountResult {self.spec.path}: {self.status} ({self.duration:.2f}s)>'
+
+
+class Mounts:
+    # The results of the last mount_all, for reporting
+    results: List[MountResult] = []
+
+    @classmethod
+    def get_specs(cls) -> List[MountSpec]:
+        """ The single-bucket MOUNT_GS / MOUNT_S3 / MOUNT_MINIO settings, followed by STORAGE_MOUNTS """
+        specs = []
+        if StorageConfig.mount_gs and StorageConfig.gs_bucket: specs.append(MountSpec('gs', StorageConfig.gs_bucket, StorageConfig.gs_mount_path))
+        if StorageConfig.mount_s3 and StorageConfig.s3_bucket: specs.append(MountSpec('s3', StorageConfig.s3_bucket, StorageConfig.s3_mount_path))
+        if StorageConfig.mount_minio and StorageConfig.minio_bucket: specs.append(MountSpec('minio', StorageConfig.minio_bucket, StorageConfig.minio_mount_path))
+        mounts = StorageConfig.mounts
+        if isinstance(mounts, str):
+            mounts = json.loads(mounts) if mounts.strip().startswith('[') else [m for m in mounts.split(',') if m.strip()]
+        specs += [MountSpec.parse(m) for m in mounts or []]
+        paths = [s.path for s in specs]
+        dupes = {p for p in paths if paths.count(p) > 1}
+        if dupes: raise ValueError(f'Multiple Mounts share the paths {sorted(dupes)}')
+        return specs
+
+    @classmethod
+    def stat(cls, path: str, timeout: float) -> bool:
+        """
+        Stats the mount root in a daemon thread, since a hung FUSE mount blocks the caller indefinitely.
+        A stat that never returns leaves only that thread behind, which doesn't keep the interpreter alive
+        """
+        done = threading.Event()
+        result = []
+
+        def run():
+            try:
+                os.stat(path)
+                result.append(True)
+            except OSError: pass
+            finally: done.set()
+
+        threading.Thread(target=run, name=f'InletsColab-Stat-{path}', daemon=True).start()
+        return done.wait(timeout) and bool(result)
+
+    @classmethod
+    def verify(cls, path: str, timeout: float = 10.0) -> bool:
+        """ The path is a mount point in /proc/self/mountinfo and answers a stat within `timeout` """
+        deadline = time.perf_counter() + timeout
+        while not StorageConfig.is_mounted(path):
+            if time.perf_counter() > deadline: return False
+            time.sleep(0.1)
+        return cls.stat(path, max(deadline - time.perf_counter(), 0.5))
+
+    @classmethod
+    def mount(cls, spec: MountSpec, timeout: float = None) -> MountResult:
+        timeout = timeout or StorageConfig.mount_timeout
+        start = time.perf_counter()
+        with Profiler.span(f'mount {spec.path}', 'storage', provider=spec.provider):
+            if StorageConfig.is_mounted(spec.path):
+                status = 'exists' if cls.stat(spec.path, timeout) else 'unresponsive'
+                return MountResult(spec, status, time.perf_counter() - start, None if status == 'exists' else 'Existing mount did not answer a stat')
+            os.makedirs(spec.path, exist_ok=True)
+            if StorageConfig.cache_dir: os.makedirs(os.path.join(StorageConfig.cache_dir, spec.name), exist_ok=True)
+            cmd = spec.get_cmd()
+            if DebugEnabled: logger.info(' '.join(shlex.quote(c) for c in cmd))
+            try: p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, env=cls.get_env())
+            except subprocess.TimeoutExpired: return MountResult(spec, 'failed', time.perf_counter() - start, f'Mount command timed out after {timeout}s')
+            except OSError as e: return MountResult(spec, 'failed', time.perf_counter() - start, str(e))
+            if p.returncode != 0: return MountResult(spec, 'failed', time.perf_counter() - start, p.stdout.decode(errors='replace').strip()[-500:])
+            if not cls.verify(spec.path, max(timeout - (time.perf_counter() - start), 1.0)):
+                return MountResult(spec, 'failed', time.perf_counter() - start, 'Mount did not appear in /proc/self/mountinfo or answer a stat')
+        return MountResult(spec, 'mounted', time.perf_counter() - start)
+
+    @classmethod
+    def get_env(cls):
+        env = dict(os.environ)
+        if StorageConfig.gauth.exists(): env['GOOGLE_APPLICATION_CREDENTIALS'] = StorageConfig.gauth.as_posix()
+        return env
+
+    @classmethod
+    def mount_all(cls, specs: List[MountSpec] = None, workers: int = None, timeout: float = None) -> List[MountResult]:
+        """ Mounts every spec concurrently, returning a result per spec in the given order """
+        specs = cls.get_specs() if specs is None else specs
+        if not specs: return []
+        workers = workers or StorageConfig.mount_workers
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(specs)), 1)) as pool:
+            cls.results = list(pool.map(lambda s: cls.mount(s, timeout=timeout), specs))
+        return cls.results
+
+    @classmethod
+    def display_info(cls, results: List[MountResult]):
+        msg = "\n\nStorage Mounts:\n"
+        for r in results: msg += f"  - {r.spec.provider}://{r.spec.bucket} -> {r.spec.path}: {r.status} ({r.duration:.2f}s)\n"
+        logger.info(msg)
+        for r in results:
+            if not r.ok: logger.error(f'Failed to mount {r.spec.path}: {r.error}')
@@ -0,0 +1,108 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from lazycls.types import *
+from inletscolab.config import logger, DebugEnabled
+from inletscolab.profiler import Profiler
+
+""" Dependency-aware Startup Orchestrator """
+
+class Phase:
+    def __init__(self, name: str, func: Callable, deps: List[str] = None, **kwargs):
+        self.name = name
+        self.func = func
+        self.deps = list(deps or [])
+        self.kwargs = kwargs
+        self.start: float = None
+        self.end: float = None
+        self.result: Any = None
+        self.error: Exception = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None: return 0.0
+        return self.end - self.start
+
+    def run(self):
+        self.start = time.perf_counter()
+        try:
+            with Profiler.span(self.name, 'graph', deps=self.deps): self.result = self.func(**self.kwargs)
+        except Exception as e: self.error = e
+        finally: self.end = time.perf_counter()
+        return self
+
+
+class Orchestrator:
+    """ Runs Phases concurrently while respecting their dependencies """
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.phases: Dict[str, Phase] = {}
+        self.start: float = None
+        self.end: float = None
+
+    def add(self, name: str, func: Callable, deps: List[str] = None, **kwargs):
+        for dep in deps or []:
+            if dep not in self.phases: raise ValueError(f'Phase {name} depends on unknown phase {dep}')
+        self.phases[name] = Phase(name, func, deps=deps, **kwargs)
+        return self
+
+    @property
+    def wall_time(self):
+        if self.start is None or self.end is None: return 0.0
+        return self.end - self.start
+
+    @property
+    def sequential_time(self):
+        """ The sum of the phase durations. Concurrent phases slow each other down, so this estimates the sequential path rather than measuring it """
+        return sum(p.duration for p in self.phases.values())
+
+    @property
+    def time_saved(self):
+        """ An estimate, as it is derived from `sequential_time` """
+        return max(self.sequential_time - self.wall_time, 0.0)
+
+    @property
+    def failed(self):
+        return [p for p in self.phases.values() if p.error]
+
+    def run(self, raise_errors: bool = True):
+        """ Runs every Phase once all of its dependencies have completed successfully """
+        pending = dict(self.phases)
+        done, skipped = set(), set()
+        self.start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+            while pending or running:
+                for name, phase in list(pending.items()):
+                    if any(d in skipped or self.phases[d].error for d in phase.deps):
+                        skipped.add(name)
+                        pending.pop(name)
+                        logger.warn(f'Skipping Phase {name}: a dependency failed')
+                    elif all(d in done for d in phase.deps):
+                        if DebugEnabled: logger.info(f'Starting Phase {name}')
+                        running[pool.submit(phase.run)] = name
+                        pending.pop(name)
+                if not running: break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    done.add(name)
+                    if self.phases[name].error: logger.error(f'Phase {name} failed: {self.phases[name].error}')
+        self.end = time.perf_counter()
+        if raise_errors and self.failed: raise self.failed[0].error
+        return self
+
+    def summary(self):
+        return {
+            'phases': {p.name: round(p.duration, 3) for p in self.phases.values()},
+            'wall_time': round(self.wall_time, 3),
+            'sequential_estimate': round(self.sequential_time, 3),
+            'time_saved_estimate': round(self.time_saved, 3),
+        }
+
+    def display_info(self):
+        msg = "\n\nStartup Phases:\n"
+        for p in self.phases.values():
+            status = 'failed' if p.error else ('skipped' if p.start is None else 'ok')
+            msg += f"  - {p.name}: {p.duration:.2f}s [{status}]\n"
+        msg += f"Completed in {self.wall_time:.2f}s. Sequential Estimate: {self.sequential_time:.2f}s. Estimated Time Saved: {self.time_saved:.2f}s\n"
+        logger.info(msg)
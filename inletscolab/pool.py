@@ -0,0 +1,102 @@
+import os
+from lazycls.types import *
+from lazycls.serializers import Base
+from inletscolab.config import ServerConfig, logger
+from inletscolab.state import State, pid_alive
+from inletscolab.services import Service, Services
+from inletscolab.budgets import Budget, parse_cpus
+
+"""
+Server Pool: Independent IDE Workers on one VM
+
+With SERVER_INSTANCES=N, the Server is instance 0, and N - 1 more code-server (or Jupyter Lab) instances
+run from SERVER_POOL_PORT up, each with its own user data, password and extension host. Instances are
+Services, so the inlets client exposes each one as an extra port (tcp) or under its name as a subdomain (http),
+and they are launched, recorded and supervised with the other Services.
+"""
+
+class ServerPool:
+    passwords: Dict[str, str] = {}
+
+    @classmethod
+    def get_name(cls, index: int) -> str:
+        return f"{'code' if ServerConfig.code else 'lab'}-{index}"
+
+    @classmethod
+    def get_cpus(cls, index: int) -> List[int]:
+        """ Splits SERVER_CPUS, or every available core, into one contiguous slice per instance """
+        available = parse_cpus(ServerConfig.cpus) or sorted(os.sched_getaffinity(0))
+        count = max(ServerConfig.instances, 1)
+        # With fewer cores than instances, instances share cores round robin
+        if len(available) < count: return [available[index % len(available)]]
+        size = len(available) // count
+        start = index * size
+        return available[start:] if index == count - 1 else available[start:start + size]
+
+    @classmethod
+    def get_budget(cls, index: int) -> Budget:
+        """ Every instance takes the SERVER_* budget, with the memory limit applying to each, pinned to its own cores """
+        return Budget(memory = ServerConfig.memory_limit, cpus = cls.get_cpus(index), nice = ServerConfig.nice, io_class = ServerConfig.io_class, oom_score_adj = ServerConfig.oom_score_adj)
+
+    @classmethod
+    def get_password(cls, name: str) -> str:
+        """ Generated once per instance and kept in the State file, so reruns and other processes see the same one """
+        if name in cls.passwords: return cls.passwords[name]
+        passwords = State.get('pool').get('passwords', {})
+        if name not in passwords:
+            passwords[name] = ServerConfig.password if not ServerConfig.generate_auth else Base.get_uuid()
+            State.update('pool', passwords = passwords)
+        cls.passwords[name] = passwords[name]
+        return cls.passwords[name]
+
+    @classmethod
+    def get_cmd(cls, name: str, port: int) -> str:
+        password = cls.get_password(name)
+        # code-server and Jupyter create their data dirs on start
+        data_dir = ServerConfig.pool_dir.joinpath(name)
+        if ServerConfig.code: return f'bash {ServerConfig.cs_exec_script.string} "{ServerConfig.host}:{port}" "{password}" "{data_dir.string}" "{ServerConfig.extensions_dir}"'
+        # Each Lab keeps its own config, settings, workspaces and runtime files, i.e. kernel connection files, under its data dir
+        env = f"env JUPYTER_CONFIG_DIR='{data_dir.joinpath('config').string}' JUPYTERLAB_SETTINGS_DIR='{data_dir.joinpath('settings').string}' JUPYTERLAB_WORKSPACES_DIR='{data_dir.joinpath('workspaces').string}'"
+        return f"{env} jupyter-lab --ip='{ServerConfig.host}' --port={port} --allow-root --no-browser --ServerApp.allow_remote_access=True --ServerApp.token='{password}' --ServerApp.password='' --ServerApp.runtime_dir='{data_dir.string}'"
+
+    @classmethod
+    def get_instances(cls) -> List[Service]:
+        """ Instances 1 to SERVER_INSTANCES - 1. Instance 0 is the Server itself """
+        instances = []
+        for index in range(1, ServerConfig.instances):
+            name, port = cls.get_name(index), ServerConfig.pool_port + index - 1
+            service = Service(name, port, cmd = cls.get_cmd(name, port), budget = cls.get_budget(index))
+            instances.append(service)
+        return instances
+
+    @classmethod
+    def start(cls):
+        for s in cls.get_instances(): Services.launch(s)
+        cls.display_info()
+
+    @classmethod
+    def stop(cls):
+        """ Stops every instance recorded by any start, including ones beyond the current SERVER_INSTANCES """
+        names = {s.name for s in cls.get_instances()} | {c.split('-', 1)[1] for c in State.load() if c.startswith(('service-code-', 'service-lab-'))}
+        for name in names: Services.kill(name)
+
+    @classmethod
+    def status(cls) -> List[Dict[str, Any]]:
+        """ Instance 0 is the Server. Running state comes from the State file, so it reflects starts by other processes """
+        result = []
+        server = State.get('server')
+        result.append({'name': 'server', 'port': ServerConfig.port, 'pid': server.get('pid'), 'running': bool(server.get('pid')) and pid_alive(server['pid'], server.get('cmdline')), 'url': ServerConfig.public_url, 'cpus': cls.get_cpus(0)})
+        for s in cls.get_instances():
+            entry = State.get(f'service-{s.name}')
+            result.append({'name': s.name, 'port': s.port, 'pid': entry.get('pid'), 'running': bool(entry.get('pid')) and pid_alive(entry['pid'], entry.get('cmdline')), 'url': s.public_url, 'password': cls.get_password(s.name), 'cpus': s.budget.cpus})
+        return result
+
+    @classmethod
+    def display_info(cls):
+        if ServerConfig.instances < 2: return
+        msg = f"\n\nServer Pool of {ServerConfig.instances} Instances:\n"
+        for s in cls.status():
+            msg += f"  - {s['name']}: {s['url']} on cores {s['cpus']}"
+            if s.get('password'): msg += f" Password: {s['password']}"
+            msg += "\n"
+        logger.info(msg)
@@ -0,0 +1,78 @@
+import re
+import time
+import socket
+import threading
+import urllib.error
+import urllib.request
+from lazycls.types import *
+from inletscolab.config import logger, DebugEnabled
+from inletscolab.logs import LogPipe
+
+""" Readiness Probes with Exponential Backoff """
+
+TunnelReadyPattern = re.compile(r'connection established|connected to', re.IGNORECASE)
+
+class Probe:
+
+    @classmethod
+    def backoff(cls, initial: float = 0.05, factor: float = 2.0, max_delay: float = 2.0):
+        delay = initial
+        while True:
+            yield delay
+            delay = min(delay * factor, max_delay)
+
+    @classmethod
+    def tcp(cls, host: str, port: int, timeout: float = 1.0):
+        try:
+            with socket.create_connection((host, int(port)), timeout=timeout): return True
+        except OSError: return False
+
+    @classmethod
+    def http(cls, url: str, timeout: float = 2.0):
+        """ Any response below 500 counts, since auth pages and redirects mean the server is up """
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as resp: return resp.status < 500
+        except urllib.error.HTTPError as e: return e.code < 500
+        except (urllib.error.URLError, OSError): return False
+
+    @classmethod
+    def wait_for(cls, check: Callable[[], bool], timeout: float = 120.0, name: str = 'probe', **kwargs):
+        """ Polls `check` with exponential backoff until it passes, returning the elapsed seconds """
+        start = time.perf_counter()
+        deadline = start + timeout
+        for delay in cls.backoff(**kwargs):
+            if check():
+                elapsed = time.perf_counter() - start
+                if DebugEnabled: logger.info(f'{name} ready in {elapsed:.2f}s')
+                return elapsed
+            now = time.perf_counter()
+            if now >= deadline: break
+            time.sleep(min(delay, deadline - now))
+        raise TimeoutError(f'{name} was not ready after {timeout:.1f}s')
+
+    @classmethod
+    def wait_for_port(cls, host: str, port: int, timeout: float = 120.0):
+        return cls.wait_for(lambda: cls.tcp(host, port), timeout=timeout, name=f'tcp://{host}:{port}')
+
+    @classmethod
+    def wait_for_http(cls, url: str, timeout: float = 120.0):
+        return cls.wait_for(lambda: cls.http(url), timeout=timeout, name=url)
+
+
+class OutputWatcher:
+    """ Listens to a LogPipe, flagging once a line matches `pattern` """
+    def __init__(self, pipe: LogPipe, pattern: Any = TunnelReadyPattern):
+        self.pipe = pipe
+        self.proc = pipe.proc
+        self.pattern = pattern
+        self.matched = threading.Event()
+        self.last_line: str = None
+        pipe.add_listener(self.on_line)
+
+    def on_line(self, line: str):
+        self.last_line = line
+        if not self.matched.is_set() and self.pattern.search(line): self.matched.set()
+
+    def check(self):
+        if self.proc.poll() is not None: raise RuntimeError(f'Process exited with {self.proc.returncode}: {self.last_line}')
+        return self.matched.is_set()
@@ -0,0 +1,121 @@
+import os
+import time
+import signal
+import subprocess
+from lazycls.types import *
+from inletscolab.config import SupervisorConfig, logger, DebugEnabled
+from inletscolab.state import State, PidHandle, pid_alive
+
+""" Process and Port Inspection through /proc, without fuser, ps or kill """
+
+_tcp_listen = '0A'
+
+
+def get_ppid(pid: int) -> Optional[int]:
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f: data = f.read()
+    except OSError: return None
+    return int(data[data.rindex(b')') + 2:].split()[1])
+
+
+def iter_pids():
+    for name in os.listdir('/proc'):
+        if name.isdigit(): yield int(name)
+
+
+class Procs:
+
+    @classmethod
+    def descendants(cls, pid: int) -> List[int]:
+        """ Children of `pid` and their children, i.e. inlets-pro under sudo, parents first """
+        children: Dict[int, List[int]] = {}
+        for p in iter_pids():
+            ppid = get_ppid(p)
+            if ppid: children.setdefault(ppid, []).append(p)
+        result, stack = [], list(children.get(pid, []))
+        while stack:
+            p = stack.pop(0)
+            result.append(p)
+            stack += children.get(p, [])
+        return result
+
+    @classmethod
+    def listen_inodes(cls, port: int) -> set:
+        """ Socket inodes listening on `port` from /proc/net/tcp and tcp6 """
+        inodes = set()
+        for path in ['/proc/net/tcp', '/proc/net/tcp6']:
+            try:
+                with open(path) as f: lines = f.readlines()[1:]
+            except OSError: continue
+            for line in lines:
+                fields = line.split()
+                if fields[3] == _tcp_listen and int(fields[1].rsplit(':', 1)[1], 16) == port: inodes.add(fields[9])
+        return inodes
+
+    @classmethod
+    def port_owners(cls, port: int) -> List[int]:
+        """ Pids holding a socket listening on `port`. Processes of other users are only visible as root """
+        inodes = {f'socket:[{i}]' for i in cls.listen_inodes(int(port))}
+        if not inodes: return []
+        owners = []
+        for pid in iter_pids():
+            try: fds = os.listdir(f'/proc/{pid}/fd')
+            except OSError: continue
+            for fd in fds:
+                try: link = os.readlink(f'/proc/{pid}/fd/{fd}')
+                except OSError: continue
+                if link in inodes:
+                    owners.append(pid)
+                    break
+        return owners
+
+    @classmethod
+    def signal(cls, proc: Union[subprocess.Popen, PidHandle], sig: int):
+        try: proc.send_signal(sig)
+        except ProcessLookupError: pass
+        except PermissionError: logger.error(f'Not permitted to signal pid {proc.pid}')
+
+    @classmethod
+    def wait(cls, proc: Union[subprocess.Popen, PidHandle], timeout: float) -> bool:
+        try: proc.wait(timeout=timeout)
+        except (subprocess.TimeoutExpired, TimeoutError): return False
+        return True
+
+    @classmethod
+    def stop(cls, proc: Union[subprocess.Popen, PidHandle], timeout: float = None, name: str = None) -> Optional[int]:
+        """ Sends SIGTERM to the process and its descendants, then SIGKILL to any still running after `timeout` """
+        if proc is None: return None
+        if proc.poll() is not None: return proc.returncode
+        timeout = SupervisorConfig.stop_timeout if timeout is None else timeout
+        name = name or f'pid {proc.pid}'
+        procs = [proc] + [PidHandle(pid) for pid in cls.descendants(proc.pid)]
+        for p in procs: cls.signal(p, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for p in procs:
+            if cls.wait(p, max(deadline - time.monotonic(), 0.0)): continue
+            logger.warn(f'{name} did not exit within {timeout:.1f}s of SIGTERM. Sending SIGKILL to pid {p.pid}')
+            cls.signal(p, signal.SIGKILL)
+            cls.wait(p, 1.0)
+        if DebugEnabled: logger.info(f'Stopped {name}')
+        return proc.poll()
+
+    @classmethod
+    def stop_recorded(cls, component: str, timeout: float = None) -> bool:
+        """ Stops the process recorded in the State file for `component`, which may belong to another interpreter """
+        entry = State.get(component)
+        if not entry.get('pid'): return False
+        if pid_alive(entry['pid'], entry.get('cmdline')): cls.stop(PidHandle(entry['pid'], entry.get('cmdline')), timeout=timeout, name=component)
+        State.update(component, pid = None)
+        return True
+
+    @classmethod
+    def free_port(cls, port: int, timeout: float = None) -> List[int]:
+        """ Stops whatever is listening on `port`, returning the pids that held it """
+        owners = cls.port_owners(port)
+        for pid in owners:
+            if pid == os.getpid():
+                logger.error(f'Port {port} is held by this process, i.e. by the proxy or metrics. Not stopping it')
+                continue
+            logger.info(f'Stopping pid {pid} listening on port {port}')
+            cls.stop(PidHandle(pid), timeout=timeout, name=f'pid {pid}')
+        return owners
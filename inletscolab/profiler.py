@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from lazycls.types import *
+from lazycls.envs import Env
+from lazycls.utils import exec_shell as _exec_shell, exec_daemon as _exec_daemon
+from inletscolab.envs import LazyEnv
+
+""" Startup Phase Profiler with Chrome Trace-Event Output """
+
+class Span:
+    def __init__(self, name: str, cat: str, start: float, end: float, tid: int, args: Dict[str, Any] = None):
+        self.name = name
+        self.cat = cat
+        self.start = start
+        self.end = end
+        self.tid = tid
+        self.args = args or {}
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Profiler:
+    enabled: bool = LazyEnv(Env.to_bool, 'PROFILE_ENABLED')
+    spans: List[Span] = []
+    t0: float = time.perf_counter()
+    _lock = threading.Lock()
+
+    @classmethod
+    def enable(cls, reset: bool = True):
+        cls.enabled = True
+        if reset: cls.reset()
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.spans = []
+            cls.t0 = time.perf_counter()
+
+    @classmethod
+    @contextmanager
+    def span(cls, name: str, cat: str = 'phase', **args):
+        if not cls.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try: yield
+        finally:
+            s = Span(name, cat, start, time.perf_counter(), threading.get_ident(), args)
+            with cls._lock: cls.spans.append(s)
+
+    @classmethod
+    def profile(cls, name: str, cat: str = 'phase'):
+        """ Decorator that records each call as a span """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with cls.span(name, cat): return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def summary(cls) -> Dict[str, Dict[str, Any]]:
+        """ Aggregates spans by name, in order of first appearance """
+        out = {}
+        with cls._lock: spans = list(cls.spans)
+        for s in sorted(spans, key=lambda s: s.start):
+            e = out.setdefault(s.name, {'cat': s.cat, 'count': 0, 'total': 0.0, 'max': 0.0})
+            e['count'] += 1
+            e['total'] += s.duration
+            e['max'] = max(e['max'], s.duration)
+        for e in out.values():
+            e['total'] = round(e['total'], 4)
+            e['max'] = round(e['max'], 4)
+        return out
+
+    @classmethod
+    def to_trace(cls):
+        with cls._lock: spans = list(cls.spans)
+        pid = os.getpid()
+        events = [{
+            'name': s.name, 'cat': s.cat, 'ph': 'X', 'pid': pid, 'tid': s.tid,
+            'ts': round((s.start - cls.t0) * 1e6, 1), 'dur': round(s.duration * 1e6, 1), 'args': s.args,
+        } for s in spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'summary': cls.summary()}}
+
+    @classmethod
+    def save(cls, path: str):
+        """ Writes a Chrome trace-event file (chrome://tracing, Perfetto), with the summary under otherData """
+        with open(path, 'w') as f: json.dump(cls.to_trace(), f, indent=1)
+
+    @classmethod
+    def format_summary(cls):
+        rows = cls.summary()
+        width = max([len(n) for n in rows] + [5])
+        t = f"\n\n{'Phase':<{width}}  {'Cat':<10} {'Count':>5} {'Total(s)':>9} {'Max(s)':>8}\n"
+        for name, e in rows.items():
+            t += f"{name:<{width}}  {e['cat']:<10} {e['count']:>5} {e['total']:>9.2f} {e['max']:>8.2f}\n"
+        return t
+
+    @classmethod
+    def display_info(cls):
+        from inletscolab.config import logger
+        logger.info(cls.format_summary())
+
+
+_secret_re = re.compile(r'(--(?:token|license|password)=)\S+')
+
+def _span_name(cmd: str):
+    """ i.e. `sudo bash scripts/get_inlets.sh` -> get_inlets.sh, `sudo inletsctl download` -> inletsctl download """
+    tokens = [t for t in cmd.split() if t != 'sudo']
+    if not tokens: return cmd
+    if tokens[0] in {'bash', 'sh'} and len(tokens) > 1: return os.path.basename(tokens[1])
+    name = os.path.basename(tokens[0])
+    if len(tokens) > 1 and not tokens[1].startswith('-'): name += f' {tokens[1]}'
+    return name
+
+
+def exec_shell(cmd: str, check: bool = False):
+    """ Profiled lazycls.utils.exec_shell. With `check`, a non-zero exit raises, as os.system never does """
+    with Profiler.span(_span_name(cmd), 'subprocess', cmd=_secret_re.sub(r'\1***', cmd)):
+        status = _exec_shell(cmd)
+    if check and status != 0: raise RuntimeError(f'{_span_name(cmd)} exited with {status >> 8 if status & 0xff == 0 else status}')
+    return status
+
+
+def exec_daemon(cmd: Union[List[str], str], *args, **kwargs):
+    """ Profiled lazycls.utils.exec_daemon. This only covers the spawn """
+    with Profiler.span(f'spawn {_span_name(cmd if isinstance(cmd, str) else " ".join(cmd))}', 'subprocess'):
+        return _exec_daemon(cmd, *args, **kwargs)
@@ -0,0 +1,406 @@
+import sys
+import gzip
+import time
+import asyncio
+import threading
+import subprocess
+from collections import OrderedDict
+from lazycls.types import *
+from urllib.parse import urlsplit, parse_qs
+from inletscolab.config import ProxyConfig, ServerConfig, WatchdogConfig, logger, DebugEnabled
+from inletscolab.profiler import exec_daemon
+from inletscolab.state import State
+from inletscolab.procs import Procs
+from inletscolab.probes import Probe
+
+"""
+Compressing, Caching Reverse Proxy between the inlets Upstream and the Server
+
+Responses are gzip (or brotli, if installed) compressed for clients that accept it, immutable
+assets are kept in memory, backend connections are reused, and WebSockets are piped through as is.
+"""
+
+_chunk_size = 64 * 1024
+_hop_headers = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'te', 'trailer', 'upgrade', 'proxy-authenticate', 'proxy-authorization'}
+_compressible = ('text/', 'application/javascript', 'application/x-javascript', 'application/json', 'application/manifest+json', 'application/xml', 'image/svg+xml', 'application/wasm', 'font/ttf', 'font/otf')
+
+
+def get_brotli():
+    try: import brotli
+    except ImportError: return None
+    return brotli
+
+
+class Head:
+    """ A request or response head, keeping header order and case for forwarding """
+    def __init__(self, line: str, headers: List[Tuple[str, str]]):
+        self.line = line
+        self.headers = headers
+
+    def get(self, name: str, default: str = '') -> str:
+        name = name.lower()
+        for k, v in self.headers:
+            if k.lower() == name: return v
+        return default
+
+    def tokens(self, name: str) -> List[str]:
+        return [t.strip().lower() for t in self.get(name).split(',') if t.strip()]
+
+    def without(self, names: set) -> List[Tuple[str, str]]:
+        return [(k, v) for k, v in self.headers if k.lower() not in names]
+
+    @property
+    def status(self) -> int:
+        return int(self.line.split(' ', 2)[1])
+
+    @property
+    def keep_alive(self):
+        if 'close' in self.tokens('connection'): return False
+        return not self.line.startswith('HTTP/1.0') and not self.line.endswith('HTTP/1.0')
+
+    @classmethod
+    def encode(cls, line: str, headers: List[Tuple[str, str]]) -> bytes:
+        return (line + '\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers) + '\r\n').encode('latin-1')
+
+    @classmethod
+    async def read(cls, reader: asyncio.StreamReader) -> Optional['Head']:
+        try: data = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError: return None
+        lines = data.decode('latin-1').split('\r\n')
+        headers = []
+        for line in lines[1:]:
+            if ':' in line:
+                k, v = line.split(':', 1)
+                headers.append((k.strip(), v.strip()))
+        return cls(lines[0], headers)
+
+
+async def iter_body(reader: asyncio.StreamReader, head: Head, response: bool = False, method: str = 'GET'):
+    """ Yields the decoded body, by chunked framing, Content-Length, or for a response, until the connection closes """
+    if response and (method == 'HEAD' or head.status in {204, 304} or head.status < 200): return
+    if 'chunked' in head.tokens('transfer-encoding'):
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+            if size == 0:
+                # Trailers end with an empty line
+                while await reader.readuntil(b'\r\n') != b'\r\n': pass
+                return
+            yield await reader.readexactly(size)
+            await reader.readexactly(2)
+    elif head.get('content-length'):
+        n = int(head.get('content-length'))
+        while n > 0:
+            chunk = await reader.read(min(n, _chunk_size))
+            if not chunk: raise asyncio.IncompleteReadError(b'', n)
+            n -= len(chunk)
+            yield chunk
+    elif response:
+        while True:
+            chunk = await reader.read(_chunk_size)
+            if not chunk: return
+            yield chunk
+
+
+def has_length(head: Head, response: bool = False):
+    """ Whether the end of the body is known without the connection closing """
+    return not response or 'chunked' in head.tokens('transfer-encoding') or bool(head.get('content-length'))
+
+
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            data = await reader.read(_chunk_size)
+            if not data: break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError): pass
+    finally: writer.close()
+
+
+class AssetCache:
+    """ Size-bounded LRU of responses keyed by target and content encoding """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: 'OrderedDict[Tuple[str, str], Tuple[str, List[Tuple[str, str]], bytes, int]]' = OrderedDict()
+
+    def get(self, key: Tuple[str, str]):
+        entry = self.entries.get(key)
+        if entry: self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Tuple[str, str], line: str, headers: List[Tuple[str, str]], body: bytes, raw_size: int):
+        if len(body) > self.max_size // 4: return
+        if key in self.entries: self.size -= len(self.entries.pop(key)[2])
+        self.entries[key] = (line, headers, body, raw_size)
+        self.size += len(body)
+        while self.size > self.max_size:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old[2])
+
+    @classmethod
+    def is_immutable(cls, head: Head):
+        cc = head.tokens('cache-control')
+        if 'no-store' in cc or 'private' in cc: return False
+        if 'immutable' in cc: return True
+        for t in cc:
+            if t.startswith('max-age=') and t[8:].isdigit() and int(t[8:]) >= 86400: return True
+        return False
+
+
+class ReverseProxy:
+    def __init__(self, host: str = None, port: int = None, backend_host: str = None, backend_port: int = None, transform: bool = True):
+        self.host = host or ServerConfig.host
+        self.port = port if port is not None else ProxyConfig.port
+        self.backend_host = backend_host or ServerConfig.host
+        self.backend_port = backend_port or ServerConfig.port
+        # Without it, responses pass through as is, and the proxy only answers Watchdog probes
+        self.transform = transform
+        self.cache = AssetCache(ProxyConfig.cache_mb * 1024 * 1024)
+        self.pool: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self.server: asyncio.AbstractServer = None
+        self.stats = {'requests': 0, 'cache_hits': 0, 'compressed': 0, 'websockets': 0, 'backend_connections': 0, 'retries': 0, 'bad_gateway': 0, 'raw_bytes': 0, 'sent_bytes': 0, 'backend_bytes': 0}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for _, w in self.pool: w.close()
+        self.pool.clear()
+
+    async def acquire(self, fresh: bool = False) -> Tuple[Tuple[asyncio.StreamReader, asyncio.StreamWriter], bool]:
+        """ A backend connection, and whether it was reused from the pool """
+        while self.pool and not fresh:
+            reader, writer = self.pool.pop()
+            if not reader.at_eof() and not writer.is_closing(): return (reader, writer), True
+            writer.close()
+        self.stats['backend_connections'] += 1
+        return await asyncio.open_connection(self.backend_host, self.backend_port), False
+
+    def release(self, conn: Tuple[asyncio.StreamReader, asyncio.StreamWriter], reuse: bool):
+        if reuse and len(self.pool) < ProxyConfig.backend_pool: self.pool.append(conn)
+        else: conn[1].close()
+
+    def choose_encoding(self, req: Head) -> str:
+        accepted = {t.split(';', 1)[0].strip() for t in req.tokens('accept-encoding')}
+        if 'br' in accepted and get_brotli(): return 'br'
+        if 'gzip' in accepted: return 'gzip'
+        return ''
+
+    @classmethod
+    def compress(cls, data: bytes, encoding: str) -> bytes:
+        if encoding == 'br': return get_brotli().compress(data, quality=min(ProxyConfig.compress_level, 11))
+        return gzip.compress(data, compresslevel=ProxyConfig.compress_level)
+
+    def is_compressible(self, resp: Head, encoding: str, method: str):
+        if not encoding or method == 'HEAD' or resp.status != 200 or resp.get('content-encoding'): return False
+        length = resp.get('content-length')
+        if length and int(length) < ProxyConfig.compress_min_size: return False
+        return resp.get('content-type').lower().startswith(_compressible)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                req = await Head.read(reader)
+                if req is None: break
+                self.stats['requests'] += 1
+                if 'websocket' in req.tokens('upgrade'): return await self.websocket(req, reader, writer)
+                if urlsplit(req.line.split(' ', 2)[1]).path == WatchdogConfig.path:
+                    await self.answer_probe(req, writer)
+                    if not req.keep_alive: break
+                    continue
+                if not await self.forward(req, reader, writer) or not req.keep_alive: break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError) as e:
+            if DebugEnabled: logger.info(f'Proxy connection ended: {e!r}')
+        except asyncio.CancelledError: pass
+        finally: writer.close()
+
+    async def answer_probe(self, req: Head, writer: asyncio.StreamWriter):
+        """ Echoes the Watchdog's nonce, proving its request made it through the tunnel to this VM """
+        body = parse_qs(urlsplit(req.line.split(' ', 2)[1]).query).get('n', [''])[0].encode()
+        writer.write(Head.encode('HTTP/1.1 200 OK', [('Content-Type', 'text/plain'), ('Cache-Control', 'no-store'), ('Content-Length', str(len(body)))]) + body)
+        await writer.drain()
+
+    async def websocket(self, req: Head, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ Forwards the upgrade on a dedicated backend connection and then pipes both ways """
+        self.stats['websockets'] += 1
+        up_reader, up_writer = await asyncio.open_connection(self.backend_host, self.backend_port)
+        up_writer.write(Head.encode(req.line, req.headers))
+        await up_writer.drain()
+        await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+
+    async def send(self, writer: asyncio.StreamWriter, line: str, headers: List[Tuple[str, str]], body: bytes, keep_alive: bool, raw_size: int):
+        headers = headers + [('Content-Length', str(len(body))), ('Connection', 'keep-alive' if keep_alive else 'close')]
+        writer.write(Head.encode(line, headers) + body)
+        await writer.drain()
+        self.stats['raw_bytes'] += raw_size
+        self.stats['sent_bytes'] += len(body)
+
+    async def exchange(self, conn: Tuple[asyncio.StreamReader, asyncio.StreamWriter], req: Head, reader: asyncio.StreamReader, chunked_req: bool) -> Optional[Head]:
+        """ Sends the request and its body to the backend, returning the response head, or None if the backend closed the connection """
+        up_reader, up_writer = conn
+        up_headers = req.without(_hop_headers)
+        if chunked_req: up_headers.append(('Transfer-Encoding', 'chunked'))
+        up_writer.write(Head.encode(req.line, up_headers + [('Connection', 'keep-alive')]))
+        async for chunk in iter_body(reader, req):
+            up_writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked_req else chunk)
+            await up_writer.drain()
+        if chunked_req: up_writer.write(b'0\r\n\r\n')
+        await up_writer.drain()
+        return await Head.read(up_reader)
+
+    async def forward(self, req: Head, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """ Proxies one request, returning whether the client connection can be reused """
+        method, target = req.line.split(' ', 2)[:2]
+        encoding = self.choose_encoding(req) if self.transform else ''
+        if method == 'GET' and self.transform:
+            cached = self.cache.get((target, encoding))
+            if cached:
+                self.stats['cache_hits'] += 1
+                await self.send(writer, cached[0], cached[1], cached[2], req.keep_alive, cached[3])
+                return True
+
+        # The backend can close a pooled keep-alive connection at any time. A request without a body can safely be sent again
+        chunked_req = 'chunked' in req.tokens('transfer-encoding')
+        retryable = method in {'GET', 'HEAD'} and not chunked_req and not int(req.get('content-length') or 0)
+        resp = None
+        for attempt in range(2):
+            conn, reused = None, False
+            try:
+                conn, reused = await self.acquire(fresh = attempt > 0)
+                resp = await self.exchange(conn, req, reader, chunked_req)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                if DebugEnabled: logger.info(f'Backend request failed: {e!r}')
+            if resp is not None: break
+            if conn: conn[1].close()
+            # Only a stale pooled connection is worth a second try
+            if attempt or not (reused and retryable): break
+            self.stats['retries'] += 1
+        if resp is None:
+            self.stats['bad_gateway'] += 1
+            body = b'Bad Gateway'
+            await self.send(writer, 'HTTP/1.1 502 Bad Gateway', [('Content-Type', 'text/plain')], body, False, len(body))
+            return False
+        up_reader = conn[0]
+        reuse_backend = resp.keep_alive and has_length(resp, response=True)
+        keep_alive = req.keep_alive and has_length(resp, response=True)
+        headers = resp.without(_hop_headers)
+        length = resp.get('content-length')
+        buffer = self.is_compressible(resp, encoding, method) or (self.transform and method == 'GET' and resp.status == 200 and AssetCache.is_immutable(resp))
+        if buffer and length and int(length) > ProxyConfig.max_buffer_mb * 1024 * 1024: buffer = False
+
+        if buffer:
+            body = b''.join([chunk async for chunk in iter_body(up_reader, resp, response=True, method=method)])
+            self.release(conn, reuse_backend)
+            self.stats['backend_bytes'] += len(body)
+            raw_size, headers = len(body), [(k, v) for k, v in headers if k.lower() != 'content-length']
+            key_encoding = ''
+            if self.is_compressible(resp, encoding, method) and len(body) >= ProxyConfig.compress_min_size:
+                # Large bundles are compressed off the event loop
+                if len(body) > _chunk_size: body = await asyncio.get_running_loop().run_in_executor(None, self.compress, body, encoding)
+                else: body = self.compress(body, encoding)
+                headers += [('Content-Encoding', encoding), ('Vary', 'Accept-Encoding')]
+                key_encoding = encoding
+                self.stats['compressed'] += 1
+            if method == 'GET' and resp.status == 200 and AssetCache.is_immutable(resp):
+                self.cache.put((target, key_encoding), resp.line, headers, body, raw_size)
+                # Responses that were not compressed serve every encoding
+                if not key_encoding and encoding: self.cache.put((target, encoding), resp.line, headers, body, raw_size)
+            await self.send(writer, resp.line, headers, body, keep_alive, raw_size)
+            return keep_alive
+
+        chunked_resp = 'chunked' in resp.tokens('transfer-encoding')
+        if chunked_resp: headers.append(('Transfer-Encoding', 'chunked'))
+        writer.write(Head.encode(resp.line, headers + [('Connection', 'keep-alive' if keep_alive else 'close')]))
+        n = 0
+        async for chunk in iter_body(up_reader, resp, response=True, method=method):
+            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked_resp else chunk)
+            await writer.drain()
+            n += len(chunk)
+        if chunked_resp: writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        self.release(conn, reuse_backend)
+        for k in ['raw_bytes', 'sent_bytes', 'backend_bytes']: self.stats[k] += n
+        return keep_alive
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update(bytes_saved = stats['raw_bytes'] - stats['sent_bytes'], backend_bytes_saved = stats['raw_bytes'] - stats['backend_bytes'], cache_entries = len(self.cache.entries), cache_bytes = self.cache.size)
+        return stats
+
+
+class Proxy:
+    """ Runs a ReverseProxy on its own event loop in a daemon thread """
+    proxy: ReverseProxy = None
+    loop: asyncio.AbstractEventLoop = None
+    thread: threading.Thread = None
+
+    @classmethod
+    def start(cls, **kwargs) -> ReverseProxy:
+        if cls.thread and cls.thread.is_alive(): return cls.proxy
+        started, errors = threading.Event(), []
+
+        def run():
+            cls.loop = asyncio.new_event_loop()
+            try:
+                cls.proxy = cls.loop.run_until_complete(ReverseProxy(**kwargs).start())
+            except Exception as e:
+                errors.append(e)
+                return
+            finally: started.set()
+            cls.loop.run_forever()
+
+        cls.thread = threading.Thread(target=run, name='InletsColab-Proxy', daemon=True)
+        cls.thread.start()
+        started.wait()
+        if errors: raise errors[0]
+        logger.info(f'Proxy is serving http://{cls.proxy.host}:{cls.proxy.port} -> http://{cls.proxy.backend_host}:{cls.proxy.backend_port}')
+        return cls.proxy
+
+    @classmethod
+    def spawn(cls, timeout: float = 10.0) -> int:
+        """
+        Runs the proxy as its own process, recorded in the State file like a Service,
+        so it outlives a starter that exits, i.e. `inletscolab start --server-background`
+        """
+        config = dict(ProxyConfig.export_config(), backend_port = ServerConfig.port)
+        handle = State.get_running('proxy', config)
+        if handle:
+            logger.info(f'Proxy is already running with pid {handle.pid}')
+            return handle.pid
+        Procs.stop_recorded('proxy')
+        cmd = [sys.executable, '-m', 'inletscolab.cmd', 'proxy', '--port', str(ProxyConfig.port), '--backend-port', str(ServerConfig.port)]
+        if not ProxyConfig.enabled: cmd.append('--passthrough')
+        # Nothing reads its output once the starter exits, and its own session keeps it from the terminal's signals
+        proc = exec_daemon(cmd=cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, set_proc_uid=False, start_new_session=True)
+        State.record_process('proxy', proc.pid, [State.hash_config(config)])
+        Probe.wait_for_port(ServerConfig.host, ProxyConfig.port, timeout=timeout)
+        logger.info(f'Proxy is serving http://{ServerConfig.host}:{ProxyConfig.port} -> http://{ServerConfig.host}:{ServerConfig.port} with pid {proc.pid}')
+        return proc.pid
+
+    @classmethod
+    def stop(cls):
+        """ Stops the proxy thread, and a proxy process started by any `spawn` """
+        Procs.stop_recorded('proxy')
+        if not cls.thread: return
+        asyncio.run_coroutine_threadsafe(cls.proxy.stop(), cls.loop).result(timeout=5.0)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join(timeout=5.0)
+        cls.thread = cls.loop = None
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return cls.proxy.get_stats() if cls.proxy else {}
+
+    @classmethod
+    def display_info(cls):
+        s = cls.stats()
+        if not s: return
+        msg = f"\n\nProxy: {s['requests']} requests, {s['cache_hits']} cache hits, {s['compressed']} compressed, {s['websockets']} websockets\n"
+        msg += f"  - Sent {s['sent_bytes'] / 1024 / 1024:.1f}MB for {s['raw_bytes'] / 1024 / 1024:.1f}MB of responses. Saved {s['bytes_saved'] / 1024 / 1024:.1f}MB over the tunnel\n"
+        msg += f"  - Read {s['backend_bytes'] / 1024 / 1024:.1f}MB from the Server over {s['backend_connections']} connections\n"
+        logger.info(msg)
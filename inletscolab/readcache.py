@@ -0,0 +1,209 @@
+import os
+import glob
+import json
+import time
+import shutil
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from lazycls.types import *
+from lazycls.io import Path, PathLike
+from lazycls.prop import classproperty
+from inletscolab.config import ReadCacheConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler
+
+""" Local Disk Read-Through Cache for Files on Bucket Mounts """
+
+class ReadCache:
+    entries: 'OrderedDict[str, Dict[str, Any]]' = None
+    stats: Dict[str, int] = None
+    _inflight: Dict[str, threading.Event] = {}
+    _lock = threading.RLock()
+
+    @classproperty
+    def cache_dir(cls):
+        return Path(ReadCacheConfig.cache_dir)
+
+    @classproperty
+    def index_file(cls):
+        return cls.cache_dir.joinpath('index.json')
+
+    @classmethod
+    def load(cls):
+        """ Loads the index once per process. Entries are kept least recently used first """
+        with cls._lock:
+            if cls.entries is not None: return
+            data = {}
+            if cls.index_file.exists():
+                try: data = json.loads(cls.index_file.read_text())
+                except ValueError: logger.warn(f'Read Cache Index at {cls.index_file.string} is corrupt. Resetting.')
+            cls.entries = OrderedDict(sorted(data.get('entries', {}).items(), key=lambda kv: kv[1]['last_used']))
+            cls.stats = {'hits': 0, 'misses': 0, 'hit_bytes': 0, 'miss_bytes': 0, 'evictions': 0, 'evicted_bytes': 0}
+            for k, v in data.get('stats', {}).items(): cls.stats[k] = v
+            atexit.register(cls.save)
+
+    @classmethod
+    def save(cls):
+        with cls._lock:
+            if cls.entries is None: return
+            cls.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = cls.cache_dir.joinpath('index.json.tmp')
+            tmp.write_text(json.dumps({'entries': cls.entries, 'stats': cls.stats}))
+            os.replace(tmp.string, cls.index_file.string)
+
+    @classmethod
+    def local_path(cls, source: str):
+        """ Mirrors the source's absolute path under the cache, i.e. /content/gs/a.bin -> {cache_dir}/files/content/gs/a.bin """
+        return cls.cache_dir.joinpath('files', source.lstrip('/')).string
+
+    @classproperty
+    def size(cls):
+        cls.load()
+        return sum(e['size'] for e in cls.entries.values())
+
+    @classmethod
+    def lookup(cls, source: str, validate: bool) -> Optional[str]:
+        with cls._lock:
+            entry = cls.entries.get(source)
+            if not entry: return None
+        if validate:
+            try: st = os.stat(source)
+            except OSError: st = None
+            # The source changed, or was removed from the bucket
+            if st is None or st.st_size != entry['size'] or st.st_mtime_ns != entry['mtime_ns']:
+                cls.remove(source)
+                return None
+        if not os.path.exists(entry['local']):
+            cls.remove(source)
+            return None
+        with cls._lock:
+            entry['last_used'] = time.time()
+            cls.entries.move_to_end(source)
+            cls.stats['hits'] += 1
+            cls.stats['hit_bytes'] += entry['size']
+        return entry['local']
+
+    @classmethod
+    def get(cls, path: PathLike, validate: bool = None) -> str:
+        """ Returns a local path for `path`, copying it into the cache on a miss """
+        cls.load()
+        source = os.path.abspath(str(path))
+        validate = ReadCacheConfig.validate if validate is None else validate
+        while True:
+            local = cls.lookup(source, validate)
+            if local: return local
+            with cls._lock:
+                event = cls._inflight.get(source)
+                if event is None:
+                    event = cls._inflight[source] = threading.Event()
+                    break
+            # Another thread is copying the same file
+            event.wait()
+        try: return cls.fetch(source)
+        finally:
+            with cls._lock: cls._inflight.pop(source, None)
+            event.set()
+
+    @classmethod
+    def fetch(cls, source: str) -> str:
+        local = cls.local_path(source)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        tmp = f'{local}.{threading.get_ident()}.tmp'
+        with Profiler.span('readcache.fetch', 'storage', path=source):
+            st = os.stat(source)
+            try:
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, local)
+            except BaseException:
+                if os.path.exists(tmp): os.unlink(tmp)
+                raise
+        with cls._lock:
+            cls.entries[source] = {'local': local, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'last_used': time.time()}
+            cls.entries.move_to_end(source)
+            cls.stats['misses'] += 1
+            cls.stats['miss_bytes'] += st.st_size
+        if DebugEnabled: logger.info(f'Cached {source} ({st.st_size} bytes)')
+        cls.evict(keep=source)
+        return local
+
+    @classmethod
+    def remove(cls, source: str):
+        with cls._lock: entry = cls.entries.pop(source, None)
+        if entry and os.path.exists(entry['local']): os.unlink(entry['local'])
+        return entry
+
+    @classmethod
+    def evict(cls, max_size: int = None, keep: str = None):
+        """ Removes the least recently used files until the cache is within `max_size` bytes """
+        cls.load()
+        max_size = max_size if max_size is not None else ReadCacheConfig.max_size
+        with cls._lock:
+            total = sum(e['size'] for e in cls.entries.values())
+            victims = []
+            for source, entry in cls.entries.items():
+                if total <= max_size: break
+                if source == keep: continue
+                victims.append(source)
+                total -= entry['size']
+        for source in victims:
+            entry = cls.remove(source)
+            if not entry: continue
+            with cls._lock:
+                cls.stats['evictions'] += 1
+                cls.stats['evicted_bytes'] += entry['size']
+        return total
+
+    @classmethod
+    def expand(cls, patterns: List[str] = None, manifest: PathLike = None, root: PathLike = None) -> List[str]:
+        """ Resolves glob patterns and a manifest of one path or pattern per line, relative to `root` """
+        patterns = list(patterns or [])
+        if manifest: patterns += [l.strip() for l in Path(manifest).read_text().splitlines() if l.strip() and not l.startswith('#')]
+        files, seen = [], set()
+        for pattern in patterns:
+            if root and not os.path.isabs(pattern): pattern = os.path.join(str(root), pattern)
+            for f in sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]:
+                if f in seen or not os.path.isfile(f): continue
+                seen.add(f)
+                files.append(f)
+        return files
+
+    @classmethod
+    @Profiler.profile('readcache.prefetch')
+    def prefetch(cls, patterns: List[str] = None, manifest: PathLike = None, root: PathLike = None, workers: int = None) -> Dict[str, str]:
+        """ Copies the matched files into the cache with a pool of workers, returning source -> local paths """
+        cls.load()
+        files = cls.expand(patterns, manifest, root)
+        workers = workers or ReadCacheConfig.workers
+        total = sum(os.path.getsize(f) for f in files)
+        if total > ReadCacheConfig.max_size: logger.warn(f'Prefetching {total / 1024 / 1024:.0f}MB exceeds the Read Cache budget of {ReadCacheConfig.max_size_mb}MB. Earlier files will be evicted.')
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            for f, local in zip(files, pool.map(cls.get, files)): results[f] = local
+        cls.save()
+        return results
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            shutil.rmtree(cls.cache_dir.joinpath('files').string, ignore_errors=True)
+            cls.entries = OrderedDict()
+            for k in cls.stats: cls.stats[k] = 0
+        cls.save()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        cls.load()
+        with cls._lock: stats = dict(cls.stats)
+        requests = stats['hits'] + stats['misses']
+        stats.update(entries = len(cls.entries), size = cls.size, max_size = ReadCacheConfig.max_size, hit_rate = round(stats['hits'] / requests, 4) if requests else 0.0)
+        return stats
+
+    @classmethod
+    def display_info(cls):
+        s = cls.get_stats()
+        msg = f"\n\nRead Cache at {cls.cache_dir.string}:\n"
+        msg += f"  - Files: {s['entries']}, {s['size'] / 1024 / 1024:.1f}MB / {s['max_size'] / 1024 / 1024:.0f}MB\n"
+        msg += f"  - Hits: {s['hits']} ({s['hit_bytes'] / 1024 / 1024:.1f}MB), Misses: {s['misses']} ({s['miss_bytes'] / 1024 / 1024:.1f}MB), Hit Rate: {s['hit_rate']:.1%}\n"
+        msg += f"  - Evictions: {s['evictions']} ({s['evicted_bytes'] / 1024 / 1024:.1f}MB)\n"
+        logger.info(msg)
@@ -2,15 +2,25 @@
 
 BIND_ADDR=$1
 CODE_PASSWORD=$2
+USER_DATA_DIR=$3
+EXTENSIONS_DIR=$4
 CODE_BIND_ADDR=${BIND_ADDR:-127.0.0.1:7070}
 
 if [[ ! -f /content/workspace.ipynb ]]; then
     touch /content/workspace.ipynb
 fi
 
+## Server Pool instances keep their own user data, but share the installed extensions
+EXTRA_ARGS=()
+if [[ "$USER_DATA_DIR" != "" ]]; then
+    EXTRA_ARGS+=("--user-data-dir=$USER_DATA_DIR")
+fi
+if [[ "$EXTENSIONS_DIR" != "" ]]; then
+    EXTRA_ARGS+=("--extensions-dir=$EXTENSIONS_DIR")
+fi
+
 if [[ "$CODE_PASSWORD" != "" ]]; then
-    PASSWORD="$CODE_PASSWORD" code-server --bind-addr="$CODE_BIND_ADDR" --disable-telemetry
+    PASSWORD="$CODE_PASSWORD" code-server --bind-addr="$CODE_BIND_ADDR" --disable-telemetry "${EXTRA_ARGS[@]}"
 else
-    code-server --bind-addr="$CODE_BIND_ADDR" --auth=none --disable-telemetry
+    code-server --bind-addr="$CODE_BIND_ADDR" --auth=none --disable-telemetry "${EXTRA_ARGS[@]}"
 fi
-
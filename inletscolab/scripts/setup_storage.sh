@@ -1,6 +1,8 @@
 #!/bin/bash
 
 ENVFILE=$1
+# all: install and mount, install: only install tools and credentials, as InletsColab mounts concurrently itself
+MODE=${2:-"all"}
 
 SCRIPTS_DIR=$(dirname "$(realpath $0)")
 ENV_FILE=${ENVFILE:-"$SCRIPTS_DIR/load_env.sh"}
@@ -10,7 +12,9 @@ source "$ENV_FILE"
 
 
 install_prereqs() {
-    apt update -qq && apt install -y -qq curl fuse
+    if [[ "$(which curl)" == "" || "$(which fusermount)" == "" ]]; then
+        apt update -qq && apt install -y -qq curl fuse
+    fi
 }
 
 install_gcsfuse() {
@@ -33,7 +37,7 @@ mount_gcsfuse() {
             echo "Another Bucket is already mounted at $GS_MOUNT_PATH"
         else
             echo "Mounting Google Storage Bucket $GS_BUCKET to $GS_MOUNT_PATH"
-            gcsfuse "$GS_BUCKET" "$GS_MOUNT_PATH"
+            gcsfuse $GS_MOUNT_OPTS "$GS_BUCKET" "$GS_MOUNT_PATH"
         fi
     fi
 }
@@ -58,7 +62,7 @@ mount_s3fs() {
             echo "S3 Bucket is already mounted at $S3_MOUNT_PATH"
         else
             echo "Mounting S3 Bucket $S3_BUCKET to $S3_MOUNT_PATH"
-            s3fs "$S3_BUCKET" "$S3_MOUNT_PATH" -o passwd_file=/etc/passwd-s3fs
+            s3fs "$S3_BUCKET" "$S3_MOUNT_PATH" -o passwd_file=/etc/passwd-s3fs $S3_MOUNT_OPTS
         fi
     fi
 
@@ -77,23 +81,32 @@ mount_miniofs() {
             echo "Minio Bucket is already mounted at $MINIO_MOUNT_PATH"
         else
             echo "Mounting Minio Bucket $MINIO_BUCKET to $MINIO_MOUNT_PATH"
-            s3fs "$MINIO_BUCKET" "$MINIO_MOUNT_PATH" -o passwd_file=/etc/passwd-miniofs -o url="$MINIO_ENDPOINT/" -o use_path_request_style
+            s3fs "$MINIO_BUCKET" "$MINIO_MOUNT_PATH" -o passwd_file=/etc/passwd-miniofs -o url="$MINIO_ENDPOINT/" -o use_path_request_style $MINIO_MOUNT_OPTS
         fi
     fi
 }
 
 install_storage() {
     install_prereqs
-    if [[ "$MOUNT_GS" == "True" ]]; then
+    if [[ "$MOUNT_GS" == "True" || " $MOUNT_PROVIDERS " == *" gs "* ]]; then
         install_gcsfuse
     fi
-    if [[ "$MOUNT_S3" == "True" || "$MOUNT_MINIO" == "True" ]]; then
+    if [[ "$MOUNT_S3" == "True" || "$MOUNT_MINIO" == "True" || " $MOUNT_PROVIDERS " == *" s3 "* || " $MOUNT_PROVIDERS " == *" minio "* ]]; then
         install_s3fs
     fi
+    if [[ "$MOUNT_S3" == "True" || " $MOUNT_PROVIDERS " == *" s3 "* ]]; then
+        setup_s3fs_credentials
+    fi
+    if [[ "$MOUNT_MINIO" == "True" || " $MOUNT_PROVIDERS " == *" minio "* ]]; then
+        setup_miniofs_credentials
+    fi
 }
 
 
 mount_storage() {
+    if [[ "$MOUNT_CACHE_DIR" != "" ]]; then
+        mkdir -p "$MOUNT_CACHE_DIR/gs" "$MOUNT_CACHE_DIR/s3" "$MOUNT_CACHE_DIR/minio"
+    fi
     if [[ "$MOUNT_GS" == "True" ]]; then
         mount_gcsfuse
     fi
@@ -107,4 +120,6 @@ mount_storage() {
 
 
 install_storage
-mount_storage
+if [[ "$MODE" == "all" ]]; then
+    mount_storage
+fi
@@ -1,42 +1,113 @@
-from lazycls.utils import exec_shell, exec_daemon, subprocess
+import time
+import shlex
+from lazycls.utils import subprocess
 from inletscolab.config import ServerConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler, exec_daemon
+from inletscolab.probes import Probe
+from inletscolab.logs import Logs
+from inletscolab.state import State
+from inletscolab.procs import Procs
+from inletscolab.budgets import Budgets
 
 class Server:
     d: subprocess.Popen = None
+    background: bool = False
+    ready_time: float = None
 
     @classmethod
     def run_foreground(cls, cmd: str):
-        if cls.d: return
-        cls.d = subprocess.Popen([cmd], shell=True, stdout=subprocess.PIPE, bufsize=1, universal_newlines=True)
-        with cls.d as proc:
-            for line in proc.stdout:
-                print(line, end="")
+        """ Streams Server output into the cell. Interrupting stops the stream, not the Server """
+        cls.run_background(cmd)
+        cls.follow()
+
+    @classmethod
+    def follow(cls):
+        try:
+            for line in Logs.follow('server'): print(line)
+        except KeyboardInterrupt:
+            logger.info('Stopped following Server logs. The Server is still running.')
     
     @classmethod
     def run_background(cls, cmd: str, set_proc_uid: bool = False, **kwargs):
         if cls.d: return
-        cls.d = exec_daemon(cmd=cmd.split(' '), set_proc_uid=set_proc_uid, **kwargs)
+        cls.d = exec_daemon(cmd=shlex.split(cmd), set_proc_uid=set_proc_uid, **kwargs)
+        Logs.attach('server', cls.d)
 
     @classmethod
     def kill(cls):
-        if not cls.d: return
-        cls.d.kill()
+        """ Stops the Server gracefully, including one started by another process """
+        if cls.d: Procs.stop(cls.d, name='Server')
+        Procs.stop_recorded('server')
         cls.d = None
 
     @classmethod
+    def get_config(cls):
+        """ The port and host come from InletsConfig, so they are added for a Server on another port not to be adopted """
+        return dict(ServerConfig.export_config(), port = ServerConfig.port, host = ServerConfig.host)
+
+    @classmethod
+    def adopt(cls) -> bool:
+        """ Reuses a Server left running by an earlier start with the same config, replacing one that isn't """
+        handle = State.get_running('server', cls.get_config())
+        if not handle:
+            if cls.d: cls.kill()
+            return False
+        if not cls.d or cls.d.pid != handle.pid: cls.d = handle
+        # The generated password is only known to the earlier start
+        if not ServerConfig.password: ServerConfig.password = State.get('server').get('password', '')
+        logger.info(f'Server is already running with pid {handle.pid}')
+        return True
+
+    @classmethod
+    def restart(cls):
+        """ Relaunches a background Server after it has exited """
+        if cls.d: Procs.stop(cls.d, name='Server')
+        cls.d = None
+        State.update('server', pid = None)
+        cls.run_startup()
+        cls.launch(background=True)
+
+    @classmethod
+    @Profiler.profile('server.ready')
+    def wait_ready(cls, timeout: float = 120.0):
+        """ Blocks until the Server accepts TCP connections and answers HTTP requests """
+        start = time.perf_counter()
+        Probe.wait_for_port(ServerConfig.host, ServerConfig.port, timeout=timeout)
+        Probe.wait_for_http(ServerConfig.local_url, timeout=max(timeout - (time.perf_counter() - start), 1.0))
+        cls.ready_time = time.perf_counter() - start
+        logger.info(f'Server is ready at {ServerConfig.local_url} after {cls.ready_time:.2f}s')
+        return cls.ready_time
+
+    @classmethod
+    @Profiler.profile('server.startup')
     def run_startup(cls, **kwargs):
-        if cls.d: return
         ServerConfig.update_config(**kwargs)
-        exec_shell(f"fuser -n tcp -k {ServerConfig.port}")
+        if cls.adopt(): return
+        # Only an unrecorded process, or a Server from another config, can be holding the port at this point
+        Procs.free_port(ServerConfig.port)
         if ServerConfig.code: ServerConfig.ensure_codeserver()
     
     @classmethod
+    @Profiler.profile('server.run')
     def run_server(cls, background: bool = True, **kwargs):
         cls.run_startup(**kwargs)
-        cmd = ServerConfig.get_cmd()
-        if DebugEnabled: logger.info(cmd)
+        return cls.launch(background=background)
+
+    @classmethod
+    def launch(cls, background: bool = True, **kwargs):
+        """ Starts the Server, assuming startup has already completed. An adopted Server is kept """
+        cls.background = background
+        if not cls.d:
+            cls.ready_time = None
+            # Generating auth changes the config, so a rerun in this interpreter must match either hash
+            hashes = [State.hash_config(cls.get_config())]
+            cmd = ServerConfig.get_cmd()
+            if DebugEnabled: logger.info(cmd)
+            cls.run_background(cmd, **kwargs)
+            hashes.append(State.hash_config(cls.get_config()))
+            State.record_process('server', cls.d.pid, hashes, password = ServerConfig.password, port = ServerConfig.port)
+            Budgets.apply('server', cls.d.pid)
         ServerConfig.display_info()
-        if not background: return cls.run_foreground(cmd)
-        cls.run_background(cmd, **kwargs)
+        if not background: cls.follow()
         
 
@@ -0,0 +1,164 @@
+import json
+import shlex
+from lazycls.types import *
+from lazycls.utils import subprocess
+from lazycls.serializers import Base
+from inletscolab.config import InletsConfig, ServerConfig, ProxyConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler, exec_daemon
+from inletscolab.probes import Probe
+from inletscolab.logs import Logs
+from inletscolab.state import State
+from inletscolab.procs import Procs
+from inletscolab.budgets import Budget, Budgets
+
+""" Additional Local Services exposed through the same inlets client """
+
+class Service:
+    def __init__(self, name: str, port: int, subdomain: str = '', host: str = None, cmd: str = None, budget: Budget = None):
+        self.name = name
+        self.port = int(port)
+        # The http client routes by domain, so each service needs its own
+        self.subdomain = subdomain or name
+        self.host = host or InletsConfig.client_host
+        self.cmd = cmd
+        self.budget = budget
+
+    @classmethod
+    def parse(cls, spec: Union[str, Dict[str, Any]]):
+        """ Accepts `name:port[:subdomain]` or a dict with name, port and optionally subdomain, host and cmd """
+        if isinstance(spec, dict): return cls(**spec)
+        parts = [p.strip() for p in spec.split(':')]
+        if len(parts) not in {2, 3} or not parts[1].isdigit(): raise ValueError(f'Invalid Service {spec}. Expected name:port[:subdomain]')
+        return cls(*parts)
+
+    @property
+    def domain(self):
+        return f'{self.subdomain}.{InletsConfig.domain_name}'
+
+    @property
+    def upstream_url(self):
+        """ An http client mapping of `domain=http://host:port` """
+        return f'{self.domain}=http://{self.host}:{self.port}'
+
+    @property
+    def public_url(self):
+        if InletsConfig.is_cluster: return f'https://{InletsConfig.active_server_host}:{self.port}'
+        return f'https://{self.domain}'
+
+    @property
+    def local_url(self):
+        return f'http://{self.host}:{self.port}/'
+
+    @property
+    def managed(self):
+        """ InletsColab starts and supervises the service, rather than only tunnelling to it """
+        return bool(self.cmd) or self.name == 'lab'
+
+    def get_credentials(self) -> Dict[str, str]:
+        """ A managed Lab's own token and password, generated once and kept in the State file, so the Server's are left as they are """
+        entry = State.get(f'service-{self.name}')
+        if not entry.get('token'):
+            entry = {'token': ServerConfig.get_lab_token(), 'password': (ServerConfig.password if not ServerConfig.generate_auth else Base.get_uuid()) or ''}
+            State.update(f'service-{self.name}', **entry)
+        return {'token': entry['token'], 'password': entry.get('password', '')}
+
+    def get_cmd(self):
+        # Jupyter Lab alongside code-server
+        if self.name == 'lab' and not self.cmd: return ServerConfig.build_lab_cmd(self.port, **self.get_credentials())
+        return self.cmd
+
+    def to_dict(self):
+        return {'name': self.name, 'port': self.port, 'subdomain': self.subdomain, 'host': self.host, 'cmd': self.cmd, 'budget': self.budget.to_dict() if self.budget else None}
+
+    def __repr__(self):
+        return f'<Service {self.name} @ {self.host}:{self.port}>'
+
+
+class Services:
+    procs: Dict[str, subprocess.Popen] = {}
+
+    @classmethod
+    def get_specs(cls) -> List[Service]:
+        """ The services from INLETS_SERVICES, as `name:port[:subdomain],...` or a JSON list """
+        services = InletsConfig.services
+        if isinstance(services, str):
+            services = json.loads(services) if services.strip().startswith('[') else [s for s in services.split(',') if s.strip()]
+        specs = [Service.parse(s) for s in services or []]
+        if ServerConfig.instances > 1:
+            from inletscolab.pool import ServerPool
+            specs += ServerPool.get_instances()
+        ports, names = [ServerConfig.port] + [s.port for s in specs], ['server'] + [s.name for s in specs]
+        if ProxyConfig.required: ports.append(ProxyConfig.port)
+        if len(set(ports)) != len(ports): raise ValueError(f'Services must use distinct ports, got {ports}')
+        if len(set(names)) != len(names): raise ValueError(f'Services must use distinct names, got {names}')
+        return specs
+
+    @classmethod
+    def get(cls, name: str) -> Service:
+        for s in cls.get_specs():
+            if s.name == name: return s
+        raise KeyError(f'No Service named {name}')
+
+    @classmethod
+    def launch(cls, service: Service):
+        """ Starts the service's command, unless it has none or its port is already being served """
+        if not service.managed: return
+        proc = cls.procs.get(service.name)
+        if proc and proc.poll() is None: return
+        if Probe.tcp(service.host, service.port):
+            # One recorded from another config, i.e. another command or budget, is replaced
+            component = f'service-{service.name}'
+            if not State.get(component).get('pid') or State.is_current(component, service.to_dict()):
+                logger.info(f'{service.name} is already serving on {service.host}:{service.port}')
+                return
+            logger.info(f'{service.name} was started from another config. Restarting it')
+            Procs.stop_recorded(component)
+        cmd = service.get_cmd()
+        if DebugEnabled: logger.info(cmd)
+        cls.procs[service.name] = exec_daemon(cmd=shlex.split(cmd), set_proc_uid=False)
+        Logs.attach(service.name, cls.procs[service.name])
+        State.record_process(f'service-{service.name}', cls.procs[service.name].pid, [State.hash_config(service.to_dict())])
+        if service.budget: Budgets.apply(f'service-{service.name}', cls.procs[service.name].pid, service.budget)
+
+    @classmethod
+    @Profiler.profile('services.launch')
+    def launch_all(cls):
+        for s in cls.get_specs(): cls.launch(s)
+
+    @classmethod
+    def restart(cls, name: str):
+        cls.kill(name)
+        cls.launch(cls.get(name))
+
+    @classmethod
+    def kill(cls, name: str):
+        """ Stops the service gracefully, including one started by another process """
+        proc = cls.procs.pop(name, None)
+        if proc: Procs.stop(proc, name=name)
+        Procs.stop_recorded(f'service-{name}')
+
+    @classmethod
+    def kill_all(cls):
+        names = set(cls.procs) | {c.split('-', 1)[1] for c in State.load() if c.startswith('service-')}
+        for name in names: cls.kill(name)
+
+    @classmethod
+    def supervise(cls):
+        from inletscolab.supervisor import Supervisor
+        for s in cls.get_specs():
+            if s.managed: Supervisor.watch(f'service:{s.name}', lambda name=s.name: cls.procs.get(name), lambda name=s.name: cls.restart(name))
+
+    @classmethod
+    def wait_ready(cls, timeout: float = 120.0) -> Dict[str, float]:
+        return {s.name: Probe.wait_for_port(s.host, s.port, timeout=timeout) for s in cls.get_specs()}
+
+    @classmethod
+    def display_info(cls):
+        specs = cls.get_specs()
+        if not specs: return
+        msg = "\n\nServices:\n"
+        for s in specs:
+            msg += f"  - {s.name}: {s.public_url} -> {s.local_url}"
+            if s.name == 'lab' and not s.cmd: msg += f" Token: {s.get_credentials()['token']}"
+            msg += "\n"
+        logger.info(msg)
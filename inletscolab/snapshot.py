@@ -0,0 +1,263 @@
+import os
+import io
+import gzip
+import json
+import time
+import fnmatch
+import hashlib
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lazycls.types import *
+from inletscolab.config import SnapshotConfig, logger, DebugEnabled
+from inletscolab.profiler import Profiler
+
+""" Compressed, Chunked Environment Snapshots for Warm Starts """
+
+
+class Codec:
+    """ zstd when the zstandard package is installed, otherwise gzip """
+    def __init__(self, name: str = None, level: int = None):
+        self.name = name or ('zstd' if self.get_zstd() else 'gzip')
+        self.level = level or SnapshotConfig.level
+        if self.name == 'zstd' and not self.get_zstd(): raise ImportError('This snapshot is zstd compressed, which requires zstandard. Install it with `pip install inletscolab[zstd]`')
+
+    @classmethod
+    def get_zstd(cls):
+        try: import zstandard
+        except ImportError: return None
+        return zstandard
+
+    @property
+    def ext(self):
+        return 'zst' if self.name == 'zstd' else 'gz'
+
+    def compress(self, data: bytes) -> bytes:
+        # zstandard compressors are not thread safe, so each call gets its own
+        if self.name == 'zstd': return self.get_zstd().ZstdCompressor(level=self.level).compress(data)
+        return gzip.compress(data, compresslevel=min(max(self.level, 1), 9), mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.name == 'zstd': return self.get_zstd().ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+
+class ChunkWriter(io.RawIOBase):
+    """ A write-only stream for tarfile, which stores each full chunk as it is written """
+    def __init__(self, store: Callable[[bytes], str], chunk_size: int):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.digests: List[str] = []
+        self.size = 0
+
+    def writable(self): return True
+
+    def write(self, data: bytes):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.chunk_size:
+            self.digests.append(self.store(bytes(self.buffer[:self.chunk_size])))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def finish(self) -> List[str]:
+        if self.buffer: self.digests.append(self.store(bytes(self.buffer)))
+        self.buffer = bytearray()
+        return self.digests
+
+
+class ChunkReader(io.RawIOBase):
+    """ A read-only stream over decompressed chunks, fetching the next while the current one is read """
+    def __init__(self, fetch: Callable[[str], bytes], digests: List[str], pool: ThreadPoolExecutor):
+        self.fetch = fetch
+        self.futures = [pool.submit(fetch, d) for d in digests[:2]]
+        self.pending = list(digests[2:])
+        self.pool = pool
+        self.current = memoryview(b'')
+
+    def readable(self): return True
+
+    def readinto(self, b) -> int:
+        while not len(self.current):
+            if not self.futures: return 0
+            self.current = memoryview(self.futures.pop(0).result())
+            if self.pending: self.futures.append(self.pool.submit(self.fetch, self.pending.pop(0)))
+        n = min(len(b), len(self.current))
+        b[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+
+class Snapshot:
+    """
+    Each immediate child of a snapshot path, i.e. one extension or one package, is packed as its own
+    tar stream, split into chunks and compressed. Chunks are stored by the sha256 of their contents, so
+    unchanged chunks are never uploaded twice, and a group whose files all have the same size and mtime
+    as the last snapshot is not packed again. Groups are restored as parallel streams.
+    """
+    index: Dict[str, Any] = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def get_backend(cls, target: str = None):
+        from inletscolab.backup import Backup
+        target = target or SnapshotConfig.target
+        if not target: raise ValueError('Set SNAPSHOT_TARGET or STORAGE_BACKUP to save snapshots')
+        return Backup.get_backend(target)
+
+    @classmethod
+    def load_index(cls):
+        with cls._lock:
+            if cls.index is not None: return cls.index
+            cls.index = {'groups': {}, 'chunks': []}
+            p = SnapshotConfig.index_file
+            if p.exists():
+                try: cls.index = json.loads(p.read_text())
+                except ValueError: logger.warn(f'Snapshot Index at {p.string} is corrupt. Every group will be packed again.')
+            return cls.index
+
+    @classmethod
+    def save_index(cls):
+        with cls._lock:
+            p = SnapshotConfig.index_file
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.parent.joinpath('index.json.tmp')
+            tmp.write_text(json.dumps(cls.index))
+            os.replace(tmp.string, p.string)
+
+    @classmethod
+    def is_excluded(cls, name: str):
+        return any(fnmatch.fnmatch(name, pat) for pat in SnapshotConfig.exclude)
+
+    @classmethod
+    def get_groups(cls, root: str) -> Dict[str, List[str]]:
+        """ Maps each child directory of `root` to the paths under it, with files directly in `root` under '.' """
+        groups: Dict[str, List[str]] = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root)
+            # Symlinks to directories are kept as links rather than followed
+            links = [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]
+            dirnames[:] = sorted(d for d in dirnames if d not in links and not cls.is_excluded(d) and not os.path.ismount(os.path.join(dirpath, d)))
+            # Directories are listed before their contents, as tar needs
+            for name in dirnames + sorted(n for n in filenames + links if not cls.is_excluded(n)):
+                rel = os.path.normpath(os.path.join(rel_dir, name))
+                group = rel.split(os.sep, 1)[0] if rel_dir != '.' or name in dirnames else '.'
+                groups.setdefault(group, []).append(rel)
+        return {g: m for g, m in groups.items() if m}
+
+    @classmethod
+    def signature(cls, root: str, members: List[str]) -> str:
+        h = hashlib.sha256()
+        for rel in members:
+            try: st = os.lstat(os.path.join(root, rel))
+            except OSError: continue
+            h.update(f'{rel}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_mode}\n'.encode())
+        return h.hexdigest()
+
+    @classmethod
+    def chunk_key(cls, digest: str, codec: Codec):
+        return f'chunks/{digest[:2]}/{digest}.{codec.ext}'
+
+    @classmethod
+    @Profiler.profile('snapshot.save')
+    def save(cls, paths: List[str] = None, target: str = None, workers: int = None, name: str = None) -> Dict[str, Any]:
+        """ Packs every snapshot path, uploading only new chunks, and writes a manifest """
+        paths = [os.path.abspath(p) for p in (paths or SnapshotConfig.paths) if os.path.isdir(p)]
+        backend = cls.get_backend(target)
+        codec = Codec()
+        start = time.perf_counter()
+        index = cls.load_index()
+        if index.get('target') != repr(backend) or index.get('codec') != codec.name: index = cls.index = {'groups': {}, 'chunks': [], 'target': repr(backend), 'codec': codec.name}
+        known = set(index['chunks'])
+        stats = {'groups': 0, 'packed': 0, 'bytes': 0, 'bytes_sent': 0, 'chunks_sent': 0}
+
+        def store(data: bytes) -> str:
+            digest = hashlib.sha256(data).hexdigest()
+            with cls._lock:
+                if digest in known: return digest
+                known.add(digest)
+            packed = codec.compress(data)
+            try: backend.put(cls.chunk_key(digest, codec), packed)
+            except Exception:
+                with cls._lock: known.discard(digest)
+                raise
+            with cls._lock:
+                stats['bytes_sent'] += len(packed)
+                stats['chunks_sent'] += 1
+            return digest
+
+        def pack(root: str, group: str, members: List[str]) -> Dict[str, Any]:
+            sig = cls.signature(root, members)
+            prev = index['groups'].get(root, {}).get(group)
+            if prev and prev['signature'] == sig: return prev
+            writer = ChunkWriter(store, SnapshotConfig.chunk_size)
+            with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for rel in members:
+                    try: tar.add(os.path.join(root, rel), arcname=rel, recursive=False)
+                    except OSError as e: logger.warn(f'Skipping {rel} in {root}: {e}')
+            with cls._lock: stats['packed'] += 1
+            return {'signature': sig, 'chunks': writer.finish(), 'size': writer.size}
+
+        groups: Dict[str, Dict[str, Any]] = {}
+        with ThreadPoolExecutor(max_workers=max(workers or SnapshotConfig.workers, 1)) as pool:
+            futures = {(root, group): pool.submit(pack, root, group, members) for root in paths for group, members in cls.get_groups(root).items()}
+            for (root, group), fut in futures.items():
+                entry = fut.result()
+                groups.setdefault(root, {})[group] = entry
+                stats['groups'] += 1
+                stats['bytes'] += entry['size']
+        manifest = json.dumps({'created': time.time(), 'codec': codec.name, 'groups': groups}).encode()
+        name = name or str(int(time.time()))
+        backend.put(f'manifests/{name}.json', manifest)
+        backend.put('manifests/latest.json', manifest)
+        with cls._lock:
+            index.update(groups = groups, chunks = sorted(known), target = repr(backend), codec = codec.name)
+            cls.save_index()
+        stats['duration'] = round(time.perf_counter() - start, 3)
+        logger.info(f"Saved Snapshot of {stats['groups']} groups ({stats['bytes'] / 1024 / 1024:.1f}MB) to {backend}. Packed {stats['packed']}, sent {stats['bytes_sent'] / 1024 / 1024:.1f}MB in {stats['duration']:.2f}s")
+        return stats
+
+    @classmethod
+    @Profiler.profile('snapshot.restore')
+    def restore(cls, target: str = None, workers: int = None, manifest: str = 'latest') -> Dict[str, Any]:
+        """ Streams every group back into place in parallel, each fetching and decompressing its chunks ahead of extraction """
+        backend = cls.get_backend(target)
+        start = time.perf_counter()
+        data = json.loads(backend.get(f'manifests/{manifest}.json'))
+        codec = Codec(data['codec'])
+        groups = data['groups']
+        stats = {'groups': sum(len(g) for g in groups.values()), 'restored': 0, 'bytes': 0, 'failed': 0}
+        workers = max(workers or SnapshotConfig.workers, 1)
+
+        def fetch(digest: str) -> bytes:
+            return codec.decompress(backend.get(cls.chunk_key(digest, codec)))
+
+        # Downloads get their own pool, so streams waiting on chunks can't starve it
+        with ThreadPoolExecutor(max_workers=workers * 2) as fetch_pool, ThreadPoolExecutor(max_workers=workers) as pool:
+            def unpack(root: str, entry: Dict[str, Any]):
+                os.makedirs(root, exist_ok=True)
+                reader = io.BufferedReader(ChunkReader(fetch, entry['chunks'], fetch_pool), buffer_size=1024 * 1024)
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    if hasattr(tarfile, 'tar_filter'): tar.extractall(root, filter='tar')
+                    else: tar.extractall(root)
+                return entry['size']
+
+            futures = {(root, group): pool.submit(unpack, root, entry) for root, g in groups.items() for group, entry in g.items()}
+            for (root, group), fut in futures.items():
+                try: stats['bytes'] += fut.result()
+                except Exception as e:
+                    stats['failed'] += 1
+                    logger.error(f'Failed to restore {group} in {root}: {e}')
+                    continue
+                stats['restored'] += 1
+        # Restored groups match the manifest, so the next save only packs what changes afterwards
+        with cls._lock:
+            for root, g in groups.items():
+                current = cls.get_groups(root) if os.path.isdir(root) else {}
+                for group, entry in g.items(): entry['signature'] = cls.signature(root, current.get(group, []))
+            cls.index = {'groups': groups, 'chunks': sorted({d for g in groups.values() for e in g.values() for d in e['chunks']}), 'target': repr(backend), 'codec': codec.name}
+            cls.save_index()
+        stats['duration'] = round(time.perf_counter() - start, 3)
+        logger.info(f"Restored {stats['restored']} of {stats['groups']} groups ({stats['bytes'] / 1024 / 1024:.1f}MB) from {backend} in {stats['duration']:.2f}s")
+        return stats
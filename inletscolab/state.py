@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import signal
+import hashlib
+import threading
+from lazycls.types import *
+from lazycls.prop import classproperty
+from inletscolab.config import authz_dir, logger, DebugEnabled
+
+""" Persisted Runtime State for Idempotent, Incremental Starts """
+
+def get_cmdline(pid: int) -> Optional[str]:
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f: return f.read().replace(b'\0', b' ').decode(errors='replace').strip()
+    except OSError: return None
+
+
+def pid_alive(pid: int, cmdline: str = None) -> bool:
+    """ Checks the pid exists, and if `cmdline` is given, that it still belongs to the same command """
+    if not pid: return False
+    current = get_cmdline(pid)
+    if current is None: return False
+    # Zombies keep their pid but have an empty cmdline
+    if not current: return False
+    return cmdline is None or current == cmdline
+
+
+class PidHandle:
+    """ A Popen-like handle for a process started by an earlier interpreter, which can't be waited on """
+    def __init__(self, pid: int, cmdline: str = None):
+        self.pid = pid
+        self.cmdline = cmdline if cmdline is not None else get_cmdline(pid)
+        self.returncode: int = None
+        self.stdout = None
+        self.stderr = None
+
+    def poll(self):
+        if self.returncode is None and not pid_alive(self.pid, self.cmdline): self.returncode = -1
+        return self.returncode
+
+    def send_signal(self, sig: int):
+        if self.poll() is not None: return
+        try: os.kill(self.pid, sig)
+        except ProcessLookupError: self.returncode = -1
+
+    def terminate(self): self.send_signal(signal.SIGTERM)
+
+    def kill(self): self.send_signal(signal.SIGKILL)
+
+    def wait(self, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline and time.monotonic() > deadline: raise TimeoutError(f'pid {self.pid} is still running')
+            time.sleep(0.05)
+        return self.returncode
+
+
+class State:
+    _lock = threading.RLock()
+
+    @classproperty
+    def state_file(cls):
+        return authz_dir.joinpath('state.json')
+
+    @classmethod
+    def hash_config(cls, config: Any) -> str:
+        return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+    @classmethod
+    def load(cls) -> Dict[str, Dict[str, Any]]:
+        if not cls.state_file.exists(): return {}
+        try: return json.loads(cls.state_file.read_text())
+        except ValueError:
+            logger.warn(f'State at {cls.state_file.string} is corrupt. Ignoring it.')
+            return {}
+
+    @classmethod
+    def save(cls, state: Dict[str, Dict[str, Any]]):
+        cls.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cls.state_file.parent.joinpath('.state.json.tmp')
+        tmp.write_text(json.dumps(state, indent=2, default=str))
+        # May hold a generated server password
+        os.chmod(tmp.string, 0o600)
+        os.replace(tmp.string, cls.state_file.string)
+
+    @classmethod
+    def get(cls, component: str) -> Dict[str, Any]:
+        return cls.load().get(component, {})
+
+    @classmethod
+    def update(cls, component: str, **data):
+        with cls._lock:
+            state = cls.load()
+            state.setdefault(component, {}).update(data, updated=time.time())
+            cls.save(state)
+            if DebugEnabled: logger.info(f'Updated State for {component}: {list(data)}')
+
+    @classmethod
+    def clear(cls, component: str = None):
+        with cls._lock:
+            state = cls.load() if component else {}
+            state.pop(component, None)
+            cls.save(state)
+
+    @classmethod
+    def record_process(cls, component: str, pid: int, hashes: List[str], **data):
+        # Popen can return while the child is still in exec, when its cmdline reads as empty
+        cmdline, deadline = get_cmdline(pid), time.monotonic() + 1.0
+        while cmdline == '' and time.monotonic() < deadline:
+            time.sleep(0.01)
+            cmdline = get_cmdline(pid)
+        cls.update(component, pid=pid, cmdline=cmdline, hashes=hashes, **data)
+
+    @classmethod
+    def is_current(cls, component: str, config: Any) -> bool:
+        """ The component was set up from a config hashing the same as `config` """
+        return cls.hash_config(config) in cls.get(component).get('hashes', [])
+
+    @classmethod
+    def get_running(cls, component: str, config: Any) -> Optional[PidHandle]:
+        """ Returns a handle to the component's process if it is alive and was started from the same config """
+        entry = cls.get(component)
+        if not entry.get('pid') or not cls.is_current(component, config): return None
+        if not pid_alive(entry['pid'], entry.get('cmdline')): return None
+        return PidHandle(entry['pid'], entry.get('cmdline'))
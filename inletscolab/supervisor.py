@@ -0,0 +1,136 @@
+import time
+import random
+import threading
+from lazycls.types import *
+from lazycls.utils import subprocess
+from lazycls.prop import classproperty
+from inletscolab.config import SupervisorConfig, logger, DebugEnabled
+from inletscolab.state import State
+
+""" In-Process Supervisor that restarts crashed children with backoff """
+
+class Watched:
+    def __init__(self, name: str, get_proc: Callable[[], subprocess.Popen], restart: Callable[[], Any]):
+        self.name = name
+        self.get_proc = get_proc
+        self.restart = restart
+        self.restarts: int = 0
+        self.failures: int = 0
+        self.downtime: float = 0.0
+        self.down_since: float = None
+        self.next_restart: float = None
+        self.last_exit: int = None
+        self.history: List[float] = []
+        self.gave_up: bool = False
+
+    def get_delay(self):
+        delay = min(SupervisorConfig.backoff_initial * (2 ** self.failures), SupervisorConfig.backoff_max)
+        return delay * random.uniform(1 - SupervisorConfig.jitter, 1 + SupervisorConfig.jitter)
+
+    def over_budget(self, now: float):
+        self.history = [t for t in self.history if now - t < SupervisorConfig.restart_window]
+        return len(self.history) >= SupervisorConfig.max_restarts
+
+    def check(self, now: float):
+        if self.gave_up: return
+        proc = self.get_proc()
+        # A failed restart can leave no process at all, which stays down until a restart succeeds
+        if proc is None and self.down_since is None: return
+        if proc is not None and proc.poll() is None:
+            # Restarted outside the Supervisor, i.e. by the Watchdog or an endpoint switch
+            if self.down_since is not None:
+                self.downtime += now - self.down_since
+                self.down_since = self.next_restart = None
+                logger.info(f'{self.name} is running again')
+            # Stable for a full window, so the next crash starts the backoff over
+            if self.failures and self.history and now - self.history[-1] > SupervisorConfig.restart_window: self.failures = 0
+            return
+        if self.down_since is None:
+            self.down_since = now
+            self.last_exit = proc.returncode
+            if self.over_budget(now):
+                self.gave_up = True
+                logger.error(f'{self.name} exited with {proc.returncode} and has used its restart budget of {SupervisorConfig.max_restarts} per {SupervisorConfig.restart_window:.0f}s. Not restarting.')
+                return
+            delay = self.get_delay()
+            self.next_restart = now + delay
+            logger.warn(f'{self.name} exited with {proc.returncode}. Restarting in {delay:.1f}s')
+            return
+        if now < self.next_restart: return
+        self.history.append(now)
+        self.failures += 1
+        try: self.restart()
+        except Exception as e:
+            if self.over_budget(now):
+                self.gave_up = True
+                logger.error(f'Failed to restart {self.name}: {e}. It has used its restart budget, so it stays down.')
+                return
+            delay = self.get_delay()
+            self.next_restart = now + delay
+            logger.error(f'Failed to restart {self.name}: {e}. Retrying in {delay:.1f}s')
+            return
+        now = time.monotonic()
+        self.downtime += now - self.down_since
+        self.restarts += 1
+        self.down_since = self.next_restart = None
+        logger.info(f'Restarted {self.name} (restart #{self.restarts})')
+
+    def stats(self):
+        return {
+            'restarts': self.restarts,
+            'downtime': round(self.downtime, 3),
+            'last_exit': self.last_exit,
+            'down': self.down_since is not None,
+            'gave_up': self.gave_up,
+        }
+
+
+class Supervisor:
+    watched: Dict[str, Watched] = {}
+    _thread: threading.Thread = None
+    _stop: threading.Event = threading.Event()
+
+    @classmethod
+    def watch(cls, name: str, get_proc: Callable[[], subprocess.Popen], restart: Callable[[], Any]):
+        if name not in cls.watched: cls.watched[name] = Watched(name, get_proc, restart)
+        return cls.watched[name]
+
+    @classmethod
+    def unwatch(cls, name: str):
+        return cls.watched.pop(name, None)
+
+    @classproperty
+    def running(cls):
+        return cls._thread is not None and cls._thread.is_alive()
+
+    @classmethod
+    def run(cls):
+        while not cls._stop.wait(SupervisorConfig.interval):
+            # `inletscolab stop` from another process can't reach this thread, so it leaves a flag
+            if State.get('supervisor').get('stopped'):
+                logger.info('InletsColab was stopped by another process. Supervisor is exiting.')
+                break
+            now = time.monotonic()
+            for w in list(cls.watched.values()):
+                try: w.check(now)
+                except Exception as e: logger.error(f'Supervisor check for {w.name} failed: {e}')
+
+    @classmethod
+    def start(cls):
+        if cls.running: return
+        cls._stop.clear()
+        State.update('supervisor', stopped = False)
+        cls._thread = threading.Thread(target=cls.run, name='InletsColabSupervisor', daemon=True)
+        cls._thread.start()
+        if DebugEnabled: logger.info(f'Supervisor started, watching: {list(cls.watched)}')
+
+    @classmethod
+    def stop(cls):
+        if not cls.running: return
+        cls._stop.set()
+        cls._thread.join(timeout=SupervisorConfig.interval * 2)
+        cls._thread = None
+
+    @classmethod
+    def stats(cls):
+        return {name: w.stats() for name, w in cls.watched.items()}
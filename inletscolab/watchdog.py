@@ -0,0 +1,120 @@
+import time
+import uuid
+import threading
+import urllib.error
+import urllib.request
+from lazycls.types import *
+from inletscolab.config import WatchdogConfig, logger, DebugEnabled
+from inletscolab.probes import Probe
+
+"""
+End-to-End Tunnel Liveness Watchdog
+
+A running inlets client can stay connected while the tunnel is stalled, so the watchdog
+sends a request through the public URL and restarts the client after repeated failures.
+"""
+
+class Watchdog:
+    stats: Dict[str, Any] = {
+        'probes': 0, 'failures': 0, 'streak': 0, 'last_rtt': None, 'avg_rtt': None,
+        'reconnects': 0, 'failed_reconnects': 0, 'last_detection': None, 'last_reconnect': None, 'reconnect_times': [],
+    }
+    thread: threading.Thread = None
+    first_failure: float = None
+    _stop = threading.Event()
+    _lock = threading.Lock()
+
+    @classmethod
+    def probe(cls, url: str = None, timeout: float = None) -> Optional[float]:
+        """
+        Returns the round trip time, or None if the probe failed. The response must echo a nonce, which the proxy's
+        probe handler does, proving the request reached this VM rather than the inlets server or a default host
+        """
+        url = url or WatchdogConfig.url
+        nonce = uuid.uuid4().hex[:16]
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f'{url}?n={nonce}', timeout=timeout or WatchdogConfig.timeout) as resp: status, body = resp.status, resp.read(256)
+        except urllib.error.HTTPError as e: status, body = e.code, b''
+        except (urllib.error.URLError, OSError) as e:
+            if DebugEnabled: logger.info(f'Tunnel probe failed: {e}')
+            return None
+        rtt = time.perf_counter() - start
+        if status != 200 or nonce.encode() not in body: return None
+        return rtt
+
+    @classmethod
+    def record(cls, rtt: Optional[float]):
+        with cls._lock:
+            s = cls.stats
+            s['probes'] += 1
+            if rtt is None:
+                s['failures'] += 1
+                s['streak'] += 1
+                if cls.first_failure is None: cls.first_failure = time.monotonic()
+                return
+            s['streak'] = 0
+            cls.first_failure = None
+            s['last_rtt'] = rtt
+            s['avg_rtt'] = rtt if s['avg_rtt'] is None else 0.8 * s['avg_rtt'] + 0.2 * rtt
+
+    @classmethod
+    def check(cls, url: str = None, restart: Callable[[], Any] = None) -> bool:
+        """ Probes once, reconnecting once WATCHDOG_FAILURES probes in a row have failed. Returns whether the probe passed """
+        rtt = cls.probe(url)
+        cls.record(rtt)
+        if rtt is None and cls.stats['streak'] >= WatchdogConfig.failures: cls.reconnect(url, restart)
+        return rtt is not None
+
+    @classmethod
+    def reconnect(cls, url: str = None, restart: Callable[[], Any] = None) -> Optional[float]:
+        """ Restarts the inlets clients and probes with backoff until the tunnel works, returning the time taken """
+        if restart is None:
+            from inletscolab.inlets import Inlets
+            restart = lambda: Inlets.reconnect(timeout=WatchdogConfig.reconnect_timeout)
+        detection = time.monotonic() - cls.first_failure if cls.first_failure else 0.0
+        logger.warn(f"Tunnel failed {cls.stats['streak']} probes over {detection:.1f}s. Reconnecting the inlets client")
+        start = time.perf_counter()
+        latency = None
+        try:
+            restart()
+            Probe.wait_for(lambda: cls.probe(url) is not None, timeout=WatchdogConfig.reconnect_timeout, name='Tunnel Reconnect', max_delay=1.0)
+            latency = time.perf_counter() - start
+            logger.info(f'Tunnel is working again {latency:.2f}s after the reconnect')
+        except Exception as e: logger.error(f'Tunnel did not recover after a reconnect: {e}')
+        with cls._lock:
+            s = cls.stats
+            s['last_detection'] = detection
+            if latency is None: s['failed_reconnects'] += 1
+            else:
+                s['reconnects'] += 1
+                s['last_reconnect'] = latency
+                s['reconnect_times'] = (s['reconnect_times'] + [latency])[-20:]
+            # A failed reconnect starts a new streak, so the next attempt waits for fresh failures
+            s['streak'] = 0
+            cls.first_failure = None
+        return latency
+
+    @classmethod
+    def loop(cls, url: str = None, restart: Callable[[], Any] = None):
+        while not cls._stop.wait(WatchdogConfig.interval):
+            try: cls.check(url, restart)
+            except Exception as e: logger.error(f'Tunnel Watchdog check failed: {e}')
+
+    @classmethod
+    def start(cls, url: str = None, restart: Callable[[], Any] = None):
+        if cls.thread and cls.thread.is_alive(): return
+        cls._stop.clear()
+        cls.thread = threading.Thread(target=cls.loop, args=(url, restart), name='InletsColab-Watchdog', daemon=True)
+        cls.thread.start()
+        logger.info(f'Watching the Tunnel through {url or WatchdogConfig.url} every {WatchdogConfig.interval:.0f}s')
+
+    @classmethod
+    def stop(cls):
+        cls._stop.set()
+        if cls.thread: cls.thread.join(timeout=WatchdogConfig.timeout + 1.0)
+        cls.thread = None
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        with cls._lock: return dict(cls.stats, running = bool(cls.thread and cls.thread.is_alive()))
@@ -18,9 +18,14 @@ requirements = [
     'typer',
 ]
 
+extras = {
+    'zstd': ['zstandard'],
+}
+
 args = {
     'packages': find_packages(include = ['inletscolab', 'inletscolab.*']),
     'install_requires': requirements,
+    'extras_require': extras,
     'long_description': root.joinpath('README.md').read_text(encoding='utf-8'),
     'python_requires': '>=3.7',
     'include_package_data': True,
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests run against the working tree, whether or not the package is installed
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
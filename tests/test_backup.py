@@ -0,0 +1,100 @@
+import os
+import pytest
+from lazycls.io import Path
+from inletscolab.config import BackupConfig
+from inletscolab.backup import Backup, LocalBackend
+
+""" Backup and restore against the local directory backend """
+
+chunk_size = 16
+
+
+@pytest.fixture()
+def backup(tmp_path, monkeypatch):
+    source, target = tmp_path.joinpath('source'), tmp_path.joinpath('target')
+    source.mkdir()
+    monkeypatch.setattr(BackupConfig, 'index_file', Path(tmp_path.joinpath('index.json').as_posix()))
+    monkeypatch.setattr(BackupConfig, 'chunk_size', chunk_size)
+    monkeypatch.setattr(BackupConfig, 'exclude', [])
+    monkeypatch.setattr(Backup, 'index', None)
+    puts = []
+    put = LocalBackend.put
+    def record_put(self, key, data):
+        puts.append(key)
+        return put(self, key, data)
+    monkeypatch.setattr(LocalBackend, 'put', record_put)
+    run = lambda: Backup.run(source = str(source), target = str(target), workers = 2)
+    return source, target, run, puts
+
+
+def chunk_puts(puts):
+    return [k for k in puts if k.startswith('chunks/')]
+
+
+def test_incremental_run_uploads_only_changed_chunks(backup):
+    source, _, run, puts = backup
+    source.joinpath('a.txt').write_bytes(b'a' * chunk_size * 3)
+    source.joinpath('b.txt').write_bytes(b'b' * chunk_size)
+    stats = run()
+    assert stats['changed'] == 2
+    # The three identical chunks of a.txt are stored once
+    assert len(chunk_puts(puts)) == 2
+    puts.clear()
+    source.joinpath('a.txt').write_bytes(b'a' * chunk_size * 2 + b'c' * chunk_size)
+    stats = run()
+    assert stats['changed'] == 1
+    assert len(chunk_puts(puts)) == 1
+    assert stats['bytes_sent'] == chunk_size
+    puts.clear()
+    stats = run()
+    assert stats['changed'] == 0 and not puts
+
+
+def test_removed_files_drop_out_of_the_manifest(backup):
+    source, target, run, _ = backup
+    source.joinpath('keep.txt').write_bytes(b'keep')
+    source.joinpath('gone.txt').write_bytes(b'gone')
+    run()
+    source.joinpath('gone.txt').unlink()
+    stats = run()
+    assert stats['removed'] == 1
+    manifest = Backup.get_backend(str(target)).get('manifests/latest.json')
+    assert b'gone.txt' not in manifest and b'keep.txt' in manifest
+
+
+def test_failed_upload_keeps_the_previous_entry(backup, monkeypatch, tmp_path):
+    source, target, run, _ = backup
+    source.joinpath('a.txt').write_bytes(b'first version')
+    run()
+    source.joinpath('a.txt').write_bytes(b'second version, which fails to upload')
+    put = LocalBackend.put
+    def failing_put(self, key, data):
+        if key.startswith('chunks/'): raise OSError('bucket unavailable')
+        return put(self, key, data)
+    monkeypatch.setattr(LocalBackend, 'put', failing_put)
+    stats = run()
+    assert stats['failed'] == 1
+    assert 'a.txt' in Backup.index['files']
+    dest = tmp_path.joinpath('restored')
+    Backup.restore(dest = str(dest), target = str(target))
+    assert dest.joinpath('a.txt').read_bytes() == b'first version'
+
+
+def test_restore_round_trips_content_and_mode(backup, tmp_path):
+    source, target, run, _ = backup
+    source.joinpath('nested', 'dir').mkdir(parents=True)
+    script = source.joinpath('nested', 'dir', 'run.sh')
+    script.write_bytes(os.urandom(chunk_size * 5 + 3))
+    os.chmod(script, 0o750)
+    source.joinpath('empty.txt').write_bytes(b'')
+    run()
+    dest = tmp_path.joinpath('restored')
+    stats = Backup.restore(dest = str(dest), target = str(target))
+    assert stats['restored'] == 2 and stats['failed'] == 0
+    restored = dest.joinpath('nested', 'dir', 'run.sh')
+    assert restored.read_bytes() == script.read_bytes()
+    assert os.stat(restored).st_mode & 0o777 == 0o750
+    assert os.stat(restored).st_mtime_ns == os.stat(script).st_mtime_ns
+    assert dest.joinpath('empty.txt').read_bytes() == b''
+    # Files already in place are skipped
+    assert Backup.restore(dest = str(dest), target = str(target))['skipped'] == 2
@@ -0,0 +1,21 @@
+import pytest
+from inletscolab.bench import TunnelBench
+
+""" Small TunnelBench runs, so a relay regression shows up as a failure rather than a slower number """
+
+
+@pytest.mark.parametrize('mode', ['tcp', 'http'])
+def test_tunnel_bench(mode):
+    results = TunnelBench.run([mode], baseline=False, requests=50, concurrency=4, bulk_mb=1, ws_messages=20)
+    assert len(results) == 1
+    result = results[0]
+    assert result['mode'] == mode
+    assert result['requests'] == 50
+    for key in ['rps', 'bulk_mbps']: assert result[key] > 0
+    for key in ['p50_ms', 'p95_ms', 'p99_ms', 'ws_p50_ms', 'ws_p99_ms']: assert result[key] >= 0
+    assert result['p50_ms'] <= result['p99_ms']
+
+
+def test_tunnel_bench_baseline():
+    results = TunnelBench.run(['tcp'], requests=20, concurrency=2, bulk_mb=1, ws_messages=10)
+    assert [r['mode'] for r in results] == ['direct', 'tcp']
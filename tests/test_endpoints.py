@@ -0,0 +1,29 @@
+import shutil
+import pytest
+from inletscolab.bench import EndpointBench
+
+""" Endpoint selection against local TLS listeners with injected handshake delays """
+
+pytestmark = pytest.mark.skipif(shutil.which('openssl') is None, reason='needs openssl for a test certificate')
+
+
+def test_selects_the_fastest_healthy_endpoint():
+    delays = (0.15, 0.02, 0.08)
+    result = EndpointBench.run(delays = delays, down = 1, samples = 3)
+    assert result['correct']
+    fastest = next(c for c in result['candidates'] if c['injected_ms'] == min(delays) * 1000)
+    assert result['selected'] == fastest['endpoint']
+    assert result['candidates'][0] == fastest
+    healthy = [c for c in result['candidates'] if c['injected_ms'] is not None]
+    assert len(healthy) == len(delays) and all(c['healthy'] for c in healthy)
+    assert [c['injected_ms'] for c in healthy] == sorted(c['injected_ms'] for c in healthy)
+
+
+def test_marks_the_down_endpoint_unhealthy():
+    result = EndpointBench.run(delays = (0.05, 0.02), down = 2, samples = 2)
+    down = [c for c in result['candidates'] if c['injected_ms'] is None]
+    assert len(down) == 2
+    assert all(not c['healthy'] and c['rtt_ms'] is None for c in down)
+    # Unhealthy candidates rank after every healthy one
+    assert all(c['injected_ms'] is None for c in result['candidates'][-2:])
+    assert result['correct']
@@ -0,0 +1,37 @@
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+""" The CLI stays fast to start: heavy dependencies are only imported by the commands that use them """
+
+root_dir = Path(__file__).resolve().parents[1]
+budget_ms = float(os.environ.get('IMPORT_BUDGET_MS', 150.0))
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root_dir), os.environ.get('PYTHONPATH')])))
+    return subprocess.run([sys.executable, *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=env, cwd=str(root_dir))
+
+
+def test_cmd_does_not_import_heavy_dependencies():
+    proc = run_python('-c', 'import sys, inletscolab.cmd; print(" ".join(sorted(sys.modules)))')
+    assert proc.returncode == 0, proc.stderr
+    modules = set(proc.stdout.split())
+    for name in ['lazycls', 'logz']:
+        assert name not in modules, f'importing inletscolab.cmd imported {name}'
+
+
+def test_cmd_import_time():
+    totals = []
+    for _ in range(3):
+        proc = run_python('-X', 'importtime', '-c', 'import inletscolab.cmd')
+        assert proc.returncode == 0, proc.stderr
+        # Top-level imports are unindented, and their cumulative times add up to the total
+        total = 0
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line: continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if not name[1:].startswith(' '): total += int(cumulative)
+        totals.append(total / 1000)
+    assert min(totals) <= budget_ms, f'importing inletscolab.cmd took {min(totals):.1f}ms, over the {budget_ms:.0f}ms budget'
@@ -0,0 +1,65 @@
+import time
+import threading
+import pytest
+from inletscolab.config import StorageConfig, decode_mountinfo
+from inletscolab.mounts import MountSpec, Mounts
+import inletscolab.mounts as mounts
+
+
+def test_parse_spec():
+    spec = MountSpec.parse('gs://my-bucket=/content/gs/')
+    assert (spec.provider, spec.bucket, spec.path) == ('gs', 'my-bucket', '/content/gs')
+    spec = MountSpec.parse({'provider': 's3', 'bucket': 'data', 'path': '/content/s3', 'options': '-o ro'})
+    assert spec.options == '-o ro'
+
+
+@pytest.mark.parametrize('spec', ['gs://bucket', 'bucket=/content/x', 'ftp://bucket=/content/x'])
+def test_parse_invalid_spec(spec):
+    with pytest.raises(ValueError): MountSpec.parse(spec)
+
+
+def test_cmd_keeps_spaces_in_one_argument():
+    cmd = MountSpec('gs', 'my bucket', '/content/my path', '--implicit-dirs').get_cmd()
+    assert cmd[0] == 'sudo'
+    assert cmd[-2:] == ['my bucket', '/content/my path']
+    assert '--implicit-dirs' in cmd
+    cmd = MountSpec('s3', 'b', '/content/s3 data').get_cmd()
+    assert cmd[:4] == ['sudo', 's3fs', 'b', '/content/s3 data']
+
+
+def test_decode_mountinfo():
+    assert decode_mountinfo('/content/my\\040path') == '/content/my path'
+    assert decode_mountinfo('/a\\011b\\134c') == '/a\tb\\c'
+    assert decode_mountinfo('/content/plain') == '/content/plain'
+
+
+def test_is_mounted(tmp_path):
+    mountinfo = tmp_path.joinpath('mountinfo')
+    mountinfo.write_text(
+        '22 1 0:21 / / rw,relatime - overlay overlay rw\n'
+        '90 22 0:50 / /content/my\\040bucket rw,nosuid,nodev - fuse gcsfuse rw\n'
+    )
+    assert StorageConfig.is_mounted('/content/my bucket', mountinfo = str(mountinfo))
+    assert StorageConfig.is_mounted('/content/my bucket/', mountinfo = str(mountinfo))
+    assert StorageConfig.is_mounted('/', mountinfo = str(mountinfo))
+    assert not StorageConfig.is_mounted('/content/my\\040bucket', mountinfo = str(mountinfo))
+    assert not StorageConfig.is_mounted('/content', mountinfo = str(mountinfo))
+    assert not StorageConfig.is_mounted('/content', mountinfo = str(tmp_path.joinpath('missing')))
+
+
+def test_stat(tmp_path):
+    assert Mounts.stat(str(tmp_path), timeout = 1.0)
+    assert not Mounts.stat(str(tmp_path.joinpath('missing')), timeout = 1.0)
+
+
+def test_stat_times_out_on_a_hung_mount(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(mounts.os, 'stat', lambda path: release.wait())
+    start = time.perf_counter()
+    try:
+        assert not Mounts.stat('/content/hung', timeout = 0.2)
+        assert time.perf_counter() - start < 1.0
+        # The stuck stat is left in a daemon thread, which doesn't hold up interpreter exit
+        stuck = [t for t in threading.enumerate() if t.name == 'InletsColab-Stat-/content/hung']
+        assert stuck and all(t.daemon for t in stuck)
+    finally: release.set()
@@ -0,0 +1,56 @@
+import asyncio
+from inletscolab.proxy import ReverseProxy
+
+""" The reverse proxy against a backend that drops its keep-alive connections """
+
+
+async def flaky_backend(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """ Answers the first request on each connection, then closes it on the next one, as an idle timeout racing a request would """
+    served = 0
+    while True:
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = [int(l.split(b':')[1]) for l in head.lower().split(b'\r\n') if l.startswith(b'content-length:')]
+        if length: await reader.readexactly(length[0])
+        if served: break
+        served += 1
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: 2\r\n\r\nok')
+        await writer.drain()
+    writer.close()
+
+
+async def request(port: int, raw: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(raw)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = [int(l.split(b':')[1]) for l in head.lower().split(b'\r\n') if l.startswith(b'content-length:')]
+    body = await reader.readexactly(length[0]) if length else b''
+    writer.close()
+    return head.split(b'\r\n', 1)[0] + b' ' + body
+
+
+async def run(second: bytes):
+    backend = await asyncio.start_server(flaky_backend, '127.0.0.1', 0)
+    proxy = await ReverseProxy(host = '127.0.0.1', port = 0, backend_host = '127.0.0.1', backend_port = backend.sockets[0].getsockname()[1]).start()
+    try:
+        first = await request(proxy.port, b'GET /a HTTP/1.1\r\nHost: x\r\n\r\n')
+        return first, await request(proxy.port, second), proxy.stats
+    finally:
+        await proxy.stop()
+        backend.close()
+
+
+def test_get_is_retried_on_a_fresh_connection():
+    first, second, stats = asyncio.run(run(b'GET /b HTTP/1.1\r\nHost: x\r\n\r\n'))
+    assert first == second == b'HTTP/1.1 200 OK ok'
+    assert stats['retries'] == 1
+    assert stats['backend_connections'] == 2
+    assert stats['bad_gateway'] == 0
+
+
+def test_request_with_body_gets_bad_gateway():
+    first, second, stats = asyncio.run(run(b'POST /b HTTP/1.1\r\nHost: x\r\nContent-Length: 4\r\n\r\ndata'))
+    assert first == b'HTTP/1.1 200 OK ok'
+    assert second == b'HTTP/1.1 502 Bad Gateway Bad Gateway'
+    assert stats['retries'] == 0
+    assert stats['bad_gateway'] == 1
@@ -0,0 +1,86 @@
+import copy
+import socket
+import asyncio
+import threading
+import pytest
+from inletscolab.config import WatchdogConfig
+from inletscolab.watchdog import Watchdog
+from inletscolab.proxy import ReverseProxy
+from inletscolab.bench import EchoUpstream, WatchdogBench
+
+""" The Watchdog against the local relay stand-in for the inlets tunnel """
+
+
+@pytest.fixture(autouse=True)
+def watchdog(monkeypatch):
+    monkeypatch.setattr(Watchdog, 'stats', copy.deepcopy(Watchdog.stats))
+    monkeypatch.setattr(Watchdog, 'first_failure', None)
+    monkeypatch.setattr(WatchdogConfig, 'timeout', 0.5)
+    monkeypatch.setattr(WatchdogConfig, 'reconnect_timeout', 2.0)
+    return Watchdog
+
+
+@pytest.fixture()
+def loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield lambda coro: asyncio.run_coroutine_threadsafe(coro, loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5.0)
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.parametrize('mode', ['tcp', 'http'])
+def test_detects_a_stall_and_reconnects(mode):
+    interval, failures, reconnect_delay = 0.05, 3, 0.2
+    result = WatchdogBench.run(trials = 2, mode = mode, interval = interval, timeout = 0.2, failures = failures, reconnect_delay = reconnect_delay)
+    assert Watchdog.stats['reconnects'] == 2
+    assert Watchdog.stats['failed_reconnects'] == 0
+    # Each of the failed probes waits out its timeout after the interval
+    assert result['detect_p50_s'] >= failures * interval
+    assert reconnect_delay <= result['reconnect_p50_s'] < WatchdogConfig.reconnect_timeout
+    assert len(Watchdog.stats['reconnect_times']) == 2
+
+
+def test_reconnects_after_failures_in_a_row(monkeypatch):
+    monkeypatch.setattr(WatchdogConfig, 'failures', 3)
+    monkeypatch.setattr(WatchdogConfig, 'reconnect_timeout', 0.2)
+    restarts = []
+    url = f'http://127.0.0.1:{closed_port()}{WatchdogConfig.path}'
+    for _ in range(2): assert not Watchdog.check(url, lambda: restarts.append(1))
+    assert not restarts
+    assert Watchdog.stats['streak'] == 2
+    Watchdog.check(url, lambda: restarts.append(1))
+    assert restarts == [1]
+    # The tunnel never came back, so the next reconnect waits for a fresh streak
+    assert Watchdog.stats['failed_reconnects'] == 1
+    assert Watchdog.stats['streak'] == 0
+    assert Watchdog.stats['last_detection'] > 0
+
+
+def test_probe_requires_the_nonce(loop):
+    upstream = loop(EchoUpstream('127.0.0.1', 0).start())
+    try:
+        base = f'http://127.0.0.1:{upstream.port}'
+        assert Watchdog.probe(base + WatchdogConfig.path) is not None
+        # Any other host answering 200, i.e. the Server or an inlets default host, does not prove the tunnel reached this VM
+        assert Watchdog.probe(base + '/echo') is None
+        assert Watchdog.probe(f'http://127.0.0.1:{closed_port()}{WatchdogConfig.path}') is None
+    finally: loop(upstream.stop())
+
+
+def test_passthrough_proxy_answers_probes(loop):
+    upstream = loop(EchoUpstream('127.0.0.1', 0).start())
+    proxy = loop(ReverseProxy(host = '127.0.0.1', port = 0, backend_host = '127.0.0.1', backend_port = upstream.port, transform = False).start())
+    try:
+        assert Watchdog.probe(f'http://127.0.0.1:{proxy.port}{WatchdogConfig.path}') is not None
+        assert proxy.stats['backend_connections'] == 0
+    finally:
+        loop(proxy.stop())
+        loop(upstream.stop())